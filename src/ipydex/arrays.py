@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains a watched numpy array (in the spirit of `SurveiledDict` and `add_watchpoints`): writes are
+checked by a vectorized condition and IPS is opened in the writing frame if the condition holds.
+
+typical use case:
+
+from ipydex.arrays import watch_array, has_nan, out_of_bounds
+
+x = watch_array(np.zeros(10**6), condition=has_nan)
+...
+x[100:200] = some_computation()  # opens IPS here if NaNs are written
+x /= y                           # also for in-place ufuncs
+"""
+
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    msg = "This functionality depends on the package numpy. Please run `pip install numpy`"
+    raise ImportError(msg)
+
+from .core import _ips_in_writing_frame
+
+
+def _is_inexact(values):
+    # only float and complex values can be NaN or infinite (np.isnan raises TypeError e.g. for object arrays)
+    return np.asarray(values).dtype.kind in "fc"
+
+
+def has_nan(values):
+    return _is_inexact(values) and np.isnan(values).any()
+
+
+def has_nonfinite(values):
+    return _is_inexact(values) and not np.isfinite(values).all()
+
+
+def out_of_bounds(lower=None, upper=None):
+    """
+    Return a condition which holds if a written value is smaller than `lower` or greater than `upper`.
+    (NaN values do not violate the bounds; combine with `has_nan` if necessary).
+    """
+
+    def condition(values):
+        if lower is not None and (values < lower).any():
+            return True
+        if upper is not None and (values > upper).any():
+            return True
+        return False
+
+    return condition
+
+
+class WatchedArray(np.ndarray):
+    """
+    ndarray subclass which evaluates `condition(written_values)` after every write via `__setitem__`, `fill` or
+    a ufunc with `out=` (which includes the in-place operators like `+=`). Only the written part of the array is
+    passed to the condition. Thus the checking costs scale with the size of the write, not with the size of the
+    array.
+
+    Views (slices) of a watched array are watched too. Results of non-inplace operations (like `x + 1`) are
+    ordinary arrays. Writes via other routes (e.g. `np.copyto`, `x.sort()`, raw buffers) are not checked.
+    """
+
+    def __new__(cls, input_array, condition=has_nan, action=None):
+        """
+        :param input_array:     array_like (an ndarray is not copied)
+        :param condition:       callable(values) -> bool
+        :param action:          optional callable(frame, array, index, values); default: open IPS in the
+                                writing frame
+        """
+        obj = np.asarray(input_array).view(cls)
+        obj._watch_condition = condition
+        obj._watch_action = action
+        return obj
+
+    def __array_finalize__(self, obj):
+        self._watch_condition = getattr(obj, "_watch_condition", None)
+        self._watch_action = getattr(obj, "_watch_action", None)
+
+    def _check(self, values, index, frame):
+        if self._watch_condition is not None and self._watch_condition(values):
+            action = self._watch_action or _ips_in_writing_frame
+            action(frame, self, index, values)
+
+    def __setitem__(self, index, value):
+        plain = self.view(np.ndarray)
+        plain[index] = value
+        if self._watch_condition is None:
+            return
+
+        written = plain[index]
+        if (
+            isinstance(value, WatchedArray) and written.shape == value.shape
+            and written.__array_interface__["data"] == value.__array_interface__["data"]
+            and written.strides == value.strides
+        ):
+            # write back of an in-place operation on a view (`x[a:b] += 1`) -> already checked in __array_ufunc__
+            return
+        self._check(written, index, sys._getframe(1))
+
+    def fill(self, value):
+        self.view(np.ndarray).fill(value)
+        self._check(self.view(np.ndarray), "fill", sys._getframe(1))
+
+    def __array_ufunc__(self, ufunc, method, *inputs, out=None, **kwargs):
+        args = [x.view(np.ndarray) if isinstance(x, WatchedArray) else x for x in inputs]
+        if out is not None:
+            kwargs["out"] = tuple(x.view(np.ndarray) if isinstance(x, WatchedArray) else x for x in out)
+
+        results = getattr(ufunc, method)(*args, **kwargs)
+
+        # note: ufuncs are called from C -> the caller of __array_ufunc__ is the writing frame
+        if method == "at":
+            # unbuffered in-place operation on inputs[0] at the indices inputs[1]
+            target = inputs[0]
+            if isinstance(target, WatchedArray):
+                target._check(args[0][inputs[1]], ufunc.__name__ + ".at", sys._getframe(1))
+            return results
+
+        if out is None:
+            return results
+
+        for arr, plain in zip(out, kwargs["out"]):
+            if isinstance(arr, WatchedArray):
+                arr._check(plain, ufunc.__name__, sys._getframe(1))
+        return out[0] if len(out) == 1 else out
+
+
+def watch_array(arr, condition=has_nan, action=None):
+    """
+    Return a watched view of `arr` (see `WatchedArray`; no data is copied).
+
+    Use `x.view(np.ndarray)` to obtain an unwatched view.
+    """
+    return WatchedArray(arr, condition=condition, action=action)
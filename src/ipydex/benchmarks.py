@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains a reproducible benchmark suite for the latency critical paths of ipydex (import time,
+time to prompt of `IPS()` and `ips_excepthook`, traceback and frame formatting, displaytools).
+
+Interactive paths are driven non-interactively via pexpect (like in test/test_embed.py).
+
+typical use case (see also `ipydex bench --help`):
+
+from ipydex import benchmarks
+
+res = benchmarks.run_suite(repeat=5)
+benchmarks.write_json(res, "bench.json")
+"""
+
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+# problem sizes (can be overridden by the arguments of `run_suite`)
+DEFAULT_PARAMS = {"depth": 200, "cell_lines": 2000, "n_names": 50000}
+QUICK_PARAMS = {"depth": 50, "cell_lines": 200, "n_names": 5000}
+
+ipy_prompt = r"]:"
+
+
+class BenchmarkSkipped(Exception):
+    pass
+
+
+def percentile(sorted_samples, p):
+    """
+    Nearest-rank percentile of an already sorted sequence.
+    """
+    k = max(0, min(len(sorted_samples) - 1, math.ceil(p / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[k]
+
+
+def summarize(samples):
+    """
+    :param samples:     list of durations (seconds)
+    :return:            dict with n, min, mean, p50, p90, p99, max and the samples
+    """
+    s = sorted(samples)
+    return {
+        "n": len(s),
+        "min": s[0],
+        "mean": statistics.mean(s),
+        "p50": percentile(s, 50),
+        "p90": percentile(s, 90),
+        "p99": percentile(s, 99),
+        "max": s[-1],
+        "samples": samples,
+    }
+
+
+def _measure(func, repeat):
+    return timeit.repeat(func, number=1, repeat=repeat)
+
+
+def _recurse(n, func):
+    # synthetic deep stack
+    if n == 0:
+        return func()
+    return _recurse(n - 1, func)
+
+
+# ### in-process benchmarks
+
+
+def bench_generate_frame_list_info(repeat, depth, **kwargs):
+    from .core import generate_frame_list_info
+
+    def run():
+        return _measure(
+            lambda: generate_frame_list_info(sys._getframe(), code_context=1, theme_name="nocolor"), repeat
+        )
+
+    return _recurse(depth, run)
+
+
+def bench_traceback_formatting(repeat, depth, **kwargs):
+    """
+    Formatting part of `ips_excepthook` (TBPrinter) for a traceback with `depth` frames.
+    """
+    from .core import TBPrinter
+
+    def fail():
+        raise ValueError("deep")
+
+    try:
+        _recurse(depth, fail)
+    except ValueError as ex:
+        exc = ex
+
+    return _measure(lambda: TBPrinter(type(exc), exc, exc.__traceback__).get_tb_txt(), repeat)
+
+
+def make_big_cell(cell_lines):
+    lines = []
+    for i in range(cell_lines):
+        k = i % 4
+        if k == 0:
+            lines.append("x{0} = {0} ##:".format(i))
+        elif k == 1:
+            lines.append("y{0} = [x{1}, {0}] ##:T".format(i, i - 1))
+        elif k == 2:
+            lines.append("z{0} = x{1} + 1  # normal comment".format(i, i - 2))
+        else:
+            lines.append("w{0}, v{0} = {0}, {0} ##:i".format(i))
+    return "\n".join(lines)
+
+
+def bench_insert_disp_lines(repeat, cell_lines, **kwargs):
+    from .displaytools import insert_disp_lines
+
+    cell = make_big_cell(cell_lines)
+    return _measure(lambda: insert_disp_lines(cell), repeat)
+
+
+def bench_fetch_locals_large_namespace(repeat, n_names, **kwargs):
+    ns = {"var_{}".format(i): i for i in range(n_names)}
+    code = compile("import ipydex\n__c = ipydex.Container(fetch_locals=True)\n", "<bench>", "exec")
+    return _measure(lambda: exec(code, ns), repeat)
+
+
+# ### subprocess based benchmarks
+
+
+def _run_python(args, repeat):
+    from .utils import run_command
+
+    samples = []
+    for i in range(repeat):
+        res = run_command([sys.executable] + args)
+        if res.returncode != 0:
+            raise RuntimeError("benchmark command failed:\n" + res.stderr)
+        samples.append(res.duration)
+    return samples
+
+
+def bench_python_startup(repeat, **kwargs):
+    # reference value for `import_ipydex`
+    return _run_python(["-c", "pass"], repeat)
+
+
+def bench_import_ipydex(repeat, **kwargs):
+    return _run_python(["-c", "import ipydex"], repeat)
+
+
+_interactive_script = """
+import sys
+
+import ipydex
+
+mode = sys.argv[1]
+depth = int(sys.argv[2])
+n_names = int(sys.argv[3])
+sys.setrecursionlimit(max(1000, depth + 500))
+
+g = globals()
+for i in range(n_names):
+    g["var_%i" % i] = i
+
+
+def recurse(n):
+    if n == 0:
+        if mode == "ips":
+            print("BENCH-T0", flush=True)
+            ipydex.IPS(theme_name="nocolor")
+            return
+        raise ValueError("deep")
+    return recurse(n - 1)
+
+
+try:
+    recurse(depth)
+except ValueError as ex:
+    print("BENCH-T0", flush=True)
+    ipydex.ips_excepthook(type(ex), ex, ex.__traceback__)
+"""
+
+
+def _time_to_prompt(mode, repeat, depth, n_names, timeout=60):
+    """
+    Start the interactive script `repeat` times and measure the time from the call of `IPS()` or
+    `ips_excepthook` until the prompt appears.
+    """
+    try:
+        import pexpect
+        from pexpect.popen_spawn import PopenSpawn
+    except ImportError:
+        raise BenchmarkSkipped("pexpect is not available")
+
+    env = os.environ.copy()
+    env["IPY_TEST_SIMPLE_PROMPT"] = "1"
+
+    samples = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, "bench_interactive.py")
+        with open(fname, "w") as f:
+            f.write(_interactive_script)
+
+        for i in range(repeat):
+            p = PopenSpawn([sys.executable, fname, mode, str(depth), str(n_names)], env=env, timeout=timeout)
+            p.expect("BENCH-T0")
+            t0 = time.perf_counter()
+            p.expect(ipy_prompt)
+            samples.append(time.perf_counter() - t0)
+            p.sendline("exit")
+            p.expect(pexpect.EOF)
+    return samples
+
+
+def bench_ips_time_to_prompt(repeat, **kwargs):
+    return _time_to_prompt("ips", repeat, depth=10, n_names=0)
+
+
+def bench_ips_time_to_prompt_large_namespace(repeat, n_names, **kwargs):
+    return _time_to_prompt("ips", repeat, depth=10, n_names=n_names)
+
+
+def bench_excepthook_time_to_prompt(repeat, depth, **kwargs):
+    return _time_to_prompt("excepthook", repeat, depth=depth, n_names=0)
+
+
+BENCHMARKS = {
+    "python_startup": bench_python_startup,
+    "import_ipydex": bench_import_ipydex,
+    "ips_time_to_prompt": bench_ips_time_to_prompt,
+    "ips_time_to_prompt_large_namespace": bench_ips_time_to_prompt_large_namespace,
+    "excepthook_time_to_prompt": bench_excepthook_time_to_prompt,
+    "traceback_formatting": bench_traceback_formatting,
+    "generate_frame_list_info": bench_generate_frame_list_info,
+    "insert_disp_lines": bench_insert_disp_lines,
+    "fetch_locals_large_namespace": bench_fetch_locals_large_namespace,
+}
+
+
+def get_metadata():
+    import IPython
+    import ipydex
+
+    return {
+        "ipydex": ipydex.__version__,
+        "ipython": IPython.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run_suite(names=None, repeat=5, quick=False, print_res=True, **params):
+    """
+    Run (selected) benchmarks.
+
+    :param names:       optional sequence of benchmark names (see `BENCHMARKS`)
+    :param repeat:      number of samples per benchmark
+    :param quick:       bool; use small problem sizes (`QUICK_PARAMS`)
+    :param print_res:   bool; print a table
+    :param params:      optional problem sizes (depth, cell_lines, n_names)
+    :return:            dict {"meta": ..., "params": ..., "results": {name: summary}, "skipped": {name: reason}}
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError("unknown benchmark(s): {}".format(", ".join(sorted(unknown))))
+
+    all_params = dict(QUICK_PARAMS if quick else DEFAULT_PARAMS)
+    all_params.update(params)
+
+    res = {"meta": get_metadata(), "params": dict(all_params, repeat=repeat), "results": {}, "skipped": {}}
+    if print_res:
+        print_summary_header()
+    for name in names:
+        try:
+            samples = BENCHMARKS[name](repeat=repeat, **all_params)
+        except BenchmarkSkipped as ex:
+            res["skipped"][name] = str(ex)
+            continue
+        res["results"][name] = summarize(samples)
+        if print_res:
+            print_summary_line(name, res["results"][name])
+
+    if print_res:
+        for name, reason in res["skipped"].items():
+            print("{:<38} skipped ({})".format(name, reason))
+    return res
+
+
+def print_summary_header():
+    print("{:<38} {:>10} {:>10} {:>10} {:>10}".format("benchmark [ms]", "min", "p50", "p90", "p99"))
+
+
+def print_summary_line(name, summary):
+    print("{:<38} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+        name, *(1000 * summary[key] for key in ("min", "p50", "p90", "p99"))
+    ))
+
+
+def write_json(res, fname):
+    with open(fname, "w") as f:
+        json.dump(res, f, indent=2)
+
+
+def compare(res, reference):
+    """
+    Print the ratio of the medians of two benchmark results (e.g. of two releases).
+
+    :param res:         result of `run_suite`
+    :param reference:   result of `run_suite` or name of a json file
+    :return:            dict {name: ratio}
+    """
+    if isinstance(reference, str):
+        with open(reference) as f:
+            reference = json.load(f)
+
+    ratios = {}
+    print("\n{:<38} {:>10} {:>10} {:>8}".format("p50 [ms]", "reference", "current", "ratio"))
+    for name, summary in res["results"].items():
+        ref_summary = reference["results"].get(name)
+        if ref_summary is None:
+            continue
+        ratio = ratios[name] = summary["p50"] / ref_summary["p50"]
+        print("{:<38} {:>10.2f} {:>10.2f} {:>7.2f}x".format(
+            name, 1000 * ref_summary["p50"], 1000 * summary["p50"], ratio
+        ))
+    return ratios
@@ -2,35 +2,201 @@
 This module contains the entry points for command line scripts, see pyproject.toml.
 """
 
+import io
+import os
 import sys
+import tokenize
 import ipydex
 
 def main():
     print("ipydex running")
 
 
+# {connection_file: BlockingKernelClient}; reused by subsequent calls from the same process
+_kernel_clients = {}
+
+
+_catch_template = """\
+try:
+{body}
+except Exception as ex:
+    import ipydex
+    ipydex.ips_excepthook(type(ex), ex, ex.__traceback__)
+    del ex
+"""
+
+
+def get_kernel_client(connection=None, timeout=10):
+    """
+    Return a connected (and cached) client for an existing kernel.
+
+    :param connection:  connection file, kernel id (or a part of it) or None (most recently started kernel)
+    :param timeout:     time in seconds to wait for the kernel to be ready
+    """
+    from jupyter_client import BlockingKernelClient, find_connection_file
+
+    connection_file = find_connection_file(connection) if connection else find_connection_file()
+    client = _kernel_clients.get(connection_file)
+    if client is None or not client.channels_running:
+        client = BlockingKernelClient()
+        client.load_connection_file(connection_file)
+        client.start_channels()
+        client.wait_for_ready(timeout=timeout)
+        _kernel_clients[connection_file] = client
+    return client
+
+
+def close_kernel_clients():
+    for client in _kernel_clients.values():
+        client.stop_channels()
+    _kernel_clients.clear()
+
+
+def make_snippet(code=None, function=None, module=None):
+    """
+    Return the source of a snippet which runs a code string, a function or a module.
+
+    :param code:        python source code
+    :param function:    name of a function in the kernel namespace or "package.module:function"
+                        (called without arguments)
+    :param module:      name of a module which is executed like `python -m <module>`
+    """
+    if code is not None:
+        return code
+    if function is not None:
+        if ":" in function:
+            mod_name, func_name = function.split(":", 1)
+            return "import importlib\nimportlib.import_module({!r}).{}()".format(mod_name, func_name)
+        return "{}()".format(function)
+    if module is not None:
+        return "import runpy\nrunpy.run_module({!r}, run_name='__main__')".format(module)
+    raise ValueError("One of `code`, `function` or `module` must be given")
+
+
+def _string_continuation_lines(source):
+    """
+    Return the (1-based) numbers of the lines which begin inside a multi-line string literal.
+    """
+    res = set()
+    fstring_start = getattr(tokenize, "FSTRING_START", None)
+    fstring_end = getattr(tokenize, "FSTRING_END", None)
+    # start lines of the (possibly nested) f-strings (python >= 3.12)
+    fstring_rows = []
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(source).readline):
+            if tok.type == tokenize.STRING:
+                res.update(range(tok.start[0] + 1, tok.end[0] + 1))
+            elif tok.type == fstring_start:
+                fstring_rows.append(tok.start[0])
+            elif tok.type == fstring_end:
+                res.update(range(fstring_rows.pop() + 1, tok.end[0] + 1))
+    except (tokenize.TokenError, SyntaxError):
+        # invalid code -> the kernel reports the error
+        pass
+    return res
+
+
+def _reindent(source, prefix):
+    """
+    Remove the common indentation of the code lines and prepend `prefix` to them. Lines which begin inside a
+    multi-line string literal are not changed (unlike `textwrap.dedent`/`textwrap.indent`), i.e. the values of the
+    strings are kept.
+    """
+    lines = source.split("\n")
+    in_string = _string_continuation_lines(source)
+    indentations = [
+        line[:len(line) - len(line.lstrip())]
+        for i, line in enumerate(lines, 1) if i not in in_string and line.strip()
+    ]
+    margin = len(os.path.commonprefix(indentations)) if indentations else 0
+    res = []
+    for i, line in enumerate(lines, 1):
+        if i in in_string:
+            res.append(line)
+        elif line.strip():
+            res.append(prefix + line[margin:])
+        else:
+            res.append("")
+    return "\n".join(res)
+
+
+def wrap_snippet(snippet, excepthook=True):
+    """
+    Wrap the snippet such that exceptions are handled by `ips_excepthook` (inside the kernel).
+    """
+    snippet = _reindent(snippet.strip("\n"), "").rstrip() or "pass"
+    if not excepthook:
+        return snippet
+    return _catch_template.format(body=_reindent(snippet, "    "))
+
+
+def run_in_kernel(snippets, connection=None, excepthook=True, batch=True, timeout=None, stdin_hook=None):
+    """
+    Execute code snippets in an existing kernel (over a reused connection). Output is printed; input requests
+    of the kernel (e.g. from the IPython shell of `ips_excepthook`) are answered from the local terminal.
+
+    :param snippets:    str or sequence of str
+    :param connection:  see `get_kernel_client`
+    :param excepthook:  bool; handle exceptions with `ips_excepthook` (every snippet separately)
+    :param batch:       bool; send all snippets in one execute request (one round trip)
+    :param timeout:     optional timeout (seconds) per execute request
+    :param stdin_hook:  optional callable(input request message) which answers input requests via `client.input`
+                        (default: read from the local terminal)
+    :return:            list of reply contents (one per execute request)
+    """
+    if isinstance(snippets, str):
+        snippets = [snippets]
+
+    client = get_kernel_client(connection)
+    codes = [wrap_snippet(snippet, excepthook) for snippet in snippets]
+    if batch:
+        codes = ["\n".join(codes)]
+
+    replies = []
+    for code in codes:
+        reply = client.execute_interactive(code, timeout=timeout, allow_stdin=True, stdin_hook=stdin_hook)
+        replies.append(reply["content"])
+    return replies
+
+
 def catch():
     """
     execute a command in the context of an ipython kernel and catch exceptions with the ips_excepthook
     """
-    from jupyter_console.app import ZMQTerminalIPythonApp
+    import argparse
 
-    sys.argv = [sys.argv[0], "--existing"]
-    app = ZMQTerminalIPythonApp.instance()
-    app.initialize(None)
-    super(ZMQTerminalIPythonApp, app).start()
+    parser = argparse.ArgumentParser(
+        prog="ipydex_catch",
+        description="Run code in an existing ipython kernel and catch exceptions with ips_excepthook.",
+    )
+    parser.add_argument(
+        "-c", "--code", dest="snippets", action="append", type=lambda x: make_snippet(code=x),
+        help="code string (can be given multiple times)",
+    )
+    parser.add_argument(
+        "-f", "--function", dest="snippets", action="append", type=lambda x: make_snippet(function=x),
+        help="function name in the kernel namespace or 'package.module:function'",
+    )
+    parser.add_argument(
+        "-m", "--module", dest="snippets", action="append", type=lambda x: make_snippet(module=x),
+        help="module which is executed like `python -m <module>`",
+    )
+    parser.add_argument(
+        "--existing", metavar="CONNECTION", default=None,
+        help="connection file or kernel id (default: most recently started kernel)",
+    )
+    parser.add_argument("--batch", action="store_true", help="submit all snippets in one execute request")
+    parser.add_argument("--no-excepthook", action="store_true", help="do not wrap the snippets")
+    parser.add_argument("--timeout", type=float, default=None, help="timeout per execute request (seconds)")
 
-    code = """
-    import ipydex
-    import traceback
-    try:
-        failing_function()
-    except Exception as ex:
-        value, tb = traceback._parse_value_tb(ex, traceback._sentinel, traceback._sentinel)
-        ipydex.ips_excepthook(type(ex), ex, tb)
-    """.replace("\n    ", "\n")
+    args = parser.parse_args(sys.argv[1:])
+    snippets = args.snippets or [make_snippet(function="failing_function")]
 
-    app.shell.run_cell(code)
+    replies = run_in_kernel(
+        snippets, connection=args.existing, excepthook=not args.no_excepthook, batch=args.batch,
+        timeout=args.timeout,
+    )
+    close_kernel_clients()
 
-    if 0:
-        ipydex.IPS()
+    if any(reply.get("status") != "ok" for reply in replies):
+        sys.exit(1)
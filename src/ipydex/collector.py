@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains a collector for crash snapshots of many (worker) processes.
+
+Instead of opening IPS (which needs a TTY) or writing one log file per process, the exception hook sends a
+compact, bounded snapshot (traceback and truncated reprs of the locals) to a collector daemon (unix socket or
+local TCP port). The collector deduplicates the snapshots by an exception fingerprint. Later a developer can list
+them and open an IPython shell with the recorded namespace of any frame.
+
+typical use case:
+
+# terminal 1:
+ipydex collector serve
+
+# worker processes (or set the environment variable IPYDEX_COLLECTOR=1 and use `activate_ips_on_exception()`):
+from ipydex import collector
+collector.install_hook()
+
+# terminal 2 (later):
+ipydex collector list
+ipydex collector view <fingerprint>
+"""
+
+import collections
+import hashlib
+import json
+import linecache
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+
+# maximum size of one message (larger snapshots are shrunk by the client and rejected by the server)
+MAX_MESSAGE_BYTES = 2**20
+
+
+def default_address():
+    """
+    Return the address from the environment variable IPYDEX_COLLECTOR (if it contains an address)
+    or a unix socket in the temp directory.
+    """
+    address = os.environ.get("IPYDEX_COLLECTOR", "")
+    if address and address not in ("1", "True", "true"):
+        return address
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return "unix:" + os.path.join(tempfile.gettempdir(), "ipydex-collector-{}.sock".format(uid))
+
+
+def parse_address(address):
+    """
+    :param address:     "unix:<path>", "tcp:<host>:<port>" or None (see `default_address`)
+    :return:            (socket family, socket address)
+    """
+    if address is None:
+        address = default_address()
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    if address.startswith("tcp:"):
+        host, port = address[len("tcp:"):].rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    raise ValueError("invalid collector address: {} (expected unix:<path> or tcp:<host>:<port>)".format(address))
+
+
+# ### client side
+
+
+def fingerprint(exc_type, frames):
+    """
+    Fingerprint of an exception: hash of the exception type and the code locations of the traceback
+    (independent of the message, which often contains varying values).
+    """
+    parts = [exc_type] + ["{}:{}:{}".format(f["filename"], f["function"], f["lineno"]) for f in frames]
+    return hashlib.sha1("\n".join(parts).encode("utf8")).hexdigest()[:16]
+
+
+def make_snapshot(exc_type, exc_value, tb, max_frames=30, max_locals=30, max_repr=200, time_budget=None):
+    """
+    Create a compact, bounded (json-serializable) snapshot of an exception.
+
+    :param max_frames:  number of (innermost) frames which are included
+    :param max_locals:  number of local variables per frame
+    :param max_repr:    maximum length of the reprs of the local variables and of the message
+    :param time_budget: time (seconds) for the reprs of the local variables; afterwards only cheap builtin values
+                        are rendered (default: module_config.SAFE_REPR_TIME_BUDGET, see `SafeRepr`)
+    :return:            dict
+    """
+    from .core import SafeRepr
+
+    safe_repr = SafeRepr(max_len=max_repr, time_budget=time_budget).start()
+
+    frames = []
+    for frame, lineno in traceback.walk_tb(tb):
+        code = frame.f_code
+        frames.append((frame, code.co_filename, code.co_name, lineno))
+    n_omitted = max(0, len(frames) - max_frames)
+    frames = frames[n_omitted:]
+
+    frame_records = []
+    for frame, filename, function, lineno in frames:
+        local_items = list(frame.f_locals.items())
+        frame_records.append({
+            "filename": filename,
+            "function": function,
+            "lineno": lineno,
+            "line": linecache.getline(filename, lineno).strip(),
+            "locals": {name: safe_repr(value) for name, value in local_items[:max_locals]},
+            "n_locals": len(local_items),
+        })
+
+    exc_type_name = "{}.{}".format(exc_type.__module__, exc_type.__qualname__)
+    try:
+        message = str(exc_value)[:max_repr]
+    except Exception:
+        message = "<str failed>"
+    tb_lines = traceback.format_exception(exc_type, exc_value, tb, limit=-max_frames)
+
+    return {
+        "fingerprint": fingerprint(exc_type_name, frame_records),
+        "exc_type": exc_type_name,
+        "message": message,
+        "tb_txt": "".join(tb_lines)[-50 * max_repr:],
+        "frames": frame_records,
+        "n_omitted_frames": n_omitted,
+        "n_skipped_reprs": safe_repr.n_skipped,
+        "pid": os.getpid(),
+        "host": socket.gethostname(),
+        "argv": sys.argv[:10],
+        "time": time.time(),
+    }
+
+
+def _encode(message):
+    data = json.dumps(message).encode("utf8") + b"\n"
+    if len(data) > MAX_MESSAGE_BYTES and message.get("frames"):
+        # drop the locals (and then frames) until the message fits
+        message = dict(message)
+        message["frames"] = [dict(f, locals={}) for f in message["frames"]]
+        data = json.dumps(message).encode("utf8") + b"\n"
+        while len(data) > MAX_MESSAGE_BYTES and message["frames"]:
+            message["frames"] = message["frames"][1:]
+            data = json.dumps(message).encode("utf8") + b"\n"
+    return data
+
+
+def _request(message, address=None, timeout=2.0, expect_reply=True):
+    family, sock_address = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(sock_address)
+        sock.sendall(_encode(message))
+        if not expect_reply:
+            return None
+        reader = sock.makefile("rb")
+        line = reader.readline(MAX_MESSAGE_BYTES + 1)
+    return json.loads(line.decode("utf8"))
+
+
+def send_snapshot(snapshot, address=None, timeout=0.5):
+    """
+    Send a snapshot to the collector. The calling thread is blocked at most `timeout` seconds (the transfer
+    happens in a daemon thread; errors are ignored).
+
+    :return:    True if the snapshot was delivered in time
+    """
+    res = []
+
+    def worker():
+        try:
+            _request({"cmd": "put", "snapshot": snapshot}, address=address, timeout=timeout)
+            res.append(True)
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=worker, name="ipydex-snapshot-sender", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return bool(res)
+
+
+def send_exception(exc=None, address=None, timeout=0.5, **kwargs):
+    """
+    Send a snapshot of `exc` (default: the exception which is currently handled) to the collector.
+    Useful in `except` blocks of worker functions (where sys.excepthook is not called).
+
+    :param kwargs:  passed to `make_snapshot`
+    :return:        True if the snapshot was delivered in time
+    """
+    if exc is None:
+        exc = sys.exc_info()[1]
+    snapshot = make_snapshot(type(exc), exc, exc.__traceback__, **kwargs)
+    return send_snapshot(snapshot, address=address, timeout=timeout)
+
+
+def install_hook(address=None, timeout=0.5, chain=True, **kwargs):
+    """
+    Install an excepthook which sends a snapshot to the collector.
+
+    :param address:     collector address (see `parse_address`)
+    :param timeout:     maximum time (seconds) which the crashing process waits for the delivery
+    :param chain:       bool; if True, call the previous excepthook afterwards (only if stdin is a TTY,
+                        otherwise the default python excepthook is used, which does not block)
+    :param kwargs:      passed to `make_snapshot`
+    """
+    previous_hook = sys.excepthook
+
+    def collector_excepthook(exc_type, exc_value, tb):
+        try:
+            delivered = send_snapshot(make_snapshot(exc_type, exc_value, tb, **kwargs), address, timeout)
+        except Exception:
+            delivered = False
+        if not delivered:
+            sys.stderr.write("ipydex: could not deliver the crash snapshot to the collector\n")
+        if chain and sys.stdin is not None and sys.stdin.isatty():
+            previous_hook(exc_type, exc_value, tb)
+        else:
+            sys.__excepthook__(exc_type, exc_value, tb)
+
+    sys.excepthook = collector_excepthook
+    return collector_excepthook
+
+
+# ### server side
+
+
+class SnapshotStore(object):
+    """
+    Deduplicating in-memory store {fingerprint: entry} (oldest fingerprints are evicted first) with an optional
+    append-only json-lines file which is loaded on startup. The file contains the full snapshot only for the first
+    occurrence of a fingerprint and small occurrence records ({fingerprint, time, host, pid}) for the repetitions.
+    """
+
+    def __init__(self, max_entries=1000, fname=None):
+        self.max_entries = max_entries
+        self.fname = fname
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        if fname is not None and os.path.exists(fname):
+            with open(fname) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if "exc_type" in record:
+                        self._add(record, persist=False)
+                    else:
+                        self._add_occurrence(record)
+
+    def add(self, snapshot):
+        with self.lock:
+            return self._add(snapshot, persist=True)
+
+    def _add(self, snapshot, persist):
+        fp = snapshot["fingerprint"]
+        entry = self.entries.get(fp)
+        if entry is None:
+            # store the full snapshot only once per fingerprint
+            entry = self.entries[fp] = {
+                "fingerprint": fp, "count": 0, "first_time": snapshot["time"], "snapshot": snapshot, "sources": []
+            }
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            record = snapshot
+        else:
+            record = {
+                "fingerprint": fp, "time": snapshot["time"], "host": snapshot.get("host"), "pid": snapshot.get("pid")
+            }
+        self._count(entry, record)
+        if persist and self.fname is not None:
+            with open(self.fname, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        return entry
+
+    def _add_occurrence(self, record):
+        entry = self.entries.get(record["fingerprint"])
+        if entry is not None:
+            self._count(entry, record)
+
+    @staticmethod
+    def _count(entry, record):
+        entry["count"] += 1
+        entry["last_time"] = record["time"]
+        source = "{}:{}".format(record.get("host"), record.get("pid"))
+        if source not in entry["sources"] and len(entry["sources"]) < 20:
+            entry["sources"].append(source)
+
+    def summary(self):
+        with self.lock:
+            return [
+                {
+                    "fingerprint": e["fingerprint"],
+                    "count": e["count"],
+                    "exc_type": e["snapshot"]["exc_type"],
+                    "message": e["snapshot"]["message"],
+                    "last_time": e["last_time"],
+                    "sources": list(e["sources"]),
+                }
+                for e in self.entries.values()
+            ]
+
+    def get(self, fingerprint_prefix):
+        with self.lock:
+            matches = [e for fp, e in self.entries.items() if fp.startswith(fingerprint_prefix)]
+        if len(matches) != 1:
+            return None
+        return matches[0]
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        store = self.server.store
+        line = self.rfile.readline(MAX_MESSAGE_BYTES + 1)
+        if not line or len(line) > MAX_MESSAGE_BYTES:
+            return
+        try:
+            message = json.loads(line.decode("utf8"))
+            cmd = message.get("cmd")
+            if cmd == "put":
+                entry = store.add(message["snapshot"])
+                reply = {"ok": True, "count": entry["count"]}
+            elif cmd == "list":
+                reply = {"ok": True, "entries": store.summary()}
+            elif cmd == "get":
+                entry = store.get(message["fingerprint"])
+                reply = {"ok": entry is not None, "entry": entry}
+            else:
+                reply = {"ok": False, "error": "unknown command: {}".format(cmd)}
+        except Exception as ex:
+            reply = {"ok": False, "error": repr(ex)}
+        self.wfile.write(json.dumps(reply).encode("utf8") + b"\n")
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class CollectorServer(object):
+    """
+    Collector daemon (threaded socket server).
+    """
+
+    def __init__(self, address=None, max_entries=1000, fname=None):
+        """
+        :param address:     "unix:<path>" or "tcp:<host>:<port>" (default: see `default_address`)
+        :param max_entries: maximum number of stored fingerprints
+        :param fname:       optional json-lines file for persistence
+        """
+        self.family, self.sock_address = parse_address(address)
+        self.store = SnapshotStore(max_entries=max_entries, fname=fname)
+
+        if self.family == socket.AF_UNIX:
+            if os.path.exists(self.sock_address):
+                self._remove_stale_socket()
+            self.server = _ThreadingUnixServer(self.sock_address, _Handler)
+            self.address = "unix:" + self.sock_address
+        else:
+            self.server = _ThreadingTCPServer(self.sock_address, _Handler)
+            # the port might have been chosen by the OS (port 0)
+            self.address = "tcp:{}:{}".format(*self.server.server_address[:2])
+        self.server.store = self.store
+        self._thread = None
+
+    def _remove_stale_socket(self):
+        """
+        Remove the socket file of a previous run (but not the socket of a running collector or any other file).
+        """
+        if not stat.S_ISSOCK(os.stat(self.sock_address).st_mode):
+            raise RuntimeError("{} exists and is not a socket".format(self.sock_address))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            try:
+                sock.connect(self.sock_address)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # nobody is listening
+                pass
+            else:
+                raise RuntimeError("another collector is already listening on unix:{}".format(self.sock_address))
+        os.unlink(self.sock_address)
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="ipydex-collector", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.sock_address):
+            os.unlink(self.sock_address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# ### viewer
+
+
+def list_snapshots(address=None, print_res=True):
+    reply = _request({"cmd": "list"}, address=address)
+    entries = reply["entries"]
+    if print_res:
+        for e in entries:
+            print("{}  {:>5}x  {}: {}  (last: {}, sources: {})".format(
+                e["fingerprint"], e["count"], e["exc_type"], e["message"][:60],
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["last_time"])), ", ".join(e["sources"][:3]),
+            ))
+    return entries
+
+
+def get_snapshot(fingerprint_prefix, address=None):
+    reply = _request({"cmd": "get", "fingerprint": fingerprint_prefix}, address=address)
+    if not reply["ok"]:
+        raise KeyError("no unique snapshot for fingerprint {}".format(fingerprint_prefix))
+    return reply["entry"]["snapshot"]
+
+
+def snapshot_namespace(snapshot, frame_index=-1):
+    """
+    Return the namespace of a recorded frame (values are `SnapshotRepr` strings) plus `__snapshot`
+    and `__frame_info`.
+    """
+    from .core import SnapshotRepr
+
+    frame_info = snapshot["frames"][frame_index]
+    ns = {name: SnapshotRepr(value) for name, value in frame_info["locals"].items()}
+    ns["__snapshot"] = snapshot
+    ns["__frame_info"] = frame_info
+    return ns
+
+
+def view_snapshot(snapshot, frame_index=-1):
+    """
+    Print the traceback of a snapshot and open an IPython shell with the recorded locals of a frame
+    (default: innermost frame). Note: the values are truncated reprs (`SnapshotRepr`), not the original objects.
+    """
+    from IPython.terminal.embed import InteractiveShellEmbed
+    from .core import DummyMod
+
+    if isinstance(snapshot, str):
+        snapshot = get_snapshot(snapshot)
+
+    frame_info = snapshot["frames"][frame_index]
+    header = "{}\n--- snapshot {} (pid {} on {}); frame: {} in {}:{} ---\n".format(
+        snapshot["tb_txt"], snapshot["fingerprint"], snapshot["pid"], snapshot["host"],
+        frame_info["function"], frame_info["filename"], frame_info["lineno"],
+    )
+    shell = InteractiveShellEmbed.instance()
+    shell(header=header, local_ns=snapshot_namespace(snapshot, frame_index), module=DummyMod())
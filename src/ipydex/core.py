@@ -3,12 +3,17 @@
 
 import collections
 import inspect
+import linecache
 import sys
 import os
 import tokenize as tk
 import io
 import pickle
+import reprlib
 import subprocess
+import threading
+import time
+import types
 import dataclasses
 import re as regex
 
@@ -111,6 +116,33 @@ module_config = dataclasses.dataclass()
 # module_config.COLOR_SCHEME = "linux"
 module_config.THEME_NAME = "linux"
 
+# snapshot policy for debug containers created internally (see `Container.fetch_locals`)
+module_config.DEBUG_FETCH_POLICY = "ref"
+# values which are larger (approximately) are not copied by the snapshot policies "weak" and "copy"
+module_config.SNAPSHOT_MAX_NBYTES = 1000000
+# backend of `shell.db` (used by `%store`) in the shells of ipydex:
+# "pickleshare" (IPython default, one file per key) or "sqlite" (one indexed file, see `ipydex.storedb`)
+module_config.STORE_BACKEND = "pickleshare"
+# optional file name for the "sqlite" backend (default: ipydex_store.sqlite in the IPython profile directory)
+module_config.STORE_DB_PATH = None
+# tracebacks: blocks of frames which repeat at least this often (recursion) are shown only once (0: disabled)
+module_config.COLLAPSE_MIN_REPEATS = 3
+# variables in Verbose tracebacks of ipydex (see `SafeRepr`): maximum length of a repr, time budget (seconds)
+# per traceback and (fully qualified) names of types whose repr is not called (expensive or lazy queries)
+module_config.SAFE_REPR_MAX_LEN = 200
+module_config.SAFE_REPR_TIME_BUDGET = 2.0
+module_config.SAFE_REPR_SKIP_TYPES = {
+    "pandas.core.frame.DataFrame",
+    "pandas.core.series.Series",
+    "polars.dataframe.frame.DataFrame",
+    "polars.series.series.Series",
+    "xarray.core.dataarray.DataArray",
+    "xarray.core.dataset.Dataset",
+    "pyspark.sql.dataframe.DataFrame",
+    "django.db.models.query.QuerySet",
+    "sqlalchemy.orm.query.Query",
+}
+
 
 class DummyMod(object):
     """A dummy module used for IPython's interactive module when
@@ -152,7 +184,7 @@ class InteractiveShellEmbedWithoutBanner(InteractiveShellEmbed):
 # noinspection PyPep8Naming
 def IPS(condition=True, frame=None, ns_extension=None, copy_namespaces=True, overwrite_globals=False,
         code_context=1, print_tb=True, add_context_for_latest=6, theme_name=None,
-        verbose=False):
+        verbose=False, release_namespaces=False, nav_frames=None, store_backend=None):
     """
 
     :param condition:           bool; if False return immediately (do not really run IPS)
@@ -164,6 +196,14 @@ def IPS(condition=True, frame=None, ns_extension=None, copy_namespaces=True, ove
     :param theme_name:          optional, one of ['nocolor', 'neutral', 'linux', 'lightbg']
     :param print_tb:            boolean or negative integer (number of printed last tracebacks)
     :param add_context_for_latest:
+    :param release_namespaces:  bool; if True, remove the names which were inserted into the local and global
+                                namespace of `frame` after the shell has been closed (prevents reference cycles
+                                frame -> namespace -> frame)
+    :param nav_frames:          optional list of frames (innermost first, like in `ips_excepthook`) which contains
+                                `frame`; inside the shell the magics `%up`, `%down` and `%frame N` switch between
+                                these frames (without restarting the shell)
+    :param store_backend:       optional backend of the `%store` magic ("pickleshare" or "sqlite");
+                                default: `module_config.STORE_BACKEND`
     :return:
 
     Starts IPython embedded shell. This is similar to IPython.embed() but with some
@@ -191,6 +231,9 @@ def IPS(condition=True, frame=None, ns_extension=None, copy_namespaces=True, ove
         overwrite_globals=overwrite_globals,
         verbose=verbose,
         theme_name=theme_name,
+        release_namespaces=release_namespaces,
+        nav_frames=nav_frames,
+        store_backend=store_backend,
     )
 
     if not frame:
@@ -222,8 +265,12 @@ def IPS(condition=True, frame=None, ns_extension=None, copy_namespaces=True, ove
     else:
         C.custom_header = ""
 
+    if nav_frames:
+        C.custom_header += "--- Use %up, %down and %frame N to move between the frames of the traceback ---\n"
+
     # noinspection PyUnresolvedReferences
     frame_list, frame_info_list = fli.frame_list, fli.frame_info_list
+
     # prevent IPython shell to be launched in IP-Notebook
 
     test_str = str(frame_info_list[0])
@@ -277,6 +324,11 @@ def _run_ips(frame_list, c):
     InteractiveShellEmbed.clear_instance()
     InteractiveShellEmbed._instance = None
 
+    # the stored variables are restored below (otherwise loading the extension would already restore them)
+    # note: an unset option is a (truthy) `LazyConfigValue` -> only an explicit True counts (IPython default: False)
+    autorestore = config.StoreMagics.get("autorestore", False) is True
+    config.StoreMagics.autorestore = False
+
     shell = InteractiveShellEmbed.instance(config=config)
 
     # Register the magic with the running shell
@@ -284,11 +336,24 @@ def _run_ips(frame_list, c):
         create_method_from_pasted_function, "line", "create_method_from_pasted_function"
     )
 
+    store_backend = getattr(c, "store_backend", None) or module_config.STORE_BACKEND
+    if store_backend == "sqlite":
+        from . import storedb
+        shell.db = storedb.get_store_db(shell, module_config.STORE_DB_PATH)
+    elif store_backend != "pickleshare":
+        raise ValueError("unknown store backend: {}".format(store_backend))
+
     # achieve that custom macros are loaded in interactive shell
     shell.run_line_magic("load_ext", "storemagic")
-    if config.StoreMagics.autorestore:
+    if autorestore and store_backend == "sqlite":
+        from IPython.extensions.storemagic import restore_aliases, restore_dhist
+        # one query for the autorestore subset (no directory listing)
+        ar_keys = storedb.restore_autorestore(shell)
+        restore_aliases(shell)
+        restore_dhist(shell)
+    elif autorestore:
         shell.run_line_magic("store", "-r")
-        ar_keys = [k.split("/")[-1] for k in shell.db.keys() if k.startswith("autorestore/")]
+        ar_keys = [k.split("/")[-1] for k in shell.db.keys("autorestore/*")]
     else:
         ar_keys = []
 
@@ -315,7 +380,9 @@ def _run_ips(frame_list, c):
 
         assert safe_keys.union(unsafe_keys) == l_keys
 
-        gns.update({k: lns[k] for k in safe_keys})
+        # remember what was inserted into gns (see `release_namespaces` below)
+        added_globals = {k: lns[k] for k in safe_keys}
+        gns.update(added_globals)
 
         if unsafe_keys and not c.overwrite_globals and c.verbose:
             c.custom_header += "following local keys have " \
@@ -340,22 +407,223 @@ def _run_ips(frame_list, c):
     else:
         # unexpected few frames or no copying desired:
         lns = {}
+        gns = {}
+        added_globals = {}
         dummy_module = None
 
+    navigator = None
+    if getattr(c, "nav_frames", None) and c.copy_namespaces and len(frame_list) >= 1:
+        navigator = FrameNavigator(shell, c.nav_frames, frame_list[-1], c.ns_extension, theme_name=c.theme_name)
+        navigator.register_magics()
+        # the navigator takes care of writing back the session namespaces into the visited frames
+        session_lns = dict(lns)
+    else:
+        session_lns = lns
+
     # now execute the shell
-    shell(header=c.custom_header, stack_depth=2, local_ns=lns, module=dummy_module)
+    shell(header=c.custom_header, stack_depth=2, local_ns=session_lns, module=dummy_module)
+
+    if navigator is not None:
+        active_lns = navigator.finish(session_lns, lns)
+    else:
+        active_lns = session_lns
 
     # if `diff_index` is not None it will be interpreted as index increment for the frame_list in the except hook
     # "__mu" means "move up"
-    diff_index = lns.get("__mu")
+    diff_index = active_lns.get("__mu")
     if not isinstance(diff_index, int):
         diff_index = None
+    elif navigator is not None:
+        # `__mu` is relative to the frame which was active when the shell was closed
+        diff_index += navigator.index - navigator.start_index
+
+    if getattr(c, "release_namespaces", False):
+        _release_namespaces(shell, lns, gns, added_globals, list(c.ns_extension.keys()) + ["__mu"])
 
     return diff_index
 
 
+class FrameNavigator(object):
+    """
+    Switches the namespaces of a running embedded shell between the frames of a traceback. This is used by the
+    magics `%up`, `%down` and `%frame N` in the shell of `ips_excepthook` (much faster than closing the shell and
+    relaunching `IPS` via `__mu`). History and shell state are kept. The session namespace of every visited frame
+    is kept too, i.e. variables defined in the shell are still available when returning to a frame.
+    """
+
+    def __init__(self, shell, frames, start_frame, ns_extension, code_context=5, theme_name=None):
+        """
+        :param shell:           InteractiveShellEmbed instance
+        :param frames:          list of frames (innermost first)
+        :param start_frame:     element of `frames` in which the shell is started
+        :param ns_extension:    dict of names which are inserted into the namespace of every visited frame
+        :param code_context:    number of source lines which are printed for the active frame
+        :param theme_name:      theme for the frame context
+        """
+        self.shell = shell
+        self.frames = frames
+        self.start_index = self.index = frames.index(start_frame)
+        self.ns_extension = ns_extension
+        self.code_context = code_context
+        self.theme_name = theme_name
+
+        # {index: session namespace}
+        self.namespaces = {}
+        self._embed_globals = None
+
+    def register_magics(self):
+        self.shell.register_magic_function(self.magic_up, "line", "up")
+        self.shell.register_magic_function(self.magic_down, "line", "down")
+        self.shell.register_magic_function(self.magic_frame, "line", "frame")
+
+    def magic_up(self, line=""):
+        """Move N (default: 1) frames up (towards the outermost caller)."""
+        self.switch(self.index + int(line.strip() or 1))
+
+    def magic_down(self, line=""):
+        """Move N (default: 1) frames down (towards the frame where the exception occurred)."""
+        self.switch(self.index - int(line.strip() or 1))
+
+    def magic_frame(self, line=""):
+        """Switch to frame N (0: frame where the exception occurred); without argument: show the current frame."""
+        line = line.strip()
+        if not line:
+            self.print_frame()
+        else:
+            self.switch(int(line))
+
+    def print_frame(self):
+        frame = self.frames[self.index]
+        record, = format_frames([frame], code_context=self.code_context, theme_name=self.theme_name)
+        print("--- frame {} of {} (0: innermost) ---".format(self.index, len(self.frames) - 1))
+        print(record)
+
+    def switch(self, new_index):
+        if not 0 <= new_index < len(self.frames):
+            print("frame index out of range (0..{})".format(len(self.frames) - 1))
+            return
+
+        shell = self.shell
+        # save the state of the current frame
+        self.namespaces[self.index] = shell.user_ns
+        self._write_back(self.frames[self.index], shell.user_ns)
+        if self._embed_globals is not None:
+            self._embed_globals.sync_to_module()
+
+        self.index = new_index
+        frame = self.frames[new_index]
+        ns = self.namespaces.get(new_index)
+        if ns is None:
+            ns = {k: v for k, v in frame.f_locals.items() if k not in shell.user_ns_hidden}
+            ns.update(self.ns_extension)
+            if "__frame" in ns:
+                ns["__frame"] = frame
+            # the shell executes the code in this dict -> it is the namespace of the active frame until the next
+            # switch or the end of the session (see `finish`)
+            self.namespaces[new_index] = ns
+
+        # like `InteractiveShellEmbed.mainloop`
+        module = DummyMod()
+        module.__dict__ = frame.f_globals
+        shell.user_module = module
+        shell.user_ns = ns
+        shell.init_user_ns()
+
+        # IPython >= 9: globals with fallback to the local namespace (nested scopes can see the locals)
+        from IPython.terminal import embed
+        embed_globals_cls = getattr(embed, "_EmbedGlobals", None)
+        if embed_globals_cls is not None:
+            self._embed_globals = embed_globals_cls(frame.f_globals, ns)
+            shell.user_module = embed.make_main_module_type(self._embed_globals)()
+        shell.set_completer_frame()
+
+        self.print_frame()
+
+    def _write_back(self, frame, ns):
+        hidden = self.shell.user_ns_hidden
+        changes = {k: v for k, v in ns.items() if k not in hidden and k not in self.ns_extension and k != "__mu"}
+        try:
+            frame.f_locals.update(changes)
+        except (KeyError, ValueError, TypeError):
+            pass
+
+    def finish(self, session_lns, lns):
+        """
+        Write back the final session namespaces after the shell was closed.
+
+        On exit, `InteractiveShellEmbed.mainloop` merges the namespace of the active frame into `session_lns`.
+        Thus `session_lns` is only used if the start frame was never left. Otherwise each namespace is written
+        back only to its own frame.
+
+        :param session_lns:     namespace which was passed to the shell (updated by the shell on exit)
+        :param lns:             local namespace of the start frame
+        :return:                namespace of the frame which was active when the shell was closed
+        """
+        if self._embed_globals is not None:
+            self._embed_globals.sync_to_module()
+            self._embed_globals = None
+
+        hidden = self.shell.user_ns_hidden
+        start_ns = self.namespaces.get(self.start_index)
+        if start_ns is None:
+            # the start frame was never left
+            lns.update(session_lns)
+            active_ns = session_lns
+        else:
+            lns.update({k: v for k, v in start_ns.items() if k not in hidden})
+            active_ns = self.namespaces[self.index]
+            if self.index != self.start_index:
+                self._write_back(self.frames[self.index], active_ns)
+        self.namespaces.clear()
+        return active_ns
+
+
+def _release_namespaces(shell, lns, gns, added_globals, extra_keys):
+    """
+    Undo the namespace modifications of `_run_ips` (except for names which were (re)defined inside the shell)
+    and drop the references which the shell instance keeps to the namespaces of the last session.
+
+    :param shell:           InteractiveShellEmbed instance
+    :param lns:             local namespace (usually `frame.f_locals`)
+    :param gns:             global namespace (usually `frame.f_globals`)
+    :param added_globals:   dict of items which were copied from lns to gns
+    :param extra_keys:      keys which were inserted into lns (e.g. ns_extension)
+    """
+
+    for k, v in added_globals.items():
+        if gns.get(k, None) is v:
+            del gns[k]
+
+    for k in extra_keys:
+        try:
+            lns.pop(k, None)
+        except (KeyError, ValueError):
+            # e.g. FrameLocalsProxy (python >= 3.13) does not allow to remove real local variables
+            pass
+
+    # the embedded shell works on copies of lns and gns (its content has already been written back to lns);
+    # the completer still references them after the session
+    completer = getattr(shell, "Completer", None)
+    if completer is not None:
+        session_ns = completer.namespace
+        if session_ns is not lns and session_ns is not shell.user_ns:
+            session_ns.clear()
+
+        session_gns = completer.global_namespace
+        if session_gns is not gns and session_gns is not shell.user_global_ns:
+            # IPython >= 9 uses a snapshot of gns with a fallback to the local namespace (`_EmbedGlobals`)
+            for ns in (session_gns, getattr(session_gns, "_snapshot", None)):
+                if ns is None:
+                    continue
+                for k in list(added_globals.keys()) + list(extra_keys):
+                    ns.pop(k, None)
+
+        completer.namespace = shell.user_ns
+        completer.global_namespace = shell.user_global_ns
+
+
 # noinspection PyPep8Naming
-def ips_excepthook(excType, excValue, traceback, frame_upcount=0, leave_ut=False):
+def ips_excepthook(excType, excValue, traceback, frame_upcount=0, leave_ut=False, release_frames=True):
     """
     This function is launched after an exception. It launches IPS inside the suitable frame.
     Also note that if `__mu` is an integer in the local_ns of the closed IPS-Session then another session
@@ -368,6 +636,11 @@ def ips_excepthook(excType, excValue, traceback, frame_upcount=0, leave_ut=False
                         int; initial value for diff index; useful if this hook is called from outside
     :param leave_ut:    bool; if True the excepthook moves frame-wise upward until reaching a frame
                         outside the unittest module
+    :param release_frames:
+                        bool; if True (default) break the reference cycles between the frames of the
+                        traceback and the interactive namespaces and clear the locals of all finished frames
+                        after the last shell was closed. Otherwise these frames (and all their locals) stay
+                        alive (at least) until the next run of the garbage collector.
     :return:
     """
 
@@ -376,15 +649,10 @@ def ips_excepthook(excType, excValue, traceback, frame_upcount=0, leave_ut=False
     # first: print the traceback:
     tb_printer = TBPrinter(excType, excValue, traceback)
 
-    # go down the stack
-    tb = traceback
-    tb_frame_list = []
-    while tb.tb_next is not None:
-        tb_frame_list.append(tb.tb_frame)
-        tb = tb.tb_next
-
-    critical_frame = tb.tb_frame
-    tb_frame_list.append(critical_frame)
+    # go down the stack (repeated blocks of frames, e.g. of a RecursionError, are contained only once;
+    # `__mu` refers to this collapsed list like the printed traceback does)
+    tb_frame_list = tb_printer.collapsed.frames
+    critical_frame = tb_frame_list[-1]
 
     tb_frame_list.reverse()
     # now the first frame in the list is the critical frame where the exception occurred
@@ -417,30 +685,53 @@ def ips_excepthook(excType, excValue, traceback, frame_upcount=0, leave_ut=False
     def __ips_print_tb(**kwargs):
         return tb_printer.printout(end_offset=index, **kwargs)
 
+    # offer the history of local variables if an execution recorder is active (see `ipydex.monitoring`)
+    recorder = getattr(sys.modules.get("ipydex.monitoring"), "active_recorder", None)
+
     while diff_index is not None:
         index += diff_index
         tb_printer.printout(end_offset=index)
         print("\n")
         current_frame = tb_frame_list[index]
+        ns_extension = {"__ips_print_tb": __ips_print_tb, "__frame": current_frame, "__fl": tb_frame_list}
+        if recorder is not None:
+            ns_extension["__var_history"] = recorder.history
         diff_index = IPS(
             frame=current_frame,
-            ns_extension={"__ips_print_tb": __ips_print_tb, "__frame": current_frame, "__fl": tb_frame_list},
+            ns_extension=ns_extension,
             print_tb=False,
+            release_namespaces=release_frames,
+            nav_frames=tb_frame_list,
         )
 
+    if release_frames:
+        current_frame = critical_frame = None
+        tb_frame_list.clear()
+        tb_printer.traceback = tb_printer.collapsed = None
+        _clear_traceback_frames(traceback)
 
-def generate_frame_list_info(frame, code_context, add_context_for_latest=0, limit_to=0, theme_name=None):
-    res = Container()
-    if theme_name is None:
-        theme_name = module_config.THEME_NAME
-    TB = ultratb.FormattedTB(mode="Context", call_pdb=False, theme_name=theme_name)
-    res.frame_list, res.frame_info_list = get_frame_list(frame, code_context, add_context_for_latest)
 
-    # old Signature: TB.format_record(frame, file, lnum, func, lines, index)
+def _clear_traceback_frames(tb):
+    """
+    Clear the locals of all finished frames of a traceback (like `traceback.clear_frames`).
 
-    # formatted_records = [TB.format_record(frame, *fi) for fi in res.frame_info_list]
-    formatted_records = []
+    Frames which are still executing (e.g. the caller of `catch_exception`) are skipped.
+    """
 
+    while tb is not None:
+        frame = tb.tb_frame
+        try:
+            frame.clear()
+        except RuntimeError:
+            pass
+        else:
+            # python < 3.13: the cached snapshot `frame.f_locals` is not affected by `.clear()`;
+            # accessing the attribute synchronizes it with the (now empty) fast locals
+            frame.f_locals
+        tb = tb.tb_next
+
+
+def _get_stack_data_options(code_context):
     style = get_style_by_name("default")
     # style = stack_data.style_with_executing_node(style, "bg:ansiyellow")
     formatter = Terminal256Formatter(style=style)
@@ -450,6 +741,41 @@ def generate_frame_list_info(frame, code_context, add_context_for_latest=0, limi
             after=code_context // 2 ,
             pygments_formatter=formatter,
         )
+    return options
+
+
+def format_frames(frames, code_context=1, theme_name=None):
+    """
+    Format a list of (independent) frames like `generate_frame_list_info` does for a call stack.
+    This is useful for frames which are not connected via `f_back` (e.g. of suspended coroutines).
+
+    :return:    list of str (one formatted record per frame)
+    """
+    if theme_name is None:
+        theme_name = module_config.THEME_NAME
+    TB = ultratb.FormattedTB(mode="Context", call_pdb=False, theme_name=theme_name)
+    options = _get_stack_data_options(code_context)
+
+    formatted_records = []
+    for frame in frames:
+        fi_obj = ultratb.FrameInfo._from_stack_data_FrameInfo(stack_data.FrameInfo(frame, options=options))
+        formatted_records.append(TB.format_record(fi_obj))
+    return formatted_records
+
+
+def generate_frame_list_info(frame, code_context, add_context_for_latest=0, limit_to=0, theme_name=None):
+    res = Container()
+    if theme_name is None:
+        theme_name = module_config.THEME_NAME
+    TB = ultratb.FormattedTB(mode="Context", call_pdb=False, theme_name=theme_name)
+    res.frame_list, res.frame_info_list = get_frame_list(frame, code_context, add_context_for_latest)
+
+    # old Signature: TB.format_record(frame, file, lnum, func, lines, index)
+
+    # formatted_records = [TB.format_record(frame, *fi) for fi in res.frame_info_list]
+    formatted_records = []
+
+    options = _get_stack_data_options(code_context)
 
     fil = list(stack_data.FrameInfo.stack_data(frame, options=options))
 
@@ -470,15 +796,137 @@ def generate_frame_list_info(frame, code_context, add_context_for_latest=0, limi
     return res
 
 
-def calling_stack_info(print_res=True, code_context=1, **kwargs):
+FRAME_SUMMARY_FIELDS = ("filename", "function", "qualname", "module", "lineno", "code_context", "index", "locals", "frame")
+DEFAULT_FRAME_SUMMARY_FIELDS = ("filename", "function", "lineno", "code_context")
+
+
+def summarize_frames(frames, fields=DEFAULT_FRAME_SUMMARY_FIELDS, code_context=1):
+    """
+    Return a structured, formatting-free summary of frames (no pygments, stack_data or ultratb involved).
+
+    :param frames:          sequence of frames or of (frame, lineno) pairs (e.g. for tracebacks)
+    :param fields:          sequence of field names (see `FRAME_SUMMARY_FIELDS`); "code_context" is a list of
+                            source lines around the current line, "index" the position of the current line in it,
+                            "locals" and "frame" are references (no copies)
+    :param code_context:    number of source lines (distributed like in `generate_frame_list_info`)
+    :return:                list of dicts (order of `frames`)
+    """
+    unknown = set(fields) - set(FRAME_SUMMARY_FIELDS)
+    if unknown:
+        msg = "Unknown field(s): {}. Valid fields: {}".format(", ".join(sorted(unknown)), FRAME_SUMMARY_FIELDS)
+        raise ValueError(msg)
+
+    need_context = "code_context" in fields or "index" in fields
+    before = code_context - (code_context // 2)
+    after = code_context // 2
+
+    res = []
+    for frame in frames:
+        if isinstance(frame, tuple):
+            frame, lineno = frame
+        else:
+            lineno = frame.f_lineno
+        code = frame.f_code
+
+        values = {
+            "filename": code.co_filename,
+            "function": code.co_name,
+            "lineno": lineno,
+        }
+        if need_context:
+            if lineno is None or code_context <= 0:
+                values["code_context"], values["index"] = [], None
+            else:
+                first = max(1, lineno - before + 1)
+                lines = [linecache.getline(code.co_filename, i) for i in range(first, lineno + after + 1)]
+                values["code_context"], values["index"] = lines, lineno - first
+
+        summary = {}
+        for field in fields:
+            if field in values:
+                summary[field] = values[field]
+            elif field == "qualname":
+                summary[field] = getattr(code, "co_qualname", code.co_name)
+            elif field == "module":
+                summary[field] = frame.f_globals.get("__name__")
+            elif field == "locals":
+                summary[field] = frame.f_locals
+            else:
+                summary[field] = frame
+        res.append(summary)
+    return res
+
+
+def stack_summary(frame=None, fields=DEFAULT_FRAME_SUMMARY_FIELDS, limit=None, code_context=1):
+    """
+    Structured summary of the call stack (outermost frame first, see `summarize_frames`).
+
+    :param frame:   start frame (default: the calling frame)
+    :param limit:   optional maximum number of (innermost) frames; the stack is only walked that far
+    """
+    if frame is None:
+        frame = inspect.currentframe().f_back
+
+    frames = []
+    while frame is not None and (limit is None or len(frames) < limit):
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return summarize_frames(frames, fields=fields, code_context=code_context)
+
+
+def traceback_summary(tb, fields=DEFAULT_FRAME_SUMMARY_FIELDS, limit=None, code_context=1):
+    """
+    Structured summary of a traceback (outermost frame first, see `summarize_frames`).
+
+    :param tb:      traceback object or exception
+    :param limit:   optional maximum number of (innermost) frames
+    """
+    if isinstance(tb, BaseException):
+        tb = tb.__traceback__
+    frames = []
+    while tb is not None:
+        frames.append((tb.tb_frame, tb.tb_lineno))
+        tb = tb.tb_next
+    if limit is not None:
+        frames = frames[-limit:] if limit > 0 else []
+    return summarize_frames(frames, fields=fields, code_context=code_context)
+
+
+def render_frame_summaries(summaries):
+    """
+    Plain text rendering (in the style of the `traceback` module) of the result of `summarize_frames`.
+    """
+    parts = []
+    for summary in summaries:
+        function = summary.get("qualname") or summary.get("function")
+        parts.append('  File "{}", line {}, in {}\n'.format(summary.get("filename"), summary.get("lineno"), function))
+        for i, line in enumerate(summary.get("code_context") or []):
+            marker = "-->" if i == summary.get("index") else "   "
+            parts.append("  {} {}\n".format(marker, line.rstrip()))
+    return "".join(parts)
+
+
+def calling_stack_info(print_res=True, code_context=1, structured=False, fields=DEFAULT_FRAME_SUMMARY_FIELDS,
+                       limit=None, **kwargs):
     """
     Debugging helper function. Can be called anywhere and returns (and optionally prints) a stacktrace
     :param print_res:
+    :param structured:  bool; if True, return the list of dicts of `stack_summary` (and print its plain
+                        rendering) instead of the highlighted text
+    :param fields:      fields of the structured summary (see `summarize_frames`)
+    :param limit:       maximum number of (innermost) frames of the structured summary
     :return:
     """
 
     start_frame = inspect.currentframe().f_back
 
+    if structured:
+        summaries = stack_summary(start_frame, fields=fields, limit=limit, code_context=code_context)
+        if print_res:
+            print(render_frame_summaries(summaries))
+        return summaries
+
     fil = generate_frame_list_info(start_frame, code_context=code_context, **kwargs)
 
     if print_res:
@@ -487,12 +935,387 @@ def calling_stack_info(print_res=True, code_context=1, **kwargs):
     return fil
 
 
+def get_coroutine_frames(coro):
+    """
+    Return the frames of a (suspended) coroutine and of all coroutines/generators it awaits
+    (outermost first).
+    """
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+
+def _task_label(task):
+    coro = task.get_coro()
+    return "{} ({})".format(task.get_name(), getattr(coro, "__qualname__", type(coro).__name__))
+
+
+def _select_tasks(tasks, task_filter):
+    if task_filter is None:
+        return list(tasks)
+    if callable(task_filter):
+        return [t for t in tasks if task_filter(t)]
+
+    import fnmatch
+    return [t for t in tasks if fnmatch.fnmatchcase(_task_label(t), "*{}*".format(task_filter))]
+
+
+def async_stack_info(loop=None, task_filter=None, limit=20, print_res=True, code_context=1, theme_name=None):
+    """
+    Debugging helper function (asyncio counterpart of `calling_stack_info`): return (and optionally print) the
+    stacks of the pending tasks of an event loop.
+
+    :param loop:        event loop (default: the running loop)
+    :param task_filter: optional; str (substring or fnmatch-pattern matched against "<task name> (<coro qualname>)")
+                        or callable (task -> bool)
+    :param limit:       maximum number of tasks which are rendered (filtering is cheap, rendering is not)
+    :param print_res:   bool
+    :return:            Container with attributes `tasks` (all selected tasks), `frame_lists` (one list per
+                        rendered task) and `tb_txt`
+    """
+    import asyncio
+
+    if loop is None:
+        loop = asyncio.get_running_loop()
+
+    tasks = [t for t in asyncio.all_tasks(loop) if not t.done()]
+    n_pending = len(tasks)
+    tasks = _select_tasks(tasks, task_filter)
+    tasks.sort(key=lambda t: t.get_name())
+
+    res = Container(tasks=tasks, frame_lists=[])
+    parts = []
+    for task in tasks[:limit]:
+        frames = get_coroutine_frames(task.get_coro())
+        res.frame_lists.append(frames)
+        parts.append("=== Task {} ===".format(_task_label(task)))
+        parts.extend(format_frames(frames, code_context=code_context, theme_name=theme_name))
+        parts.append("")
+
+    parts.append(
+        "{} pending tasks, {} selected, {} rendered".format(n_pending, len(tasks), len(res.frame_lists))
+    )
+    res.tb_txt = "\n".join(parts)
+
+    if print_res:
+        print(res.tb_txt)
+    return res
+
+
+def ips_in_task(task, depth=-1, **kwargs):
+    """
+    Open IPS in the frame of a suspended asyncio task.
+
+    :param task:    asyncio.Task or str (name of a pending task of the running loop)
+    :param depth:   index into the list of coroutine frames of the task (default: -1 -> innermost frame)
+    :param kwargs:  passed to IPS
+    """
+    import asyncio
+
+    if isinstance(task, str):
+        matching = [t for t in asyncio.all_tasks() if t.get_name() == task]
+        if not matching:
+            raise ValueError("No pending task with name '{}'.".format(task))
+        task = matching[0]
+
+    frames = get_coroutine_frames(task.get_coro())
+    if not frames:
+        raise ValueError("Task {} has no suspended frame.".format(_task_label(task)))
+
+    kwargs.setdefault("print_tb", False)
+    print("\n".join(format_frames(frames, theme_name=kwargs.get("theme_name"))))
+    return IPS(frame=frames[depth], **kwargs)
+
+
+def find_repeated_blocks(keys, min_repeats=3, max_period=50):
+    """
+    Cycle detection for a sequence of frames (e.g. of a `RecursionError`).
+
+    :param keys:        sequence of hashable keys, e.g. (code, lineno) for each frame (outermost first)
+    :param min_repeats: minimum number of consecutive repetitions of a block
+    :param max_period:  maximum length of a block
+    :return:            list of (start, period, repeats)
+    """
+    n = len(keys)
+    res = []
+    i = 0
+    while i < n:
+        best = None
+        for period in range(1, max_period + 1):
+            if i + period * min_repeats > n:
+                break
+            if keys[i + period] != keys[i]:
+                # cheap rejection
+                continue
+            block = keys[i:i + period]
+            repeats = 1
+            while keys[i + repeats * period:i + (repeats + 1) * period] == block:
+                repeats += 1
+            if repeats >= min_repeats and (best is None or period * repeats > best[1] * best[2]):
+                best = (i, period, repeats)
+        if best is None:
+            i += 1
+        else:
+            res.append(best)
+            i += best[1] * best[2]
+    return res
+
+
+class CollapsedTraceback(object):
+    """
+    Traceback in which repeated blocks of frames (see `find_repeated_blocks`) are only contained once.
+
+    Attributes:
+        tb:         traceback object (a new chain of the kept entries or the original traceback)
+        entries:    list of the kept traceback entries (outermost first)
+        markers:    {index in `entries`: description of the hidden frames before this entry}
+        n_hidden:   number of hidden frames
+    """
+
+    def __init__(self, tb, min_repeats=None, max_period=50):
+        if min_repeats is None:
+            min_repeats = module_config.COLLAPSE_MIN_REPEATS
+
+        all_entries = []
+        while tb is not None:
+            all_entries.append(tb)
+            tb = tb.tb_next
+
+        self.markers = {}
+        self.n_hidden = 0
+        blocks = []
+        if min_repeats:
+            keys = [(entry.tb_frame.f_code, entry.tb_lineno) for entry in all_entries]
+            blocks = find_repeated_blocks(keys, min_repeats=min_repeats, max_period=max_period)
+
+        if not blocks:
+            self.entries = all_entries
+            self.tb = all_entries[0] if all_entries else None
+            return
+
+        # keep the last repetition of every block (the innermost frame is the frame where the exception occurred)
+        self.entries = []
+        last = 0
+        for start, period, repeats in blocks:
+            self.entries.extend(all_entries[last:start])
+            hidden = period * (repeats - 1)
+            self.n_hidden += hidden
+            self.markers[len(self.entries)] = (
+                "[... {} frames hidden: the following {} frame(s) were repeated {} more times ...]".format(
+                    hidden, period, repeats - 1
+                )
+            )
+            last = start + period * repeats
+            self.entries.extend(all_entries[last - period:last])
+        self.entries.extend(all_entries[last:])
+
+        # build a new chain (from the innermost entry outwards)
+        tb = None
+        for entry in reversed(self.entries):
+            tb = types.TracebackType(tb, entry.tb_frame, entry.tb_lasti, entry.tb_lineno)
+        self.tb = tb
+
+    @property
+    def frames(self):
+        return [entry.tb_frame for entry in self.entries]
+
+    def insert_markers(self, tb_parts):
+        """
+        Prepend the markers to the formatted parts of the respective frames (in place). This keeps one part per
+        kept frame (which is relied on by `TBPrinter.get_tb_txt`). If the parts cannot be mapped to the frames
+        (e.g. because IPython omitted some frames) a summary is inserted before the exception message.
+        """
+        if not self.markers:
+            return tb_parts
+
+        n = len(self.entries)
+        frame_parts = tb_parts[-1 - n:-1]
+        aligned = len(tb_parts) > n and all(
+            os.path.basename(entry.tb_frame.f_code.co_filename) in part
+            for entry, part in zip(self.entries, frame_parts)
+        )
+        if aligned:
+            offset = len(tb_parts) - 1 - n
+            for idx, marker in self.markers.items():
+                tb_parts[offset + idx] = "    {}\n\n{}".format(marker, tb_parts[offset + idx])
+        else:
+            note = "[... {} repeated frames hidden ...]".format(self.n_hidden)
+            tb_parts.insert(len(tb_parts) - 1, note)
+        return tb_parts
+
+
+class SafeRepr(reprlib.Repr):
+    """
+    Bounded repr for the variables of Verbose tracebacks:
+
+    - reprlib-style truncation (also of the elements of containers) and a maximum length per value
+    - values of the types in `skip_types` (or of subclasses) are summarized without calling their repr
+    - after the time budget is used up (see `start`) no further reprs (except of cheap builtin types) are called,
+      also not for the elements of containers which are rendered when the deadline passes
+    - exceptions of `__repr__` are reported instead of propagated
+
+    Note: a single slow repr cannot be interrupted; the budget only protects against the sum of many.
+    """
+
+    def __init__(self, max_len=None, time_budget=None, skip_types=None):
+        super().__init__()
+        if max_len is None:
+            max_len = module_config.SAFE_REPR_MAX_LEN
+        if time_budget is None:
+            time_budget = module_config.SAFE_REPR_TIME_BUDGET
+        if skip_types is None:
+            skip_types = module_config.SAFE_REPR_SKIP_TYPES
+        self.max_len = max_len
+        self.maxstring = self.maxother = max_len
+        self.time_budget = time_budget
+        self.skip_types = set(skip_types)
+        # {type: bool}
+        self._skip_cache = {}
+        self.deadline = None
+        self.n_skipped = 0
+
+    def start(self):
+        """
+        (Re)start the time budget (e.g. for a new traceback).
+        """
+        self.deadline = self.clock() + self.time_budget
+        self.n_skipped = 0
+        return self
+
+    # source of the time for the budget (replaceable, e.g. by a fake clock)
+    clock = staticmethod(time.perf_counter)
+
+    # reprs of these types are cheap (and bounded by reprlib) -> they are also rendered after the deadline
+    cheap_types = (int, float, complex, bool, type(None), str, bytes)
+
+    def __call__(self, obj):
+        try:
+            res = self.repr(obj)
+        except Exception as ex:
+            res = "<{} object (repr failed: {})>".format(type(obj).__name__, type(ex).__name__)
+        if len(res) > self.max_len:
+            res = res[:self.max_len - 3] + "..."
+        return res
+
+    def repr1(self, x, level):
+        cls = type(x)
+        # checked for every (also nested) value
+        if self.deadline is not None and cls not in self.cheap_types and self.clock() > self.deadline:
+            self.n_skipped += 1
+            return "<repr skipped: time budget of {} s exceeded>".format(self.time_budget)
+        skip = self._skip_cache.get(cls)
+        if skip is None:
+            names = {"{}.{}".format(base.__module__, base.__qualname__) for base in cls.__mro__}
+            skip = self._skip_cache[cls] = not names.isdisjoint(self.skip_types)
+        if skip:
+            try:
+                shape = x.shape
+            except Exception:
+                shape = None
+            shape_str = " shape={}".format(tuple(shape)) if isinstance(shape, tuple) else ""
+            return "<{}{} (repr skipped)>".format(cls.__name__, shape_str)
+        return super().repr1(x, level)
+
+
+class _SafeReprValue(object):
+    """
+    Wrapper whose repr is rendered by a `SafeRepr` (see `CollapsingFormattedTB.format_record`).
+    """
+
+    __slots__ = ("value", "safe_repr")
+
+    def __init__(self, value, safe_repr):
+        self.value = value
+        self.safe_repr = safe_repr
+
+    def __repr__(self):
+        return self.safe_repr(self.value)
+
+
+class _SafeReprFrame(object):
+    """
+    The subset of a frame which is used by `inspect.getargvalues` (with wrapped values of the locals).
+    """
+
+    def __init__(self, frame, safe_repr):
+        self.f_code = frame.f_code
+        self.f_locals = {name: _SafeReprValue(value, safe_repr) for name, value in frame.f_locals.items()}
+
+
+class _SafeReprFrameInfo(ultratb.FrameInfo):
+    """
+    Copy of a `FrameInfo` whose arguments and variables are rendered by a `SafeRepr` when they are formatted by
+    `VerboseTB.format_record`.
+    """
+
+    def __init__(self, frame_info, safe_repr):
+        # no call of the base constructor (it might read the source again)
+        self.__dict__.update(frame_info.__dict__)
+        self.frame = _SafeReprFrame(frame_info.frame, safe_repr)
+        self.safe_repr = safe_repr
+
+    @property
+    def variables_in_executing_piece(self):
+        variables = super().variables_in_executing_piece
+        return [var._replace(value=_SafeReprValue(var.value, self.safe_repr)) for var in variables]
+
+
+class CollapsingFormattedTB(ultratb.FormattedTB):
+    """
+    `FormattedTB` which is used for the hooks of ipydex (`color_excepthook`, `ip_extra_syshook`):
+
+    - repeated blocks of frames (e.g. of a `RecursionError`) are formatted only once (see `CollapsedTraceback`)
+    - in Verbose mode the variables are rendered by a `SafeRepr` (bounded length and time)
+    """
+
+    # SafeRepr of the traceback which is currently formatted
+    _safe_repr = None
+
+    def structured_traceback(self, etype, evalue, etb=None, tb_offset=None, context=5):
+        if not self.include_vars:
+            return self._collapsed_structured_traceback(etype, evalue, etb, tb_offset, context)
+
+        # the reprs are replaced only for this instance (see `format_record`)
+        safe_repr = self._safe_repr = SafeRepr().start()
+        try:
+            tb_parts = self._collapsed_structured_traceback(etype, evalue, etb, tb_offset, context)
+        finally:
+            self._safe_repr = None
+        if safe_repr.n_skipped and tb_parts:
+            note = "[... {} reprs skipped because the time budget of {} s was exceeded ...]".format(
+                safe_repr.n_skipped, safe_repr.time_budget
+            )
+            tb_parts.insert(len(tb_parts) - 1, note)
+        return tb_parts
+
+    def format_record(self, frame_info):
+        safe_repr = self._safe_repr
+        if safe_repr is None or frame_info.frame is None or isinstance(frame_info._sd, stack_data.RepeatedFrames):
+            return super().format_record(frame_info)
+        return super().format_record(_SafeReprFrameInfo(frame_info, safe_repr))
+
+    def _collapsed_structured_traceback(self, etype, evalue, etb, tb_offset, context):
+        if etb is None or not module_config.COLLAPSE_MIN_REPEATS:
+            return super().structured_traceback(etype, evalue, etb, tb_offset, context)
+
+        collapsed = CollapsedTraceback(etb)
+        tb_parts = super().structured_traceback(etype, evalue, collapsed.tb, tb_offset, context)
+        return collapsed.insert_markers(tb_parts)
+
+
 class TBPrinter(object):
 
     def __init__(self, excType, excValue, traceback):
         self.excType = excType
         self.excValue = excValue
         self.traceback = traceback
+        # the frames of the traceback without repeated blocks (`__mu` refers to this list)
+        self.collapsed = CollapsedTraceback(traceback)
 
         self.TB = ultratb.FormattedTB(mode="Context", call_pdb=False, theme_name=module_config.THEME_NAME)
 
@@ -514,7 +1337,8 @@ class TBPrinter(object):
         :return:
         """
         # note that the kwarg `tb_offset` of the FormattedTB constructor is refers to the start of the list
-        tb_parts = self.TB.structured_traceback(self.excType, self.excValue, self.traceback)
+        tb_parts = self.TB.structured_traceback(self.excType, self.excValue, self.collapsed.tb)
+        tb_parts = self.collapsed.insert_markers(tb_parts)
         line_list = [prefix] + tb_parts[:len(tb_parts)-1-end_offset] + [tb_parts[-1]]
 
         if cut_logging:
@@ -550,7 +1374,7 @@ class TBPrinter(object):
         text = "\n".join(line_list)
 
         if debug:
-            return Container(fetch_locals=True)
+            return Container(fetch_locals=module_config.DEBUG_FETCH_POLICY)
 
         return text
 
@@ -566,6 +1390,12 @@ def activate_ips_on_exception(theme_name=None):
         # into an IP-Shell after an exception
         return
 
+    if os.environ.get("IPYDEX_COLLECTOR"):
+        # worker processes (without TTY): send a crash snapshot to the collector daemon (see ipydex.collector)
+        from .collector import install_hook
+        install_hook()
+        return
+
     # set the hook
     sys.excepthook = ips_excepthook
 
@@ -580,6 +1410,11 @@ def catch_exception(func, *args, **kwargs):
         import traceback
         value, tb = traceback._parse_value_tb(ex, traceback._sentinel, traceback._sentinel)
         ips_excepthook(type(ex), ex, tb)
+        del value, tb
+
+    # the excepthook might have created a snapshot of the locals of this frame (referring to `ex` and its
+    # traceback); synchronize it to break the reference cycle
+    inspect.currentframe().f_locals
 
 
 # based on https://github.com/jupyter/jupyter_client/issues/1004
@@ -601,7 +1436,7 @@ def color_excepthook(pdb=0, mode=2, force=True):
     modus = ['Plain', 'Context', 'Verbose'][mode] # select the mode
 
     if force or not sys.excepthook == sys_orig_excepthook:
-        sys.excepthook = ultratb.FormattedTB(mode=modus, call_pdb=pdb, theme_name=module_config.THEME_NAME)
+        sys.excepthook = CollapsingFormattedTB(mode=modus, call_pdb=pdb, theme_name=module_config.THEME_NAME)
 
 
 # for backward compatibility
@@ -632,9 +1467,9 @@ def ip_extra_syshook(fnc, pdb=0, filename=None):
         assert isinstance(filename, str)
         pdb = 0
 
-    ip_excepthook = ultratb.FormattedTB(mode="Verbose", call_pdb=pdb, theme_name=module_config.THEME_NAME)
+    ip_excepthook = CollapsingFormattedTB(mode="Verbose", call_pdb=pdb, theme_name=module_config.THEME_NAME)
 
-    fileTraceback = ultratb.FormattedTB(mode="Verbose", theme_name="nocolor", call_pdb=0)
+    fileTraceback = CollapsingFormattedTB(mode="Verbose", theme_name="nocolor", call_pdb=0)
 
     # define the new excepthook
     def theexecpthook (type, value, traceback):
@@ -702,54 +1537,169 @@ def ST():
 # Code below is jupyter notebook specific
 
 
-def get_notebook_name():
+# cache for `get_notebook_name`: {kernel_id: Container(server=..., session_id=..., path=...)}
+_notebook_name_cache = {}
+
+
+def _list_running_servers():
+    try:
+        from notebook.notebookapp import list_running_servers
+    except ImportError:
+        from jupyter_server.serverapp import list_running_servers
+    return list(list_running_servers())
+
+
+def _get_sessions_url(server, session_id=None):
+    from requests.compat import urljoin
+
+    if session_id is None:
+        return urljoin(server['url'], 'api/sessions')
+    return urljoin(server['url'], 'api/sessions/{}'.format(session_id))
+
+
+def _server_request(server, session_id=None, timeout=2.0):
+    """
+    Return the decoded json response of the sessions api of `server` or None (if the server is not reachable)
+    """
+    import requests
+
+    try:
+        response = requests.get(
+            _get_sessions_url(server, session_id), params={'token': server.get('token', '')}, timeout=timeout
+        )
+    except requests.RequestException:
+        return None
+
+    if response.status_code != 200:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def _session_to_path(server, session):
+    # old servers (notebook) use "notebook_dir", new ones (jupyter_server) "root_dir"
+    root_dir = server.get("root_dir", server.get("notebook_dir"))
+    relative_path = session.get('notebook', {}).get('path', session.get('path'))
+    return os.path.join(root_dir, relative_path)
+
+
+def _find_kernel_session(servers, kernel_id, timeout):
+    """
+    Query all servers concurrently and return (server, session) for the first match (or (None, None)).
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if not servers:
+        return None, None
+
+    executor = ThreadPoolExecutor(max_workers=len(servers))
+    try:
+        future_dict = {executor.submit(_server_request, ss, None, timeout): ss for ss in servers}
+        for future in as_completed(future_dict):
+            data = future.result() or []
+            for nn in data:
+                if nn['kernel']['id'] == kernel_id:
+                    return future_dict[future], nn
+    finally:
+        # do not wait for slow servers once we have the result
+        executor.shutdown(wait=False)
+
+    return None, None
+
+
+def get_notebook_name(kernel_id=None, servers=None, timeout=2.0, use_cache=True):
     """
     Return the full path of the jupyter notebook.
+
+    :param kernel_id:   optional; default: id of the running kernel
+    :param servers:     optional list of server-info-dicts (like the result of `list_running_servers()`)
+    :param timeout:     timeout (in seconds) for each http request
+    :param use_cache:   bool; if True, the result is cached per kernel id. Subsequent calls only re-validate
+                        the cached session with one request to the corresponding server.
     """
     # taken from https://github.com/jupyter/notebook/issues/1000#issuecomment-359875246
 
     try:
         import requests
-        from requests.compat import urljoin
     except ImportError:
         msg = "This functions depends on the module requests."
         # it is not an official dependency because this is not a core functionality
         raise ImportError(msg)
 
-    import ipykernel
-    import json
-    import re
-    try:
-        version = "old"
-        from notebook.notebookapp import list_running_servers
-    except ImportError:
-        version = "new"
-        from jupyter_server.serverapp import list_running_servers
+    if kernel_id is None:
+        kernel_id = get_kernel_id()
 
-    kernel_id = re.search('kernel-(.*).json',
-                          ipykernel.connect.get_connection_file()).group(1)
-    servers = list_running_servers()
-    for ss in servers:
-        response = requests.get(urljoin(ss['url'], 'api/sessions'),
-                                params={'token': ss.get('token', '')})
+    cached = _notebook_name_cache.get(kernel_id) if use_cache else None
+    if cached is not None:
+        session = _server_request(cached.server, cached.session_id, timeout)
+        if session is not None and session['kernel']['id'] == kernel_id:
+            # the notebook might have been renamed in the meantime
+            cached.path = _session_to_path(cached.server, session)
+            return cached.path
+        _notebook_name_cache.pop(kernel_id, None)
 
-        if response.status_code != 200:
-            continue
+    if servers is None:
+        servers = _list_running_servers()
 
-        data = json.loads(response.text)
+    server, session = _find_kernel_session(servers, kernel_id, timeout)
 
-        for nn in data:
+    if session is None:
+        msg = "Could not get access to any notebook server."
+        raise ValueError(msg)
 
-            if nn['kernel']['id'] == kernel_id:
-                relative_path = nn['notebook']['path']
+    path = _session_to_path(server, session)
+    if use_cache:
+        _notebook_name_cache[kernel_id] = Container(server=server, session_id=session['id'], path=path)
+    return path
 
-                if version == "old":
-                    return os.path.join(ss["notebook_dir"], relative_path)
-                else:
-                    return os.path.join(ss["root_dir"], relative_path)
 
-    msg = "Could not get access to any notebook server."
-    raise ValueError(msg)
+# result of `get_environment`, keyed by process id (a forked child must not inherit the result)
+_environment_cache = {}
+
+
+def _kernel_app_initialized():
+    kernelapp = sys.modules.get("ipykernel.kernelapp")
+    return kernelapp is not None and kernelapp.IPKernelApp.initialized()
+
+
+def get_environment(refresh=False):
+    """
+    Return a (cached) Container which describes the environment of this process:
+
+    - `.shell_class`: name of the class of the IPython shell which was active when probing (or None)
+    - `.zmq_kernel`: bool; True if the code runs inside a jupyter kernel (notebook, lab, qtconsole, ...)
+
+    Only the active shell and `sys.modules` are inspected (no stack walking). The result is cached
+    per process once it is definite.
+
+    :param refresh:     bool; if True, ignore the cache
+    """
+
+    pid = os.getpid()
+    res = _environment_cache.get(pid)
+    if res is not None and not refresh:
+        return res
+
+    shell_class = None
+    if "IPython" in sys.modules:
+        from IPython import get_ipython
+        shell = get_ipython()
+        if shell is not None:
+            shell_class = type(shell).__name__
+
+    zmq_kernel = "ipykernel" in sys.modules and shell_class == "ZMQInteractiveShell"
+
+    res = Container(shell_class=shell_class, zmq_kernel=zmq_kernel)
+
+    # a kernel process which has not yet created its shell is not definite -> do not cache
+    # (merely importing ipykernel, e.g. to start or connect to other kernels, does not matter)
+    if zmq_kernel or not _kernel_app_initialized():
+        _environment_cache.clear()
+        _environment_cache[pid] = res
+
+    return res
 
 
 def in_ipynb(debug=False):
@@ -757,64 +1707,106 @@ def in_ipynb(debug=False):
     Test whether this functions is called from within an ipython notebook on jupyter
     """
 
-    frame_info_list = get_frame_list()[1]
-    filenames = [fi.filename for fi in frame_info_list]
-
-    test_str = "\n".join(filenames)
-    # this should be made more reliable
-    if "ipykernel_launcher" in test_str and \
-       "ipykernel/kernelapp.py" in test_str and \
-       "zmqshell" in test_str:
-        res = True
-    else:
-        res = False
+    res = get_environment().zmq_kernel
 
     if debug:
-        dbgc = Container(fetch_locals=True)
+        dbgc = Container(fetch_locals=module_config.DEBUG_FETCH_POLICY)
         return dbgc
     else:
         return res
 
 
-def save_current_nb_as_html(info=None, return_res=False, fname=None):
+# exporter instances (including the compiled template) for `export_notebook_to_html`, keyed by template name
+_html_exporter_cache = {}
+_html_exporter_lock = threading.Lock()
+
+
+def _get_html_exporter(template_name):
     """
-    Save the current notebook as html file in the same directory
+    Return a cached `nbconvert.HTMLExporter` instance (raises ImportError if nbconvert is not available).
     """
-    assert in_ipynb()
+    exporter = _html_exporter_cache.get(template_name)
+    if exporter is None:
+        from nbconvert import HTMLExporter
+        exporter = HTMLExporter(template_name=template_name)
+        _html_exporter_cache[template_name] = exporter
+    return exporter
 
-    full_path = get_notebook_name()
-    path, src_filename = os.path.split(full_path)
 
-    wd_save = os.getcwd()
-    os.chdir(path)
-    cmd_list = ["jupyter", "nbconvert", src_filename, "--to", "html", "--template", "classic"]
+def export_notebook_to_html(nb_path, html_path=None, template_name="classic"):
+    """
+    Convert a notebook file to html without changing the working directory.
+
+    The conversion runs in-process with a cached exporter. Only if nbconvert cannot be imported a
+    `jupyter nbconvert` subprocess is started.
 
-    res = subprocess.run(cmd_list, capture_output=True)
-    res.exited = res.returncode
-    res.stdout = res.stdout.decode("utf8")
-    res.stderr = res.stderr.decode("utf8")
+    :param nb_path:         path of the .ipynb file
+    :param html_path:       optional target path (default: same directory and basename as `nb_path`);
+                            relative paths refer to the directory of the notebook
+    :param template_name:   nbconvert template
+    :return:                Container with attributes `returncode`, `stdout`, `stderr`, `fname`, `method`
+    """
 
     suffix = ".ipynb"
-    html_filename = src_filename[:-len(suffix)] + ".html"
-    assert src_filename.endswith(suffix)
-    assert os.path.isfile(html_filename)
+    assert nb_path.endswith(suffix)
+    path, src_filename = os.path.split(os.path.abspath(nb_path))
+    default_html_path = os.path.join(path, src_filename[:-len(suffix)] + ".html")
 
-    if fname:
-        import shutil
-        shutil.move(html_filename, fname)
+    if html_path is None:
+        html_path = default_html_path
     else:
-        fname = html_filename
-    res.fname = html_filename
+        html_path = os.path.join(path, html_path)
+
+    try:
+        exporter = _get_html_exporter(template_name)
+    except ImportError:
+        exporter = None
+
+    if exporter is not None:
+        import nbformat
+
+        nb = nbformat.read(nb_path, as_version=4)
+        resources = {"metadata": {"path": path, "name": src_filename[:-len(suffix)]}}
+        with _html_exporter_lock:
+            body, _ = exporter.from_notebook_node(nb, resources=resources)
+        with open(html_path, "w", encoding="utf8") as htmlfile:
+            htmlfile.write(body)
+        return Container(returncode=0, exited=0, stdout="", stderr="", fname=html_path, method="in-process")
+
+    cmd_list = ["jupyter", "nbconvert", src_filename, "--to", "html", "--template", template_name]
+    res = subprocess.run(cmd_list, capture_output=True, cwd=path)
+    assert os.path.isfile(default_html_path)
+    if html_path != default_html_path:
+        import shutil
+        shutil.move(default_html_path, html_path)
+
+    return Container(
+        returncode=res.returncode,
+        exited=res.returncode,
+        stdout=res.stdout.decode("utf8"),
+        stderr=res.stderr.decode("utf8"),
+        fname=html_path,
+        method="subprocess",
+        cmd_list=cmd_list,
+    )
 
-    os.chdir(wd_save)
+
+def save_current_nb_as_html(info=None, return_res=False, fname=None):
+    """
+    Save the current notebook as html file in the same directory (see also `export_notebook_to_html`)
+    """
+    assert in_ipynb()
+
+    full_path = get_notebook_name()
+    res = export_notebook_to_html(full_path, html_path=fname)
 
     if info == True:
         # this is for debugging
-        print("target dir: ", path)
-        print("cmd: ", cmd_list)
-        print("working dir: ", wd_save)
+        print("target dir: ", os.path.dirname(full_path))
+        print("method: ", res.method)
+        print("working dir: ", os.getcwd())
     elif info is None:
-        print("`{}`".format(fname), "written.")
+        print("`{}`".format(fname or os.path.basename(res.fname)), "written.")
 
     if return_res:
         return res
@@ -967,6 +1959,10 @@ class Container(object):
         print(C.x)
         print(C.y)
         print(C.res)
+
+        # to prevent that the container keeps large objects alive use a snapshot policy, e.g.:
+        # debug_container.fetch_locals(policy="weak", exclude="tmp_*")
+        # debug_container.memory_report()
     """
 
     def __init__(self, cargs=None, **kwargs):
@@ -992,7 +1988,9 @@ class Container(object):
             kwargs.update(tmp_dict)
 
         if fetch_locals:
-            self.fetch_locals(upcount=2)
+            # `fetch_locals` might be True or the name of a snapshot policy
+            policy = fetch_locals if isinstance(fetch_locals, str) else None
+            self.fetch_locals(upcount=2, policy=policy)
 
         isec = set(dir(self)).intersection(list(kwargs.keys()))
         if len(isec) > 0 and not allow_overwrite:
@@ -1018,10 +2016,20 @@ class Container(object):
             res.append(getattr(self, n))
         return res
 
-    def fetch_locals(self, upcount=1):
+    def fetch_locals(self, upcount=1, policy=None, include=None, exclude=None, max_nbytes=None):
         """
         Magic function which fetches all variables from the callers namespace
         :param upcount     int, how many stack levels we go up
+        :param policy:     snapshot policy (str); one of
+                            "ref":  store strong references (default)
+                            "weak": store `weakref.ref`-objects where possible; other values are stored
+                                    if they are small, otherwise only a truncated repr is stored
+                            "copy": store shallow copies of small values, truncated reprs of large values
+                            "repr": store only truncated reprs (`SnapshotRepr` objects)
+        :param include:    optional names or fnmatch-patterns (sequence or comma separated str); if given,
+                           only matching locals are fetched
+        :param exclude:    optional names or fnmatch-patterns of locals which should not be fetched
+        :param max_nbytes: size limit for "weak" and "copy" (default: module_config.SNAPSHOT_MAX_NBYTES)
         :return:
         """
 
@@ -1035,8 +2043,38 @@ class Container(object):
             if i == 0:
                 break
 
+        if policy is None:
+            policy = "ref"
+        if max_nbytes is None:
+            max_nbytes = module_config.SNAPSHOT_MAX_NBYTES
+
+        include = _split_name_patterns(include)
+        exclude = _split_name_patterns(exclude)
+
         for k, v in frame.f_locals.items():
-            self.__dict__[k] = v
+            if include is not None and not _matches_any(k, include):
+                continue
+            if exclude is not None and _matches_any(k, exclude):
+                continue
+            self.__dict__[k] = _snapshot_value(v, policy, max_nbytes)
+
+    def memory_report(self, print_res=True):
+        """
+        Report the approximate memory which is retained by the attributes of this container
+        (see `approx_nbytes`; weak references count as zero).
+
+        :param print_res:   bool; whether to print the report
+        :return:            list of (name, nbytes)-tuples (largest first)
+        """
+
+        res = [(k, approx_nbytes(v)) for k, v in self.item_list()]
+        res.sort(key=lambda tup: -tup[1])
+
+        if print_res:
+            for k, nbytes in res:
+                print("{:>14,d}  {}".format(nbytes, k))
+            print("{:>14,d}  (total)".format(sum(nbytes for _, nbytes in res)))
+        return res
 
     def publish_attrs(self, upcount=1):
         """
@@ -1095,6 +2133,28 @@ class Container(object):
         C = Container(**attribute_dict)
         return C
 
+    def to_shared_memory(self, name=None, min_nbytes=1024):
+        """
+        Publish this container to `multiprocessing.shared_memory` (see `SharedContainerBlock`).
+
+        :param name:        optional name of the shared memory block (default: generated)
+        :param min_nbytes:  numpy arrays with at least this size are placed in the shared buffer,
+                            everything else is pickled
+        :return:            SharedContainerBlock (owner side; call `.close()` and `.unlink()` when done)
+        """
+        return SharedContainerBlock.publish(self, name=name, min_nbytes=min_nbytes)
+
+    @staticmethod
+    def from_shared_memory(name, readonly=True):
+        """
+        Attach to a container which was published by `to_shared_memory` (possibly in another process).
+
+        :param name:        name of the shared memory block (`block.name` on the publishing side)
+        :param readonly:    bool; whether the array views should be write protected
+        :return:            SharedContainerBlock; the reconstructed container is available as `.container`
+        """
+        return SharedContainerBlock.attach(name, readonly=readonly)
+
     def __repr__(self):
         # basically return the representation of the dict
         return "<Container: {}>".format(self.__dict__)
@@ -1109,6 +2169,269 @@ class Container(object):
 # End of class Container
 
 
+class SnapshotRepr(str):
+    """
+    Placeholder for a value of which only the (truncated) repr was stored (see `Container.fetch_locals`).
+    """
+
+    def __repr__(self):
+        return "<SnapshotRepr: {}>".format(str.__repr__(self))
+
+
+_snapshot_repr = None
+
+
+def _truncated_repr(value):
+    global _snapshot_repr
+    if _snapshot_repr is None:
+        import reprlib
+        _snapshot_repr = reprlib.Repr()
+        _snapshot_repr.maxstring = 80
+        _snapshot_repr.maxother = 80
+    try:
+        return SnapshotRepr(_snapshot_repr.repr(value))
+    except Exception as ex:
+        return SnapshotRepr("<repr failed: {}>".format(type(ex).__name__))
+
+
+def approx_nbytes(obj):
+    """
+    Return the approximate number of bytes retained by `obj`: `sys.getsizeof` plus the size of the direct
+    elements for builtin collections, header size plus `.nbytes` for array-like objects. Weak references count as
+    zero.
+    """
+    import weakref
+
+    if isinstance(obj, weakref.ref):
+        return 0
+
+    try:
+        size = sys.getsizeof(obj)
+    except TypeError:
+        size = 0
+
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        if getattr(getattr(obj, "flags", None), "owndata", False):
+            # `sys.getsizeof` of a numpy array which owns its data already contains the data
+            size = max(size - nbytes, 0)
+        return size + nbytes
+
+    if isinstance(obj, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(elt) for elt in obj)
+    return size
+
+
+def _split_name_patterns(patterns):
+    if patterns is None:
+        return None
+    if isinstance(patterns, str):
+        patterns = patterns.replace(",", " ").split(" ")
+    return [p for p in patterns if p != ""]
+
+
+def _matches_any(name, patterns):
+    import fnmatch
+    return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+def _snapshot_value(value, policy, max_nbytes):
+    """
+    Convert `value` according to the snapshot policy (see `Container.fetch_locals`)
+    """
+    if policy == "ref":
+        return value
+    elif policy == "repr":
+        return _truncated_repr(value)
+    elif policy == "weak":
+        import weakref
+        try:
+            return weakref.ref(value)
+        except TypeError:
+            pass
+        # not weak-referenceable (e.g. int, str, list, dict): keep it only if it is small
+        if approx_nbytes(value) <= max_nbytes:
+            return value
+        return _truncated_repr(value)
+    elif policy == "copy":
+        import copy
+        if approx_nbytes(value) > max_nbytes:
+            return _truncated_repr(value)
+        try:
+            return copy.copy(value)
+        except Exception:
+            return _truncated_repr(value)
+    else:
+        msg = "Unknown snapshot policy: '{}'. Expected one of 'ref', 'weak', 'copy', 'repr'.".format(policy)
+        raise ValueError(msg)
+
+
+class SharedContainerBlock(object):
+    """
+    Handle for a `Container` which lives in a `multiprocessing.shared_memory` block.
+
+    Layout of the block: 8 byte header (length of the pickled metadata), pickled metadata (small values and
+    array descriptors), then the raw data of all numpy arrays (each aligned to `ALIGNMENT` bytes).
+
+    Typical usage:
+
+        # worker process
+        block = C.to_shared_memory()
+        queue.put(block.name)
+        # ... wait until the parent is done, then:
+        block.close()
+        block.unlink()
+
+        # parent process
+        block = Container.from_shared_memory(queue.get())
+        C = block.container  # array attributes are views into the shared buffer (no copy)
+        IPS()
+        block.close()
+
+    Both sides must call `.close()`; exactly one side (usually the publisher) must call `.unlink()`.
+    The handle can also be used as context manager (the owner unlinks on exit).
+    """
+
+    ALIGNMENT = 64
+    _header_size = 8
+
+    def __init__(self, shm, owner, container=None, array_names=()):
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+        self.container = container
+        self.array_names = list(array_names)
+        self.closed = False
+
+    @staticmethod
+    def _align(n, alignment=ALIGNMENT):
+        return -(-n // alignment) * alignment
+
+    @staticmethod
+    def _is_sharable_array(value, min_nbytes):
+        np = sys.modules.get("numpy")
+        if np is None or not isinstance(value, np.ndarray):
+            return False
+        return not value.dtype.hasobject and value.nbytes >= min_nbytes
+
+    @classmethod
+    def publish(cls, container, name=None, min_nbytes=1024):
+        from multiprocessing import shared_memory
+
+        assert isinstance(container, Container)
+
+        small_values = {}
+        array_descriptors = {}
+        arrays = {}
+        offset = 0
+        for key, value in container.item_list():
+            if cls._is_sharable_array(value, min_nbytes):
+                offset = cls._align(offset)
+                array_descriptors[key] = (offset, value.dtype.str, value.shape)
+                arrays[key] = value
+                offset += value.nbytes
+            else:
+                small_values[key] = value
+
+        meta = {
+            "small_values": small_values,
+            "arrays": array_descriptors,
+            "carg_varnames": list(container._Container__carg_varnames),
+        }
+        meta_bytes = pickle.dumps(meta, protocol=pickle.HIGHEST_PROTOCOL)
+        data_start = cls._align(cls._header_size + len(meta_bytes))
+
+        # size=0 is not allowed for shared memory
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(data_start + offset, 1))
+        try:
+            shm.buf[:cls._header_size] = len(meta_bytes).to_bytes(cls._header_size, "little")
+            shm.buf[cls._header_size:cls._header_size + len(meta_bytes)] = meta_bytes
+
+            np = sys.modules.get("numpy")
+            for key, arr in arrays.items():
+                start = data_start + array_descriptors[key][0]
+                target = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf, offset=start)
+                target[...] = arr
+                del target
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+        return cls(shm, owner=True, array_names=arrays.keys())
+
+    @classmethod
+    def attach(cls, name, readonly=True):
+        from multiprocessing import shared_memory
+
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=name)
+            # prevent the resource tracker of this (non-owning) process from unlinking the block at exit
+            # see https://github.com/python/cpython/issues/82300
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+
+        meta_len = int.from_bytes(bytes(shm.buf[:cls._header_size]), "little")
+        meta = pickle.loads(bytes(shm.buf[cls._header_size:cls._header_size + meta_len]))
+        data_start = cls._align(cls._header_size + meta_len)
+
+        attribute_dict = dict(meta["small_values"])
+        if meta["arrays"]:
+            import numpy as np
+
+            for key, (offset, dtype_str, shape) in meta["arrays"].items():
+                arr = np.ndarray(shape, dtype=np.dtype(dtype_str), buffer=shm.buf, offset=data_start + offset)
+                if readonly:
+                    arr.flags.writeable = False
+                attribute_dict[key] = arr
+
+        container = Container()
+        container.__dict__.update(attribute_dict)
+        container._Container__carg_varnames = meta["carg_varnames"]
+
+        return cls(shm, owner=False, container=container, array_names=meta["arrays"].keys())
+
+    def close(self):
+        """
+        Release the array views of `.container` and close the shared memory block for this process.
+        """
+        if self.closed:
+            return
+        if self.container is not None:
+            for key in self.array_names:
+                self.container.__dict__.pop(key, None)
+        try:
+            self.shm.close()
+        except BufferError:
+            msg = (
+                "Cannot close shared memory block `{}` because some array views are still referenced "
+                "outside of `.container`. Delete them first.".format(self.name)
+            )
+            raise BufferError(msg)
+        self.closed = True
+
+    def unlink(self):
+        """
+        Destroy the underlying shared memory block (call this exactly once, usually on the owner side).
+        """
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+    def __repr__(self):
+        return "<SharedContainerBlock: {} (owner={}, arrays={})>".format(self.name, self.owner, self.array_names)
+
+
 def get_whole_assignment_expression(line, varname, seq_type):
     """
     Example:
@@ -1281,28 +2604,317 @@ def break_on_setattr(attrname, condition=always):
     return decorator
 
 
+_missing = object()
+
+
+def _ips_in_writing_frame(frame, obj, name, value):
+    IPS(frame=frame, ns_extension={"__watched_obj": obj, "__watched_name": name, "__watched_value": value})
+
+
+class WatchedAttribute(object):
+    """
+    Data descriptor which is installed on a class for one watched attribute (see `add_watchpoints`).
+    Reads and writes are delegated to the original class attribute (e.g. a slot descriptor or a property)
+    or to the instance `__dict__`.
+    """
+
+    def __init__(self, name, condition, action, original, defined_in_cls):
+        self.name = name
+        self.condition = condition
+        self.action = action
+        # class attribute which was replaced (or _missing)
+        self.original = original
+        # whether `original` has to be restored in `cls.__dict__` when the watchpoint is removed
+        self.defined_in_cls = defined_in_cls
+        self._delegate = original is not _missing and hasattr(type(original), "__set__")
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        if self._delegate:
+            return self.original.__get__(obj, objtype)
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            pass
+        original = self.original
+        if original is _missing:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(obj).__name__, self.name))
+        if hasattr(type(original), "__get__"):
+            return original.__get__(obj, objtype)
+        # e.g. class level default value (like in dataclasses)
+        return original
+
+    def __set__(self, obj, value):
+        if self.condition(obj, value):
+            self.action(inspect.currentframe().f_back, obj, self.name, value)
+        if self._delegate:
+            self.original.__set__(obj, value)
+        else:
+            obj.__dict__[self.name] = value
+
+    def __delete__(self, obj):
+        if self._delegate:
+            self.original.__delete__(obj)
+        else:
+            try:
+                del obj.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name)
+
+
+def add_watchpoints(cls, *attrnames, condition=always, action=None, **conditions):
+    """
+    Watch assignments to selected attributes of the instances of `cls` (alternative to `break_on_setattr`).
+
+    Only for the watched names a data descriptor is installed. Thus writes to all other attributes keep their
+    original speed. Classes with `__slots__` are supported. Can be applied to existing classes at runtime
+    (see also `remove_watchpoints`) or used via the decorator `watchpoints`.
+
+    Example: add_watchpoints(MyClass, "a", "b", c=lambda self, value: value < 0)
+
+    :param cls:         the class
+    :param attrnames:   attribute names which are watched with `condition`
+    :param condition:   callable(obj, value) -> bool (default: always)
+    :param action:      optional callable(frame, obj, name, value); default: open IPS in the writing frame
+    :param conditions:  attribute names with individual conditions
+    :return:            cls
+    """
+
+    if action is None:
+        action = _ips_in_writing_frame
+
+    name_conditions = dict.fromkeys(attrnames, condition)
+    name_conditions.update(conditions)
+
+    for name, cond in name_conditions.items():
+        current = cls.__dict__.get(name, _missing)
+        if isinstance(current, WatchedAttribute):
+            # replace the watchpoint but keep the original attribute
+            original, defined_in_cls = current.original, current.defined_in_cls
+        else:
+            defined_in_cls = current is not _missing
+            # the attribute might be defined in a base class (e.g. as slot)
+            original = _missing
+            for base in cls.__mro__:
+                if name in base.__dict__:
+                    original = base.__dict__[name]
+                    break
+        setattr(cls, name, WatchedAttribute(name, cond, action, original, defined_in_cls))
+    return cls
+
+
+def remove_watchpoints(cls, *attrnames):
+    """
+    Remove watchpoints which were installed by `add_watchpoints` (default: all watchpoints of `cls`).
+    """
+
+    if not attrnames:
+        attrnames = [k for k, v in cls.__dict__.items() if isinstance(v, WatchedAttribute)]
+
+    for name in attrnames:
+        watched = cls.__dict__.get(name)
+        if not isinstance(watched, WatchedAttribute):
+            continue
+        if watched.defined_in_cls:
+            setattr(cls, name, watched.original)
+        else:
+            delattr(cls, name)
+    return cls
+
+
+def watchpoints(*attrnames, condition=always, action=None, **conditions):
+    """
+    Class decorator version of `add_watchpoints`.
+    """
+    def decorator(cls):
+        return add_watchpoints(cls, *attrnames, condition=condition, action=action, **conditions)
+    return decorator
+
+
+class _Deleted(object):
+    def __repr__(self):
+        return "<deleted>"
+
+
 class SurveiledDict(dict):
     """
-    Dictionary which triggers IPS if a value is set (and an optional condition is met)
+    Dictionary which triggers IPS if a watched key is written or deleted (and an optional condition is met).
+
+    All mutating methods are covered: `__setitem__`, `update`, `|=`, `setdefault`, `pop`, `popitem`,
+    `__delitem__` and `clear`. The initial content (passed to the constructor) is not checked. For deletions the
+    condition is called with `SurveiledDict.DELETED` as value.
+
+    See `surveil` for the configuration (watched keys, per-key conditions, batch conditions, record mode).
     """
 
+    DELETED = _Deleted()
+
+    # class level defaults (relevant e.g. during unpickling, where items are set before the instance state)
+    _watch_all = False
+    _watched_keys = frozenset()
+    _patterns = None
+
     def __init__(self, *args, **kwargs):
-        self._set_condition(always)
+        self.surveil()
         super().__init__(*args, **kwargs)
 
+    def surveil(
+        self, condition=always, keys=None, patterns=None, key_conditions=None, batch_condition=None, record=None
+    ):
+        """
+        Configure the surveillance.
+
+        :param condition:       callable(d, key, value) -> bool; condition for all watched keys
+        :param keys:            optional iterable of watched keys (default: all keys are watched unless
+                                `patterns` or `key_conditions` are given)
+        :param patterns:        optional fnmatch pattern(s) for watched str-keys (str or list of str)
+        :param key_conditions:  optional dict {key: condition} which overrides `condition` for single keys
+                                (these keys are watched too)
+        :param batch_condition: optional callable(d, items) -> violating (key, value)-pairs (or bool for all/none);
+                                called once per bulk operation (`update`, `|=`, `clear`) with all watched items
+                                instead of evaluating the per-key conditions item by item
+        :param record:          None (default: open IPS in the writing frame) or int N: record the last N
+                                violations in the ring buffer `self.violations` instead
+        :return:                self
+        """
+        self._condition_func = condition
+        self._key_conditions = dict(key_conditions or {})
+        self._batch_condition = batch_condition
+        self._patterns = _split_name_patterns(patterns)
+
+        # precomputed set -> cheap membership test for every write
+        self._watched_keys = set(keys or ()) | set(self._key_conditions)
+        self._watch_all = keys is None and not self._patterns and not self._key_conditions
+        # {key: bool} results of the pattern matching
+        self._pattern_cache = {}
+
+        self.violations = None if record is None else collections.deque(maxlen=record)
+        return self
+
     def _set_condition(self, condition):
         self._condition_func = condition
 
+    def _is_watched(self, key):
+        if self._watch_all or key in self._watched_keys:
+            return True
+        if not self._patterns:
+            return False
+        res = self._pattern_cache.get(key)
+        if res is None:
+            if len(self._pattern_cache) > 10000:
+                self._pattern_cache.clear()
+            res = self._pattern_cache[key] = isinstance(key, str) and _matches_any(key, self._patterns)
+        return res
+
+    def _check_item(self, method, key, value):
+        condition = self._key_conditions.get(key, self._condition_func)
+        if condition(self, key, value):
+            # frame of the caller of the mutating method
+            self._handle_violations(method, [(key, value)], sys._getframe(2))
+
+    def _check_items(self, method, items):
+        if not items:
+            return
+        if self._batch_condition is not None:
+            violations = self._batch_condition(self, items)
+            if violations is True:
+                violations = items
+            elif not violations:
+                return
+            violations = list(violations)
+        else:
+            key_conditions, condition = self._key_conditions, self._condition_func
+            violations = [(k, v) for k, v in items if key_conditions.get(k, condition)(self, k, v)]
+        if violations:
+            self._handle_violations(method, violations, sys._getframe(2))
+
+    def _handle_violations(self, method, items, frame):
+        if self.violations is not None:
+            for key, value in items:
+                self.violations.append(
+                    Container(
+                        method=method, key=key, value=value,
+                        filename=frame.f_code.co_filename, lineno=frame.f_lineno, function=frame.f_code.co_name,
+                    )
+                )
+            return
+        IPS(frame=frame, ns_extension={"__surveiled_dict": self, "__violations": items, "__method": method})
+
+    def _watched_items(self, args, kwargs):
+        """
+        Return the (possibly materialized) arguments of a bulk update and the list of watched items.
+        """
+        if len(args) > 1:
+            raise TypeError("update expected at most 1 argument, got {}".format(len(args)))
+        sources = []
+        if args:
+            other = args[0]
+            if not hasattr(other, "keys"):
+                # iterable of pairs (might be an iterator)
+                other = dict(other)
+                args = (other,)
+            sources.append(other)
+        if kwargs:
+            sources.append(kwargs)
+
+        items = []
+        for source in sources:
+            if self._watch_all:
+                keys = source.keys()
+            else:
+                if isinstance(source, dict):
+                    # the intersection of a keys-view and a set iterates over the smaller operand
+                    keys = source.keys() & self._watched_keys
+                else:
+                    keys = self._watched_keys.intersection(source.keys())
+                if self._patterns:
+                    keys = [k for k in source.keys() if k in keys or self._is_watched(k)]
+            items.extend((k, source[k]) for k in keys)
+        return args, items
+
     def __setitem__(self, key, value):
-        if self._condition_func(self, key, value):
-            IPS()
+        if self._watch_all or key in self._watched_keys or (self._patterns and self._is_watched(key)):
+            self._check_item("__setitem__", key, value)
         super().__setitem__(key, value)
 
     def update(self, *args, **kwargs):
-        if self._condition_func(self, *args, **kwargs):
-            IPS()
+        args, items = self._watched_items(args, kwargs)
+        self._check_items("update", items)
         super().update(*args, **kwargs)
 
+    def __ior__(self, other):
+        args, items = self._watched_items((other,), {})
+        self._check_items("|=", items)
+        super().update(*args)
+        return self
+
+    def setdefault(self, key, default=None):
+        if key not in self and self._is_watched(key):
+            self._check_item("setdefault", key, default)
+        return super().setdefault(key, default)
+
+    def __delitem__(self, key):
+        if key in self and self._is_watched(key):
+            self._check_item("__delitem__", key, self.DELETED)
+        super().__delitem__(key)
+
+    def pop(self, key, *args):
+        if key in self and self._is_watched(key):
+            self._check_item("pop", key, self.DELETED)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        if self:
+            key = next(reversed(self))
+            if self._is_watched(key):
+                self._check_item("popitem", key, self.DELETED)
+        return super().popitem()
+
+    def clear(self):
+        self._check_items("clear", [(k, self.DELETED) for k in self if self._is_watched(k)])
+        super().clear()
+
 
 def enable_conversion_to_json(obj):
     """
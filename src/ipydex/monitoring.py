@@ -0,0 +1,809 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains debugging tools which are based on `sys.monitoring` (PEP 669, python >= 3.12).
+
+In contrast to `sys.settrace` (used e.g. by `TracerFactory`/pdb), events are only activated for selected code
+objects. Thus unrelated code runs at full speed. An armed line itself is not cheaper than with a trace function
+(see `BreakpointManager`).
+
+typical use case:
+
+from ipydex.monitoring import BreakpointManager
+
+bpm = BreakpointManager()
+bpm.add(some_function, lineno=123, condition="x < 0")  # opens IPS in that frame if the condition holds
+...
+bpm.close()
+
+Post-mortem history of local variables (see `ExecutionRecorder`):
+
+from ipydex.monitoring import ExecutionRecorder
+
+recorder = ExecutionRecorder(some_module, maxlen=10000).start()
+
+Count raised (and possibly caught) exceptions per raise site (see `RaiseProfiler`):
+
+from ipydex.monitoring import RaiseProfiler
+
+with RaiseProfiler() as rp:
+    ...
+rp.render()
+"""
+
+import ast
+import collections
+import operator
+import reprlib
+import sys
+import types
+
+from .core import IPS, format_frames
+
+
+def _require_monitoring():
+    if not hasattr(sys, "monitoring"):
+        msg = "This functionality depends on `sys.monitoring` which is available for python >= 3.12."
+        raise RuntimeError(msg)
+    return sys.monitoring
+
+
+def _get_code(target):
+    """
+    Return the code object of a function, method or code object.
+    """
+    target = getattr(target, "__func__", target)
+    target = getattr(target, "__wrapped__", target)
+    code = getattr(target, "__code__", target)
+    if not hasattr(code, "co_code"):
+        raise TypeError("Cannot determine code object of {!r}".format(target))
+    return code
+
+
+def _open_ips(frame, breakpoint):
+    print("\n--- ipydex breakpoint {} ---".format(breakpoint))
+    IPS(frame=frame)
+
+
+class Breakpoint(object):
+    def __init__(self, code, lineno, condition, action, ignore=0, max_hits=None):
+        self.code = code
+        # None means: break at function entry
+        self.lineno = lineno
+        self.condition = condition
+        # compiled once (not on every hit) into a function of the local variables which the condition uses
+        if condition is None:
+            self.condition_names = self.condition_code = None
+        else:
+            self.condition_names, self.condition_code = _compile_condition(condition, code)
+        # fetches the values of the names from `frame.f_locals` (a single value or a tuple)
+        self.condition_getter = operator.itemgetter(*self.condition_names) if self.condition_names else None
+        self.condition_star = self.condition_names is not None and len(self.condition_names) > 1
+        # the function of the condition is created at the first hit (with the globals of the frame)
+        self.condition_globals = self.condition_func = None
+        self.action = action
+        self.enabled = True
+        self.hits = 0
+        # hit-count conditions (checked before the condition is evaluated)
+        self.ignore = ignore
+        self.max_hits = max_hits
+        # True if `max_hits` is reached
+        self.spent = max_hits is not None and max_hits <= 0
+
+    # note: called for every execution of an armed location -> keep it lean
+
+    def reached(self, frame):
+        """
+        Check the hit counts and the condition and call the action.
+
+        The condition is evaluated with only the local variables which it uses (looked up once per hit); if one of
+        them is not (yet) bound, the condition is considered false.
+
+        :return:    sys.monitoring.DISABLE if the breakpoint can no longer fire, else None
+        """
+        if self.ignore:
+            self.ignore -= 1
+            return
+
+        if self.condition_code is not None:
+            if frame.f_globals is not self.condition_globals:
+                self.condition_globals = frame.f_globals
+                self.condition_func = types.FunctionType(self.condition_code, frame.f_globals)
+            getter = self.condition_getter
+            if getter is None:
+                res = self.condition_func()
+            else:
+                try:
+                    args = getter(frame.f_locals)
+                except KeyError:
+                    return
+                res = self.condition_func(*args) if self.condition_star else self.condition_func(args)
+            if not res:
+                return
+
+        self.hits += 1
+        self.spent = self.max_hits is not None and self.hits >= self.max_hits
+        self.action(frame, self)
+        if self.spent:
+            return sys.monitoring.DISABLE
+
+    def __repr__(self):
+        place = "entry" if self.lineno is None else "line {}".format(self.lineno)
+        return "<Breakpoint {}:{} ({}){}>".format(
+            self.code.co_qualname if hasattr(self.code, "co_qualname") else self.code.co_name,
+            place,
+            self.condition,
+            "" if self.enabled else " [disabled]",
+        )
+
+
+def _compile_condition(condition, code):
+    """
+    Compile a condition (python expression) into the code of a function whose arguments are the local variables of
+    `code` which the condition uses (other names are resolved as globals or builtins).
+
+    :return:    (tuple of argument names, code object)
+    """
+    tree = ast.parse(condition, "<breakpoint condition>", "eval")
+    local_names = set(code.co_varnames) | set(code.co_cellvars) | set(code.co_freevars)
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in local_names and node.id not in names:
+            names.append(node.id)
+    src = "lambda {}: ({})".format(", ".join(names), condition)
+    lambda_code = compile(src, "<breakpoint condition>", "eval")
+    func_code = [const for const in lambda_code.co_consts if isinstance(const, types.CodeType)][0]
+    return tuple(names), func_code
+
+
+class BreakpointManager(object):
+    """
+    Conditional breakpoints based on `sys.monitoring` LINE and PY_START events which are activated only for the
+    code objects of the targets.
+
+    When a breakpoint is reached and its condition (compiled once, see `Breakpoint.reached`) evaluates to
+    true in the frame, `action(frame, breakpoint)` is called (default: open IPS in that frame). The cheap hit-count conditions `ignore` and `max_hits`
+    are checked before the condition is evaluated. Disabled breakpoints and breakpoints which reached `max_hits` do
+    not cause any overhead: their location is switched off via `sys.monitoring.DISABLE`.
+
+    Cost: code without breakpoints runs at full speed, but every execution of an armed line calls a python callback
+    which reads the locals of the frame. For that line this is more expensive than a (no-op) `sys.settrace`
+    function, which however slows down all code. Typical slowdowns of the hot loop of `benchmark_breakpoints`
+    (python 3.12):
+
+    armed breakpoint with condition:    ~15x    (only the armed line)
+    armed breakpoint, `ignore` count:    ~8x    (only the armed line)
+    disabled or spent breakpoint:         1x
+    sys.settrace:                        ~5x    (all code)
+    """
+
+    def __init__(self, tool_id=None):
+        """
+        :param tool_id:     preferred sys.monitoring tool id (default: sys.monitoring.DEBUGGER_ID; if it is in use,
+                            the first free non-reserved id)
+        """
+        monitoring = _require_monitoring()
+        if tool_id is None:
+            tool_id = monitoring.DEBUGGER_ID
+        self.tool_id = _use_free_tool_id("ipydex-breakpoints", tool_id)
+        monitoring.register_callback(self.tool_id, monitoring.events.LINE, self._line_callback)
+        monitoring.register_callback(self.tool_id, monitoring.events.PY_START, self._start_callback)
+
+        # {(id(code), lineno): Breakpoint} (hashing a code object is expensive; the breakpoint references the code)
+        self._line_breakpoints = {}
+        # {id(code): Breakpoint}
+        self._entry_breakpoints = {}
+        self.closed = False
+
+    def add(self, target, lineno=None, condition=None, action=None, ignore=0, max_hits=None):
+        """
+        Add a breakpoint.
+
+        :param target:      function, method or code object
+        :param lineno:      absolute line number (default: None -> function entry)
+        :param condition:   optional python expression (str) which is evaluated in the frame
+        :param action:      optional callable(frame, breakpoint) (default: open IPS in the frame)
+        :param ignore:      number of times the location is passed before the condition is checked
+        :param max_hits:    optional maximum number of hits (afterwards the location is switched off)
+        :return:            Breakpoint
+        """
+        code = _get_code(target)
+        if lineno is not None:
+            valid_lines = {line for _, _, line in code.co_lines() if line is not None}
+            if lineno not in valid_lines:
+                msg = "Line {} does not belong to the code of {} (valid: {}..{})".format(
+                    lineno, code.co_name, min(valid_lines), max(valid_lines)
+                )
+                raise ValueError(msg)
+
+        bp = Breakpoint(code, lineno, condition, action or _open_ips, ignore=ignore, max_hits=max_hits)
+        if lineno is None:
+            self._entry_breakpoints[id(code)] = bp
+        else:
+            self._line_breakpoints[(id(code), lineno)] = bp
+        self._update_events(code)
+        return bp
+
+    def remove(self, bp):
+        if bp.lineno is None:
+            self._entry_breakpoints.pop(id(bp.code), None)
+        else:
+            self._line_breakpoints.pop((id(bp.code), bp.lineno), None)
+        self._update_events(bp.code)
+
+    def enable(self, bp):
+        bp.enabled = True
+        # re-enable locations which were switched off by returning DISABLE
+        sys.monitoring.restart_events()
+
+    def disable(self, bp):
+        bp.enabled = False
+
+    def clear(self):
+        codes = {bp.code for bp in self.breakpoints}
+        self._entry_breakpoints.clear()
+        self._line_breakpoints.clear()
+        for code in codes:
+            self._update_events(code)
+
+    def close(self):
+        """
+        Remove all breakpoints and release the tool id.
+        """
+        if self.closed:
+            return
+        monitoring = sys.monitoring
+        self.clear()
+        monitoring.register_callback(self.tool_id, monitoring.events.LINE, None)
+        monitoring.register_callback(self.tool_id, monitoring.events.PY_START, None)
+        monitoring.free_tool_id(self.tool_id)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def breakpoints(self):
+        return list(self._entry_breakpoints.values()) + list(self._line_breakpoints.values())
+
+    def _update_events(self, code):
+        events = sys.monitoring.events
+        event_set = events.NO_EVENTS
+        if id(code) in self._entry_breakpoints:
+            event_set |= events.PY_START
+        if any(bp.code is code for bp in self._line_breakpoints.values()):
+            event_set |= events.LINE
+        sys.monitoring.set_local_events(self.tool_id, code, event_set)
+        sys.monitoring.restart_events()
+
+    # note: the callbacks are called for every execution of an armed location -> keep them lean
+
+    def _line_callback(self, code, lineno):
+        bp = self._line_breakpoints.get((id(code), lineno))
+        if bp is None or not bp.enabled or bp.spent:
+            # the location can no longer fire -> no further events for it (until restart_events)
+            return sys.monitoring.DISABLE
+        # frame of the monitored code
+        return bp.reached(sys._getframe(1))
+
+    def _start_callback(self, code, instruction_offset):
+        bp = self._entry_breakpoints.get(id(code))
+        if bp is None or not bp.enabled or bp.spent:
+            return sys.monitoring.DISABLE
+        return bp.reached(sys._getframe(1))
+
+
+# tool ids which are not reserved for debuggers, coverage tools, profilers or optimizers (see PEP 669)
+_unreserved_tool_ids = (3, 4)
+
+
+def _use_free_tool_id(name, preferred=None):
+    """
+    Register `name` for the preferred tool id (or the first free non-reserved one) and return the id.
+    """
+    monitoring = sys.monitoring
+    candidates = list(_unreserved_tool_ids)
+    if preferred is not None:
+        candidates.insert(0, preferred)
+    for tool_id in candidates:
+        if monitoring.get_tool(tool_id) is None:
+            monitoring.use_tool_id(tool_id, name)
+            return tool_id
+    raise RuntimeError("No free sys.monitoring tool id available")
+
+
+def _collect_code_objects(target, res=None):
+    """
+    Return the set of code objects of a function, method, class, module (or module name) or code object,
+    including nested code objects (inner functions, comprehensions, ...).
+    """
+    if res is None:
+        res = set()
+
+    if isinstance(target, str):
+        target = sys.modules[target]
+
+    if isinstance(target, types.ModuleType):
+        for obj in list(vars(target).values()):
+            if getattr(obj, "__module__", None) == target.__name__ and isinstance(obj, (type, types.FunctionType)):
+                _collect_code_objects(obj, res)
+        return res
+
+    if isinstance(target, type):
+        for obj in vars(target).values():
+            if isinstance(obj, (staticmethod, classmethod)):
+                obj = obj.__func__
+            elif isinstance(obj, property):
+                for func in (obj.fget, obj.fset, obj.fdel):
+                    if func is not None:
+                        _collect_code_objects(func, res)
+                continue
+            if isinstance(obj, (type, types.FunctionType)) and getattr(obj, "__module__", None) == target.__module__:
+                _collect_code_objects(obj, res)
+        return res
+
+    code = _get_code(target)
+    stack = [code]
+    while stack:
+        code = stack.pop()
+        if code in res:
+            continue
+        res.add(code)
+        stack.extend(const for const in code.co_consts if isinstance(const, types.CodeType))
+    return res
+
+
+# recorder which is used by `var_history` (and offered in the shell of `ips_excepthook`)
+active_recorder = None
+
+_scalar_types = (int, float, complex, bool, type(None))
+
+# marker for the last value of a non-scalar variable (None is a scalar value itself)
+_non_scalar = object()
+
+
+class ExecutionRecorder(object):
+    """
+    Opt-in recorder which stores bounded summaries (truncated reprs) of changed local variables for every executed
+    line of selected functions or modules in a ring buffer. It is based on `sys.monitoring` LINE, PY_START and
+    PY_RETURN events which are only activated for the code objects of the targets.
+
+    Inside the shell of `ips_excepthook` the history of a local variable of the current frame can be shown with
+    `__var_history("x")` (or `var_history("x", frame)`).
+    """
+
+    def __init__(self, *targets, maxlen=10000, max_repr=80, tool_id=None):
+        """
+        :param targets:     functions, methods, classes, code objects, modules or module names
+        :param maxlen:      size of the ring buffer (number of recorded changes)
+        :param max_repr:    maximum length of the stored summaries
+        :param tool_id:     optional sys.monitoring tool id (default: first free id)
+        """
+        monitoring = _require_monitoring()
+        self.codes = set()
+        for target in targets:
+            _collect_code_objects(target, self.codes)
+
+        # entries: (call_id, code, lineno, name, summary)
+        self.records = collections.deque(maxlen=maxlen)
+        self.repr = reprlib.Repr()
+        self.repr.maxstring = self.repr.maxother = max_repr
+
+        # {id(frame): [call_id, last lineno, {name: (scalar value or _non_scalar, summary)}]}
+        self._frame_state = {}
+        self._call_counter = 0
+        # bound for `_frame_state` (entries of finished frames are removed on return but not on unwinding)
+        self.max_frames = 10000
+
+        self.tool_id = _use_free_tool_id("ipydex-recorder", tool_id)
+        events = monitoring.events
+        monitoring.register_callback(self.tool_id, events.PY_START, self._start_callback)
+        monitoring.register_callback(self.tool_id, events.LINE, self._line_callback)
+        monitoring.register_callback(self.tool_id, events.PY_RETURN, self._return_callback)
+        self.active = False
+
+    def start(self):
+        """
+        Activate the events for the selected code objects (and make this the active recorder).
+        """
+        global active_recorder
+        events = sys.monitoring.events
+        for code in self.codes:
+            sys.monitoring.set_local_events(self.tool_id, code, events.PY_START | events.LINE | events.PY_RETURN)
+        self.active = True
+        active_recorder = self
+        return self
+
+    def stop(self):
+        for code in self.codes:
+            sys.monitoring.set_local_events(self.tool_id, code, sys.monitoring.events.NO_EVENTS)
+        self.active = False
+
+    def close(self):
+        """
+        Stop recording and release the tool id (the records are kept).
+        """
+        global active_recorder
+        if self.tool_id is None:
+            return
+        self.stop()
+        events = sys.monitoring.events
+        for event in (events.PY_START, events.LINE, events.PY_RETURN):
+            sys.monitoring.register_callback(self.tool_id, event, None)
+        sys.monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+        self._frame_state.clear()
+        if active_recorder is self:
+            active_recorder = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # keep the records and the frame state for the post-mortem analysis
+        self.stop()
+
+    # note: the callbacks are called for every line of the recorded code -> keep them lean
+
+    def _new_state(self, frame):
+        if len(self._frame_state) >= self.max_frames:
+            self._frame_state.clear()
+        self._call_counter += 1
+        state = self._frame_state[id(frame)] = [self._call_counter, None, {}]
+        return state
+
+    def _start_callback(self, code, instruction_offset):
+        self._new_state(sys._getframe(1))
+
+    def _line_callback(self, code, lineno):
+        frame = sys._getframe(1)
+        state = self._frame_state.get(id(frame))
+        if state is None:
+            state = self._new_state(frame)
+        self._record_changes(frame, code, state)
+        state[1] = lineno
+
+    def _return_callback(self, code, instruction_offset, retval):
+        frame = sys._getframe(1)
+        state = self._frame_state.pop(id(frame), None)
+        if state is not None:
+            self._record_changes(frame, code, state)
+
+    def _record_changes(self, frame, code, state):
+        call_id, lineno, last = state
+        if lineno is None:
+            # values of the arguments
+            lineno = code.co_firstlineno
+        for name, value in frame.f_locals.items():
+            prev = last.get(name)
+            if isinstance(value, _scalar_types):
+                if prev is not None and type(prev[0]) is type(value) and prev[0] == value:
+                    continue
+                scalar = value
+            else:
+                scalar = _non_scalar
+            try:
+                summary = self.repr.repr(value)
+            except Exception as ex:
+                summary = "<repr failed: {}>".format(type(ex).__name__)
+            if prev is not None and prev[1] == summary:
+                continue
+            last[name] = (scalar, summary)
+            self.records.append((call_id, code, lineno, name, summary))
+
+    def history(self, name, frame=None, n=10, print_res=True):
+        """
+        Return (and print) the last `n` recorded changes of a local variable.
+
+        :param name:        variable name
+        :param frame:       optional frame (default: `__frame` of the calling shell namespace);
+                            if None, the changes in all recorded calls are returned
+        :param n:           maximum number of entries
+        :return:            list of (lineno, summary)
+        """
+        if frame is None:
+            frame = sys._getframe(1).f_locals.get("__frame")
+
+        call_id = code = None
+        if frame is not None:
+            code = frame.f_code
+            state = self._frame_state.get(id(frame))
+            if state is not None:
+                call_id = state[0]
+
+        res = []
+        for rec_call_id, rec_code, lineno, rec_name, summary in reversed(self.records):
+            if rec_name != name:
+                continue
+            if call_id is not None and rec_call_id != call_id:
+                continue
+            if call_id is None and code is not None and rec_code is not code:
+                continue
+            res.append((lineno, summary))
+            if len(res) >= n:
+                break
+        res.reverse()
+
+        if print_res:
+            if not res:
+                print("no recorded changes of `{}`".format(name))
+            for lineno, summary in res:
+                print("line {:>5}: {} = {}".format(lineno, name, summary))
+        return res
+
+
+def var_history(name, frame=None, n=10, print_res=True):
+    """
+    Show the recent history of a local variable which was recorded by the active `ExecutionRecorder`
+    (see `ExecutionRecorder.history`).
+    """
+    if active_recorder is None:
+        raise RuntimeError("No ExecutionRecorder has been started")
+    if frame is None:
+        frame = sys._getframe(1).f_locals.get("__frame")
+    return active_recorder.history(name, frame=frame, n=n, print_res=print_res)
+
+
+class RaiseSite(object):
+    def __init__(self, code, lineno):
+        self.code = code
+        self.lineno = lineno
+        # {exception type: count}
+        self.counts = {}
+        # formatted source context (captured at the first raise, see `RaiseProfiler`)
+        self.context = None
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def __repr__(self):
+        return "<RaiseSite {}:{} ({}x)>".format(self.code.co_filename, self.lineno, self.total)
+
+
+class RaiseProfiler(object):
+    """
+    Count raised exceptions per raise site and per exception type (e.g. `KeyError` of lookups which are caught
+    internally) based on the `sys.monitoring` RAISE event. Only the origin of an exception is counted, not the
+    frames through which it propagates (these are recognized via the preceding PY_UNWIND event of the callee).
+    Explicit re-raises of stored exceptions (`raise ex`) count as new raises at their site.
+
+    Unlike the other tools of this module, RAISE and PY_UNWIND are global events: while the profiler is running,
+    every raise of the interpreter calls the (lean) callbacks.
+
+    typical use case:
+
+    with RaiseProfiler() as rp:
+        run_service()
+    rp.render(n=10)
+    """
+
+    def __init__(self, tool_id=None, context=True, code_context=1, theme_name=None):
+        """
+        :param tool_id:         optional sys.monitoring tool id (default: first free id)
+        :param context:         bool; capture the formatted source context of a site at its first raise
+                                (like `generate_frame_list_info`, costs some ms once per site)
+        :param code_context:    number of context lines
+        :param theme_name:      optional IPython theme for the context (default: module_config.THEME_NAME)
+        """
+        monitoring = _require_monitoring()
+        self.context = context
+        self.code_context = code_context
+        self.theme_name = theme_name
+
+        # {(code, instruction_offset): RaiseSite} (several offsets may belong to the same site)
+        self._sites_by_offset = {}
+        # {(code, lineno): RaiseSite}
+        self.sites = {}
+        # {code: [[nth, lineno, exc_type, action, hits], ...]}
+        self._breaks = {}
+        # exception which just left a frame (its next RAISE event is the propagation into the caller)
+        self._unwinding = None
+
+        self.tool_id = _use_free_tool_id("ipydex-raise-profiler", tool_id)
+        monitoring.register_callback(self.tool_id, monitoring.events.RAISE, self._raise_callback)
+        monitoring.register_callback(self.tool_id, monitoring.events.PY_UNWIND, self._unwind_callback)
+        self.active = False
+
+    def start(self):
+        events = sys.monitoring.events
+        sys.monitoring.set_events(self.tool_id, events.RAISE | events.PY_UNWIND)
+        self.active = True
+        return self
+
+    def stop(self):
+        sys.monitoring.set_events(self.tool_id, sys.monitoring.events.NO_EVENTS)
+        self._unwinding = None
+        self.active = False
+
+    def close(self):
+        """
+        Stop profiling and release the tool id (the counts are kept).
+        """
+        if self.tool_id is None:
+            return
+        self.stop()
+        sys.monitoring.register_callback(self.tool_id, sys.monitoring.events.RAISE, None)
+        sys.monitoring.register_callback(self.tool_id, sys.monitoring.events.PY_UNWIND, None)
+        sys.monitoring.free_tool_id(self.tool_id)
+        self.tool_id = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def reset(self):
+        self._sites_by_offset.clear()
+        self.sites.clear()
+
+    def break_at(self, target, nth=1, lineno=None, exc_type=None, action=None):
+        """
+        Open IPS in the raising frame at the `nth` raise of a site.
+
+        :param target:      function, method or code object which contains the site
+        :param nth:         int
+        :param lineno:      optional absolute line number (default: every line of `target`)
+        :param exc_type:    optional exception class (subclasses match, too)
+        :param action:      optional callable(frame, exception) (default: open IPS in the frame)
+        """
+        self._breaks.setdefault(_get_code(target), []).append([nth, lineno, exc_type, action, 0])
+
+    # note: the callbacks are called for every raise of the interpreter -> keep them lean
+
+    def _unwind_callback(self, code, instruction_offset, exception):
+        self._unwinding = exception
+
+    def _raise_callback(self, code, instruction_offset, exception):
+        unwinding = self._unwinding
+        self._unwinding = None
+        if unwinding is exception:
+            # the exception propagates through this frame (it was raised in a called frame)
+            return
+
+        site = self._sites_by_offset.get((code, instruction_offset))
+        if site is None:
+            site = self._new_site(code, instruction_offset, sys._getframe(1))
+        exc_type = type(exception)
+        site.counts[exc_type] = site.counts.get(exc_type, 0) + 1
+
+        if code in self._breaks:
+            self._check_breaks(code, site, exception)
+
+    def _new_site(self, code, instruction_offset, frame):
+        lineno = frame.f_lineno
+        site = self.sites.get((code, lineno))
+        if site is None:
+            site = self.sites[(code, lineno)] = RaiseSite(code, lineno)
+            if self.context:
+                site.context = format_frames([frame], code_context=self.code_context, theme_name=self.theme_name)[0]
+        self._sites_by_offset[(code, instruction_offset)] = site
+        return site
+
+    def _check_breaks(self, code, site, exception):
+        for brk in self._breaks[code]:
+            nth, lineno, exc_type, action, hits = brk
+            if lineno is not None and lineno != site.lineno:
+                continue
+            if exc_type is not None and not isinstance(exception, exc_type):
+                continue
+            brk[4] = hits = hits + 1
+            if hits == nth:
+                frame = sys._getframe(2)
+                if action is None:
+                    print("\n--- ipydex: raise #{} of {!r} at {} ---".format(hits, exception, site))
+                    IPS(frame=frame)
+                else:
+                    action(frame, exception)
+
+    def per_type(self):
+        """
+        :return:    list of (exception type, count) sorted by count
+        """
+        res = collections.Counter()
+        for site in self.sites.values():
+            res.update(site.counts)
+        return res.most_common()
+
+    def top(self, n=10):
+        """
+        :return:    list of the `n` sites with the most raises
+        """
+        return sorted(self.sites.values(), key=lambda site: site.total, reverse=True)[:n]
+
+    def render(self, n=10, print_res=True):
+        """
+        Format the top `n` raise sites (with source context) and the totals per exception type.
+
+        :return:    str
+        """
+        parts = []
+        for site in self.top(n):
+            types_str = ", ".join(
+                "{} ({})".format(exc_type.__name__, count)
+                for exc_type, count in sorted(site.counts.items(), key=lambda item: item[1], reverse=True)
+            )
+            parts.append("--- {}x: {} ---".format(site.total, types_str))
+            if site.context is None:
+                parts.append("{}:{} in {}\n".format(site.code.co_filename, site.lineno, site.code.co_name))
+            else:
+                parts.append(site.context)
+
+        parts.append("--- total per exception type ---")
+        for exc_type, count in self.per_type():
+            parts.append("{:>10}  {}".format(count, exc_type.__name__))
+        res = "\n".join(parts)
+        if print_res:
+            print(res)
+        return res
+
+
+def _bench_target(n):
+    res = 0
+    for i in range(n):
+        res += i % 7
+    return res
+
+
+def _bench_unrelated(n):
+    res = 0
+    for i in range(n):
+        res += i % 7
+    return res
+
+
+def benchmark_breakpoints(n=200000, repeat=5, print_res=True):
+    """
+    Measure the runtime of a hot loop (`_bench_unrelated`) and of a function with a line breakpoint
+    (`_bench_target`) in the following situations: no breakpoints, disabled breakpoint, armed breakpoint (with a
+    condition which never holds), armed breakpoint with a hit-count condition (`ignore`), spent breakpoint
+    (`max_hits` reached) and for comparison an active `sys.settrace` function.
+
+    :return:    dict {situation: (best time of `_bench_target`, best time of `_bench_unrelated`)}
+    """
+    import timeit
+
+    def best(func):
+        return min(timeit.repeat(lambda: func(n), number=1, repeat=repeat))
+
+    def measure():
+        return best(_bench_target), best(_bench_unrelated)
+
+    res = {"no breakpoints": measure()}
+
+    lineno = _bench_target.__code__.co_firstlineno + 3
+    with BreakpointManager() as bpm:
+        bp = bpm.add(_bench_target, lineno=lineno, condition="i < 0")
+        res["armed breakpoint"] = measure()
+        bpm.disable(bp)
+        res["disabled breakpoint"] = measure()
+        bpm.remove(bp)
+
+        bp = bpm.add(_bench_target, lineno=lineno, condition="i < 0", ignore=n * repeat * 2)
+        res["armed, ignore count"] = measure()
+        bpm.remove(bp)
+
+        bp = bpm.add(_bench_target, lineno=lineno, action=lambda frame, bp: None, max_hits=1)
+        res["spent breakpoint"] = measure()
+
+    def tracer(frame, event, arg):
+        return tracer
+
+    sys.settrace(tracer)
+    try:
+        res["sys.settrace"] = measure()
+    finally:
+        sys.settrace(None)
+
+    if print_res:
+        base_target, base_unrelated = res["no breakpoints"]
+        print("{:<22} {:>12} {:>10} {:>12} {:>10}".format("", "target [s]", "slowdown", "unrelated [s]", "slowdown"))
+        for key, (t_target, t_unrelated) in res.items():
+            print("{:<22} {:>12.4f} {:>9.2f}x {:>12.4f} {:>9.2f}x".format(
+                key, t_target, t_target / base_target, t_unrelated, t_unrelated / base_unrelated
+            ))
+    return res
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains low-overhead profiling tools which complement the interactive tools of ipydex.
+
+typical use case:
+
+from ipydex.profiling import StackSampler
+
+with StackSampler(interval=0.01) as sampler:
+    some_slow_function()
+
+sampler.print_top()
+sampler.export_collapsed("stacks.txt")  # input for flamegraph.pl, speedscope, ...
+"""
+
+import collections
+import sys
+import threading
+import time
+
+
+class StackSampler(object):
+    """
+    Background thread which periodically captures the raw stacks of selected threads via `sys._current_frames()`.
+
+    Only tuples (co_filename, co_name, f_lineno) are stored (no frame references, no formatting). Samples are
+    aggregated into a table {(thread_id, stack): count} where `stack` is ordered from the outermost to the
+    innermost frame.
+    """
+
+    def __init__(self, interval=0.01, threads=None, max_depth=200):
+        """
+        :param interval:    sampling interval in seconds (default: 0.01 -> 100 Hz)
+        :param threads:     optional sequence of `threading.Thread` objects or thread idents which should be
+                            sampled (default: all threads except the sampler itself)
+        :param max_depth:   maximum number of (innermost) frames which are recorded per sample
+        """
+        self.interval = interval
+        self.max_depth = max_depth
+        if threads is None:
+            self.thread_ids = None
+        else:
+            self.thread_ids = {getattr(t, "ident", t) for t in threads}
+
+        self.samples = collections.Counter()
+        self.n_samples = 0
+        self.wall_time = 0.0
+        self.sampler_cpu_time = 0.0
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._start_time = None
+
+    def start(self):
+        assert self._thread is None, "sampler is already running"
+        self._stop_event.clear()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="ipydex-stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return self
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        self.wall_time += time.perf_counter() - self._start_time
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        cpu_start = time.thread_time()
+        wait = self._stop_event.wait
+        while not wait(self.interval):
+            self._take_sample(own_id)
+        self.sampler_cpu_time += time.thread_time() - cpu_start
+
+    def _take_sample(self, own_id):
+        max_depth = self.max_depth
+        thread_ids = self.thread_ids
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or (thread_ids is not None and thread_id not in thread_ids):
+                continue
+            stack = []
+            while frame is not None and len(stack) < max_depth:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples[(thread_id, tuple(stack))] += 1
+        self.n_samples += 1
+
+    @property
+    def overhead(self):
+        """
+        CPU time consumed by the sampler thread relative to the sampled wall time
+        """
+        if self.wall_time == 0:
+            return 0.0
+        return self.sampler_cpu_time / self.wall_time
+
+    def collapsed(self, include_lineno=True, include_thread=False):
+        """
+        Return the samples as collapsed stacks {"outer;middle;inner": count}
+        (the format expected by flamegraph.pl and speedscope).
+
+        :param include_lineno:  bool; whether to distinguish frames by line number
+        :param include_thread:  bool; whether to prefix each stack with the thread id
+        """
+
+        res = collections.Counter()
+        for (thread_id, stack), count in self.samples.items():
+            if include_lineno:
+                parts = ["{}:{}:{}".format(name, filename, lineno) for filename, name, lineno in stack]
+            else:
+                parts = ["{}:{}".format(name, filename) for filename, name, lineno in stack]
+            if include_thread:
+                parts.insert(0, "thread-{}".format(thread_id))
+            res[";".join(parts)] += count
+        return res
+
+    def export_collapsed(self, fname=None, **kwargs):
+        """
+        Return the collapsed stacks as text (one line per stack: "<stack> <count>") and optionally write it to a
+        file. Keyword arguments are passed to `collapsed`.
+        """
+        txt = "\n".join("{} {}".format(stack, count) for stack, count in self.collapsed(**kwargs).most_common())
+        if fname is not None:
+            with open(fname, "w") as txtfile:
+                txtfile.write(txt + "\n")
+        return txt
+
+    def top(self, n=10):
+        """
+        Return the n innermost frames (filename, name, lineno) which occurred most often together with their count.
+        """
+        res = collections.Counter()
+        for (thread_id, stack), count in self.samples.items():
+            if stack:
+                res[stack[-1]] += count
+        return res.most_common(n)
+
+    def print_top(self, n=10):
+        total = sum(self.samples.values()) or 1
+        print("{} samples in {:.2f}s (sampler overhead: {:.2%})".format(self.n_samples, self.wall_time, self.overhead))
+        for (filename, name, lineno), count in self.top(n):
+            print("{:6.1%}  {}:{} ({})".format(count / total, filename, lineno, name))
+
+
+def sample_stacks(interval=0.01, threads=None, max_depth=200):
+    """
+    Convenience function: return a started `StackSampler` (call `.stop()` at the end of the region of interest).
+    """
+    return StackSampler(interval=interval, threads=threads, max_depth=max_depth).start()
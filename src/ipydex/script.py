@@ -0,0 +1,80 @@
+"""
+This module contains the `ipydex` command line script (see pyproject.toml).
+"""
+
+import argparse
+import sys
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="ipydex", description="ipydex command line interface")
+    subparsers = parser.add_subparsers(dest="command")
+
+    from . import benchmarks
+
+    bench_parser = subparsers.add_parser("bench", help="run the benchmark suite")
+    bench_parser.add_argument("-n", "--repeat", type=int, default=5, help="number of samples per benchmark")
+    bench_parser.add_argument("-o", "--output", metavar="JSON", help="write the results to this file")
+    bench_parser.add_argument(
+        "--compare", metavar="JSON", help="compare the medians with a previous result (e.g. of the last release)"
+    )
+    bench_parser.add_argument(
+        "--only", nargs="+", choices=list(benchmarks.BENCHMARKS), metavar="NAME",
+        help="run only these benchmarks ({})".format(", ".join(benchmarks.BENCHMARKS)),
+    )
+    bench_parser.add_argument("--quick", action="store_true", help="use small problem sizes")
+    for key, value in benchmarks.DEFAULT_PARAMS.items():
+        bench_parser.add_argument(
+            "--{}".format(key.replace("_", "-")), type=int, default=None, help="problem size (default: {})".format(value)
+        )
+
+    collector_parser = subparsers.add_parser("collector", help="crash snapshot collector (see ipydex.collector)")
+    collector_parser.add_argument(
+        "action", choices=["serve", "list", "view"], help="run the daemon, list or view the stored snapshots"
+    )
+    collector_parser.add_argument("fingerprint", nargs="?", help="(prefix of the) fingerprint for `view`")
+    collector_parser.add_argument(
+        "-a", "--address", default=None, help="unix:<path> or tcp:<host>:<port> (default: $IPYDEX_COLLECTOR or "
+        "a unix socket in the temp directory)"
+    )
+    collector_parser.add_argument("--db", metavar="JSONL", help="file for persistence of the snapshots (serve)")
+    collector_parser.add_argument("--frame", type=int, default=-1, help="index of the frame (view)")
+
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 0
+
+    if args.command == "bench":
+        params = {key: getattr(args, key) for key in benchmarks.DEFAULT_PARAMS if getattr(args, key) is not None}
+        res = benchmarks.run_suite(names=args.only, repeat=args.repeat, quick=args.quick, **params)
+        if args.output:
+            benchmarks.write_json(res, args.output)
+            print("\nresults written to", args.output)
+        if args.compare:
+            benchmarks.compare(res, args.compare)
+
+    elif args.command == "collector":
+        from . import collector
+
+        if args.action == "serve":
+            server = collector.CollectorServer(args.address, fname=args.db)
+            print("collecting crash snapshots at", server.address)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.close()
+        elif args.action == "list":
+            collector.list_snapshots(args.address)
+        else:
+            if args.fingerprint is None:
+                parser.error("`ipydex collector view` needs a fingerprint")
+            collector.view_snapshot(collector.get_snapshot(args.fingerprint, args.address), args.frame)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
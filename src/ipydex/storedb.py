@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains a single-file (sqlite) backend for `shell.db` which is used by the `%store` magic.
+
+IPython's default backend (pickleshare) stores every key in a separate file and lists directories to find the
+keys. This becomes slow with many stored variables (especially on network file systems). `SQLiteStoreDB` keeps
+all entries in one file with an index on the keys.
+
+The backend is activated for the shells of ipydex via:
+
+import ipydex
+ipydex.module_config.STORE_BACKEND = "sqlite"
+"""
+
+import os
+import pickle
+import sqlite3
+
+
+STORE_FILE_NAME = "ipydex_store.sqlite"
+
+
+class SQLiteStoreDB(object):
+    """
+    Dict-like persistent store which provides the subset of the `PickleShareDB` interface used by IPython.
+    Values are pickled. Keys are strings like "autorestore/x".
+    """
+
+    def __init__(self, path):
+        """
+        :param path:    file name of the database (created if necessary)
+        """
+        self.path = path
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+
+        # `timeout`: wait for locks of other processes (instead of failing immediately)
+        self.con = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self.con:
+            # primary key -> the keys are indexed (this also serves prefix globs like "autorestore/*")
+            self.con.execute("CREATE TABLE IF NOT EXISTS store (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def __getitem__(self, key):
+        row = self.con.execute("SELECT value FROM store WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.con:
+            self.con.execute("INSERT OR REPLACE INTO store (key, value) VALUES (?, ?)", (key, data))
+
+    def __delitem__(self, key):
+        with self.con:
+            cursor = self.con.execute("DELETE FROM store WHERE key = ?", (key,))
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.con.execute("SELECT 1 FROM store WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return self.con.execute("SELECT COUNT(*) FROM store").fetchone()[0]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self, globpat=None):
+        """
+        :param globpat:     optional glob pattern (e.g. "autorestore/*")
+        :return:            list of keys
+        """
+        if globpat is None:
+            rows = self.con.execute("SELECT key FROM store ORDER BY key")
+        else:
+            rows = self.con.execute("SELECT key FROM store WHERE key GLOB ? ORDER BY key", (globpat,))
+        return [row[0] for row in rows]
+
+    def raw_items(self, globpat):
+        """
+        Return a list of (key, pickled value) for all keys which match `globpat` (one query).
+        """
+        rows = self.con.execute("SELECT key, value FROM store WHERE key GLOB ? ORDER BY key", (globpat,))
+        return rows.fetchall()
+
+    def items(self, globpat="*"):
+        return [(key, pickle.loads(data)) for key, data in self.raw_items(globpat)]
+
+    def update(self, other):
+        data = [(k, pickle.dumps(v, protocol=pickle.HIGHEST_PROTOCOL)) for k, v in other.items()]
+        with self.con:
+            self.con.executemany("INSERT OR REPLACE INTO store (key, value) VALUES (?, ?)", data)
+
+    def close(self):
+        self.con.close()
+
+    def __repr__(self):
+        return "<SQLiteStoreDB {}>".format(self.path)
+
+
+# {path: SQLiteStoreDB}
+_store_dbs = {}
+
+
+def get_store_db(shell, path=None, migrate=True):
+    """
+    Return the (cached) store for `shell`.
+
+    :param shell:   IPython shell
+    :param path:    optional file name (default: ipydex_store.sqlite in the profile directory of the shell)
+    :param migrate: bool; if True and the file does not yet exist, the entries of IPython's pickleshare
+                    store are imported
+    """
+    if path is None:
+        path = os.path.join(shell.profile_dir.location, STORE_FILE_NAME)
+
+    db = _store_dbs.get(path)
+    if db is None:
+        is_new = not os.path.exists(path)
+        db = _store_dbs[path] = SQLiteStoreDB(path)
+        if is_new and migrate:
+            import_pickleshare(db, os.path.join(shell.profile_dir.location, "db"))
+    return db
+
+
+def import_pickleshare(db, pickleshare_dir):
+    """
+    Copy all (readable) entries of a pickleshare directory into `db`.
+
+    :return:    number of imported entries
+    """
+    if not os.path.isdir(pickleshare_dir):
+        return 0
+
+    try:
+        from IPython.external.pickleshare import PickleShareDB
+    except ImportError:
+        from pickleshare import PickleShareDB
+
+    source = PickleShareDB(pickleshare_dir)
+    entries = {}
+    for key in source.keys():
+        try:
+            entries[key] = source[key]
+        except Exception:
+            # e.g. objects of classes which are not importable anymore
+            pass
+    db.update(entries)
+    return len(entries)
+
+
+def restore_autorestore(shell):
+    """
+    Load the stored variables (keys "autorestore/*") into `shell.user_ns` with a single query.
+
+    :return:    list of restored names
+    """
+    names = []
+    for key, data in shell.db.raw_items("autorestore/*"):
+        name = key.split("/")[-1]
+        try:
+            obj = pickle.loads(data)
+        except Exception as ex:
+            print("Unable to restore variable '{}', ignoring (use %store -d to forget!)".format(name))
+            print("The error was:", type(ex))
+            continue
+        shell.user_ns[name] = obj
+        names.append(name)
+    return names
@@ -1,5 +1,9 @@
 from colorama import Style, Back, Fore
+import codecs
+import collections
 import os
+import threading
+import time
 
 
 def hl(txt, k="g"):
@@ -16,24 +20,177 @@ def hl(txt, k="g"):
     return f"{start}{txt2}{end}"
 
 
-def compare_strings(str1, str2, n=25):
-    # Find the index of the first difference
-    idx = next((i for i in range(min(len(str1), len(str2))) if str1[i] != str2[i]), None)
+def find_first_difference(str1, str2, start=0, chunk_size=2**16):
+    """
+    Return the index of the first difference of two strings (or sequences) at or after `start`
+    (or None if there is no difference).
 
-    if idx is None:
-        if len(str1) == len(str2):
+    The strings are compared chunk-wise via slice equality (which runs in C). Inside a differing chunk the
+    position is narrowed by bisection. If one string is a prefix of the other the length of the shorter string
+    is returned.
+    """
+    n = min(len(str1), len(str2))
+    if start == 0 and str1 == str2:
+        return None
+
+    pos = start
+    while pos < n:
+        end = min(pos + chunk_size, n)
+        if str1[pos:end] != str2[pos:end]:
+            lo, hi = pos, end
+            while hi - lo > 32:
+                mid = (lo + hi) // 2
+                if str1[lo:mid] != str2[lo:mid]:
+                    hi = mid
+                else:
+                    lo = mid
+            for i in range(lo, hi):
+                if str1[i] != str2[i]:
+                    return i
+        pos = end
+
+    if len(str1) != len(str2) and start <= n:
+        return n
+    return None
+
+
+def find_differences(str1, str2, max_regions=10, min_gap=1, max_region_length=1000, chunk_size=2**16):
+    """
+    Return a list of differing regions `(start, end)` (at most `max_regions`).
+
+    Strings are compared position by position (no alignment). Regions which are separated by less than
+    `min_gap` equal characters are merged. Regions are truncated after `max_region_length` characters
+    (e.g. after an insertion the rest of the strings differs).
+    """
+    n = min(len(str1), len(str2))
+    regions = []
+    pos = 0
+    while len(regions) < max_regions:
+        idx = find_first_difference(str1, str2, start=pos, chunk_size=chunk_size)
+        if idx is None:
+            break
+        if idx >= n:
+            # one string is longer
+            regions.append((idx, max(len(str1), len(str2))))
+            break
+
+        # exclusive end of the region (last differing position + 1)
+        end = idx + 1
+        limit = min(n, idx + max_region_length)
+        j = end
+        while j < limit:
+            if str1[j] != str2[j]:
+                end = j + 1
+            elif j + 1 - end >= min_gap:
+                break
+            j += 1
+        regions.append((idx, end))
+        pos = j
+    return regions
+
+
+def _line_and_col(txt, idx, last=(0, 1)):
+    """
+    Return (line, column) (both 1-based) of `idx`. `last` is a previously computed (idx, line) pair which is
+    used to count only the newlines in between.
+    """
+    last_idx, last_line = last
+    if idx < last_idx:
+        last_idx, last_line = 0, 1
+    line = last_line + txt.count("\n", last_idx, idx)
+    col = idx - (txt.rfind("\n", 0, idx) + 1) + 1
+    return line, col
+
+
+def compare_strings(str1, str2, n=25, lines=False, max_regions=1, print_res=True):
+    """
+    Find and print differences of two strings (with `n` characters of context).
+
+    :param str1:            first string
+    :param str2:            second string
+    :param n:               number of context characters
+    :param lines:           bool; if True report line and column and do not show context beyond the line
+    :param max_regions:     maximum number of reported differing regions
+    :param print_res:       bool; print the result
+    :return:                list of Containers (index, end, line, col) (empty if the strings are identical)
+    """
+    from .core import Container
+
+    regions = find_differences(str1, str2, max_regions=max_regions, min_gap=max(1, n))
+    if not regions:
+        if print_res:
             print("The strings are identical.")
-            return
-        idx = min(len(str1), len(str2))
+        return []
+
+    res = []
+    last = (0, 1)
+    for k, (idx, end) in enumerate(regions):
+        line = col = None
+        ctx_start = max(0, idx - n)
+        # show at most 3*n differing characters
+        ctx_end = min(max(len(str1), len(str2)), min(end, idx + 3 * n) + n)
+        if lines:
+            ref = str1 if idx < len(str1) else str2
+            line, col = _line_and_col(ref, idx, last)
+            last = (idx, line)
+
+        res.append(Container(index=idx, end=end, line=line, col=col))
+        if not print_res:
+            continue
+
+        if lines:
+            print(f"{'First d' if k == 0 else 'D'}ifference at line {line}, column {col} (index {idx}):")
+        else:
+            print(f"{'First d' if k == 0 else 'D'}ifference at index {idx}:")
+        for txt, color in ((str1, "g"), (str2, "y")):
+            start, stop = ctx_start, ctx_end
+            if lines:
+                # restrict the context to the current line
+                start = max(start, txt.rfind("\n", 0, min(idx, len(txt))) + 1)
+                line_end = txt.find("\n", idx)
+                if line_end != -1:
+                    stop = min(stop, max(line_end, end))
+            print(f"{txt[start:idx]}{hl(txt[idx:stop], color)}")
+    return res
+
+
+def benchmark_compare_strings(nbytes=100 * 2**20, repeat=3, naive=True, print_res=True):
+    """
+    Compare two strings of `nbytes` characters which differ near the end and near the middle.
 
-    # Calculate the start and end indices for context
-    start = max(0, idx - n)
-    end = min(max(len(str1), len(str2)), idx + n + 1)
+    :param naive:   bool; also measure the old character-by-character generator (slow)
+    :return:        dict {method: best time in seconds}
+    """
+    import timeit
 
-    # Print the context
-    print(f"First difference at index {idx}:")
-    print(f"{str1[start:idx]}{hl(str1[idx:end], 'g')}")
-    print(f"{str2[start:idx]}{hl(str2[idx:end], 'y')}")
+    block = "".join(chr(ord("a") + i % 26) for i in range(1000)) + "\n"
+    str1 = block * (nbytes // len(block))
+    str2 = list(str1)
+    str2[len(str1) // 2] = "#"
+    str2[-10] = "#"
+    str2 = "".join(str2)
+
+    def naive_first_difference():
+        return next((i for i in range(min(len(str1), len(str2))) if str1[i] != str2[i]), None)
+
+    def best(func, repeat=repeat):
+        return min(timeit.repeat(func, number=1, repeat=repeat))
+
+    res = {
+        "find_first_difference": best(lambda: find_first_difference(str1, str2)),
+        "find_differences": best(lambda: find_differences(str1, str2, max_regions=10)),
+        "compare_strings(lines=True)": best(
+            lambda: compare_strings(str1, str2, lines=True, max_regions=10, print_res=False)
+        ),
+    }
+    if naive:
+        res["naive generator"] = best(naive_first_difference, repeat=1)
+
+    if print_res:
+        print(f"string length: {len(str1) / 2**20:.1f} MiB")
+        for key, value in res.items():
+            print(f"{key:<30} {value:8.4f} s")
+    return res
 
 
 def regex_a_in_b(a_pattern_str:str, b_target_str:str) -> bool:
@@ -48,9 +205,114 @@ def regex_a_in_b(a_pattern_str:str, b_target_str:str) -> bool:
     # return bool(regex.search(b))
 
 
-def get_out_and_err_of_command(cmd, _input=None, env: dict = None, extra_env: dict = None, returncode=False):
+def get_out_and_err_of_command(
+    cmd, _input=None, env: dict = None, extra_env: dict = None, returncode=False, timeout=None
+):
+    """
+    Run `cmd` and return the decoded stdout and stderr (and optionally the returncode).
+    See `run_command` for streaming, bounded capturing and timing information.
+    """
+
+    res = run_command(cmd, _input=_input, env=env, extra_env=extra_env, timeout=timeout)
+
+    if returncode:
+        return res.stdout, res.stderr, res.returncode
+    return res.stdout, res.stderr
+
+
+class _CaptureBuffer(object):
+    """
+    Keeps the last `max_chars` characters of a stream (all characters if `max_chars` is None).
+    """
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars
+        self.chunks = collections.deque()
+        self.size = 0
+        # number of characters which were dropped from the beginning
+        self.dropped = 0
+
+    def append(self, txt):
+        self.chunks.append(txt)
+        self.size += len(txt)
+        if self.max_chars is None:
+            return
+        while self.size > self.max_chars:
+            excess = self.size - self.max_chars
+            first = self.chunks[0]
+            if len(first) <= excess:
+                self.chunks.popleft()
+                excess = len(first)
+            else:
+                self.chunks[0] = first[excess:]
+            self.size -= excess
+            self.dropped += excess
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+
+def _read_stream(stream, buffer, callback, encoding, errors):
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    partial_line = ""
+    while True:
+        # returns what is available (at most 64 KiB), b"" means EOF
+        data = stream.read1(2**16)
+        txt = decoder.decode(data, final=not data)
+        if txt:
+            buffer.append(txt)
+            if callback is not None:
+                lines = (partial_line + txt).split("\n")
+                partial_line = lines.pop()
+                for line in lines:
+                    callback(line)
+        if not data:
+            break
+    if callback is not None and partial_line:
+        callback(partial_line)
+    stream.close()
+
+
+def _write_input(stream, data):
+    try:
+        if data:
+            stream.write(data)
+    except (BrokenPipeError, OSError):
+        # the process does not read its input
+        pass
+    finally:
+        try:
+            stream.close()
+        except (BrokenPipeError, OSError):
+            pass
+
+
+def run_command(
+    cmd, _input=None, env: dict = None, extra_env: dict = None, timeout=None, on_stdout=None, on_stderr=None,
+    max_capture=None, encoding="utf-8", errors="replace", cwd=None,
+):
+    """
+    Run `cmd` and capture its output while it is produced (incremental decoding, no `communicate`).
+
+    :param cmd:             command (list of str or str)
+    :param _input:          optional bytes or str which is written to stdin
+    :param env:             optional environment (default: copy of `os.environ`)
+    :param extra_env:       optional dict which updates the environment
+    :param timeout:         optional time in seconds after which the process is killed
+    :param on_stdout:       optional callable(line) which is called (from a reader thread) for every line of
+                            stdout (without the trailing newline)
+    :param on_stderr:       like `on_stdout` for stderr
+    :param max_capture:     optional maximum number of captured characters per stream (the last characters are
+                            kept); None means unbounded
+    :param encoding:        encoding of the output
+    :param errors:          error handling of the decoder
+    :param cwd:             optional working directory
+    :return:                Container with the attributes cmd, returncode, stdout, stderr, stdout_dropped,
+                            stderr_dropped (number of dropped characters), timed_out, start_time (epoch) and
+                            duration (seconds)
+    """
     import subprocess
-    import os
+    from .core import Container
 
     if env is None:
         env = os.environ.copy()
@@ -58,16 +320,73 @@ def get_out_and_err_of_command(cmd, _input=None, env: dict = None, extra_env: di
     if extra_env is not None:
         env.update(extra_env)
 
-    p = subprocess.Popen(cmd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if isinstance(_input, str):
+        _input = _input.encode(encoding)
 
-    out, err = p.communicate(_input)
+    start_time = time.time()
+    t0 = time.perf_counter()
+    p = subprocess.Popen(
+        cmd, env=env, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
 
-    out = out.decode("UTF-8")
-    err = err.decode("UTF-8")
+    buffers = [_CaptureBuffer(max_capture), _CaptureBuffer(max_capture)]
+    threads = [
+        threading.Thread(target=_read_stream, args=(p.stdout, buffers[0], on_stdout, encoding, errors), daemon=True),
+        threading.Thread(target=_read_stream, args=(p.stderr, buffers[1], on_stderr, encoding, errors), daemon=True),
+        threading.Thread(target=_write_input, args=(p.stdin, _input), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    timed_out = False
+    try:
+        p.wait(timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        p.kill()
+        p.wait()
+
+    for thread in threads:
+        # child processes which inherited the pipes might keep them open
+        thread.join(None if not timed_out else 1.0)
+
+    return Container(
+        cmd=cmd,
+        returncode=p.returncode,
+        stdout=buffers[0].getvalue(),
+        stderr=buffers[1].getvalue(),
+        stdout_dropped=buffers[0].dropped,
+        stderr_dropped=buffers[1].dropped,
+        timed_out=timed_out,
+        start_time=start_time,
+        duration=time.perf_counter() - t0,
+    )
+
+
+def run_commands(cmds, max_workers=None, on_result=None, **kwargs):
+    """
+    Run several commands concurrently (see `run_command` for the keyword arguments).
+
+    :param cmds:            sequence of commands
+    :param max_workers:     maximum number of concurrently running processes (default: number of CPUs)
+    :param on_result:       optional callable(result) which is called when a command has finished
+    :return:                list of results (in the order of `cmds`)
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    cmds = list(cmds)
+    results = [None] * len(cmds)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(cmds) or 1))) as executor:
+        futures = {executor.submit(run_command, cmd, **kwargs): i for i, cmd in enumerate(cmds)}
+        for future in as_completed(futures):
+            res = results[futures[future]] = future.result()
+            if on_result is not None:
+                on_result(res)
+    return results
 
-    if returncode:
-        return out, err, p.returncode
-    return out, err
 
 def get_clipboard_content():
 
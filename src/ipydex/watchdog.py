@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module contains a watchdog which dumps the stacks of all threads (formatted like `calling_stack_info`)
+if the monitored thread does not report progress in time.
+
+typical use case:
+
+from ipydex.watchdog import HangWatchdog
+
+wd = HangWatchdog(deadline=30, fname="hang.txt")
+
+with wd:
+    for item in work_items:
+        process(item)
+        wd.heartbeat()  # re-arm
+"""
+
+import os
+import queue
+import sys
+import threading
+import time
+
+from .core import generate_frame_list_info, IPS
+
+
+class HangWatchdog(object):
+    """
+    Watchdog thread with a configurable deadline. If the deadline is missed, the stacks of all threads are
+    written to a file (and optionally an IPython shell is opened in the frame of the stalled thread).
+
+    All formatting happens in the watchdog thread (not in the stalled one) and is bounded by `format_timeout`.
+    If formatting takes longer, raw stacks (filename, line number, function) are written instead.
+    """
+
+    def __init__(self, deadline=10.0, fname=None, code_context=1, format_timeout=2.0, open_ips=False):
+        """
+        :param deadline:        time in seconds after which the armed thread is considered as stalled
+        :param fname:           file to which the stacks are appended (default: ipydex_hang_<pid>.txt)
+        :param code_context:    number of source lines per frame
+        :param format_timeout:  time budget (seconds) for formatting the stacks of all threads
+        :param open_ips:        bool; if True and a TTY is attached, open IPS in the frame of the stalled thread
+        """
+        if fname is None:
+            fname = "ipydex_hang_{}.txt".format(os.getpid())
+
+        self.deadline = deadline
+        self.fname = fname
+        self.code_context = code_context
+        self.format_timeout = format_timeout
+        self.open_ips = open_ips
+
+        # number of times the deadline was missed
+        self.n_dumps = 0
+
+        self._condition = threading.Condition()
+        self._expiry = None
+        self._armed_thread_id = None
+        self._closed = False
+        self._thread = None
+
+    def arm(self, deadline=None):
+        """
+        (Re-)arm the watchdog for the calling thread.
+
+        :param deadline:    optional new deadline (seconds)
+        """
+        with self._condition:
+            if deadline is not None:
+                self.deadline = deadline
+            self._armed_thread_id = threading.get_ident()
+            self._expiry = time.monotonic() + self.deadline
+            self._ensure_thread()
+            self._condition.notify()
+
+    # re-arming is the natural way to signal progress
+    heartbeat = arm
+
+    def disarm(self):
+        with self._condition:
+            self._expiry = None
+            self._condition.notify()
+
+    def close(self):
+        """
+        Stop the watchdog thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._expiry = None
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        self.arm()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.disarm()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._closed = False
+            self._thread = threading.Thread(target=self._run, name="ipydex-hang-watchdog", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._expiry is None:
+                        self._condition.wait()
+                        continue
+                    remaining = self._expiry - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._closed:
+                    return
+                stalled_thread_id = self._armed_thread_id
+                missed_deadline = self.deadline
+                # fire only once per arming
+                self._expiry = None
+
+            self.n_dumps += 1
+            self._dump(stalled_thread_id, missed_deadline)
+
+    def _dump(self, stalled_thread_id, missed_deadline):
+        frames = sys._current_frames()
+        frames.pop(threading.get_ident(), None)
+        stalled_frame = frames.get(stalled_thread_id)
+
+        txt = format_thread_stacks(
+            frames, stalled_thread_id, code_context=self.code_context, timeout=self.format_timeout
+        )
+        header = "--- ipydex hang watchdog: deadline of {}s missed ({}) ---\n".format(missed_deadline, time.ctime())
+
+        with open(self.fname, "a") as txtfile:
+            txtfile.write(header)
+            txtfile.write(txt)
+            txtfile.write("\n-- --\n")
+
+        if self.open_ips and stalled_frame is not None and sys.stdin is not None and sys.stdin.isatty():
+            print(header, "stacks written to", self.fname)
+            IPS(frame=stalled_frame)
+        del frames, stalled_frame
+
+
+def _thread_names():
+    return {t.ident: t.name for t in threading.enumerate()}
+
+
+def _format_raw_stack(frame):
+    lines = []
+    while frame is not None:
+        lines.append('  File "{}", line {}, in {}'.format(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
+    lines.reverse()
+    return "\n".join(lines)
+
+
+class _FormatJob(object):
+    """
+    Formatting of the stacks of several threads (executed by the formatter thread, see `_FormatterThread`).
+    """
+
+    def __init__(self, frames, code_context):
+        self.frames = frames
+        self.code_context = code_context
+        # {thread_id: tb_txt}
+        self.formatted = {}
+        self.done = threading.Event()
+
+    def cancel(self):
+        # the remaining stacks are skipped and the frames are released
+        self.frames = None
+
+    def run(self):
+        try:
+            for thread_id in list(self.frames or ()):
+                frames = self.frames
+                if frames is None:
+                    break
+                fli = generate_frame_list_info(frames[thread_id], self.code_context, theme_name="nocolor")
+                self.formatted[thread_id] = fli.tb_txt
+                del frames
+        finally:
+            self.done.set()
+
+
+class _FormatterThread(object):
+    """
+    Single daemon thread which executes the formatting jobs of `format_thread_stacks` one after another.
+
+    A job which misses its timeout is cancelled but the thread cannot be interrupted (e.g. while it waits for a slow
+    file system). Later jobs wait in the queue (and time out, too) instead of starting further threads, i.e. at most
+    one formatter thread exists.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, job):
+        with self._lock:
+            # (a thread does not survive a fork)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ipydex-stack-formatter", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            job.run()
+            del job
+
+
+_formatter_thread = _FormatterThread()
+
+
+def format_thread_stacks(frames, marked_thread_id=None, code_context=1, timeout=2.0):
+    """
+    Format the stacks of several threads like `calling_stack_info` (without colors) within a time budget.
+    The formatting happens in a (reused) formatter thread.
+
+    :param frames:              dict {thread_id: frame} (like the result of `sys._current_frames()`)
+    :param marked_thread_id:    optional; this thread is marked as "[stalled]"
+    :param code_context:        number of source lines per frame
+    :param timeout:             time budget in seconds; threads which could not be formatted in time are
+                                rendered as raw stacks
+    :return:                    str
+    """
+
+    names = _thread_names()
+
+    # formatting might be slow (e.g. source files on slow file systems) -> do it in the formatter thread
+    job = _FormatJob(dict(frames), code_context)
+    _formatter_thread.submit(job)
+    job.done.wait(timeout)
+    job.cancel()
+    # ignore results which arrive later
+    formatted = dict(job.formatted)
+
+    parts = []
+    for thread_id, frame in frames.items():
+        mark = " [stalled]" if thread_id == marked_thread_id else ""
+        parts.append("=== Thread {} ({}){} ===".format(names.get(thread_id, "?"), thread_id, mark))
+        tb_txt = formatted.get(thread_id)
+        if tb_txt is None:
+            parts.append("(formatting timed out; raw stack)\n" + _format_raw_stack(frame))
+        else:
+            parts.append(tb_txt)
+        parts.append("")
+    return "\n".join(parts)
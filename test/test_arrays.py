@@ -0,0 +1,82 @@
+import unittest
+
+try:
+    import numpy as np
+    from ipydex import arrays
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "numpy is not available")
+class TestWatchedArray(unittest.TestCase):
+
+    def setUp(self):
+        self.hits = []
+
+    def record(self, frame, arr, index, values):
+        self.hits.append((frame.f_code.co_name, index, values.size))
+
+    def test_setitem(self):
+        x = arrays.watch_array(np.zeros(1000), action=self.record)
+
+        def writing_function():
+            x[10:20] = 1.0
+            x[30:35] = np.nan
+            x[[1, 2]] = [np.nan, 0]
+
+        writing_function()
+        self.assertEqual(self.hits, [("writing_function", slice(30, 35), 5), ("writing_function", [1, 2], 2)])
+
+        # the data is shared with the original array
+        base = np.zeros(5)
+        y = arrays.watch_array(base, action=self.record)
+        y[0] = 3
+        self.assertEqual(base[0], 3)
+
+    def test_non_float_dtypes(self):
+        for condition in (arrays.has_nan, arrays.has_nonfinite):
+            x = arrays.watch_array(np.array([None, "a", 1.0], dtype=object), condition=condition, action=self.record)
+            x[0] = "b"
+            x[1:] = [np.nan, np.inf]
+            self.assertEqual(x[0], "b")
+
+            d = arrays.watch_array(np.zeros(3, dtype="datetime64[s]"), condition=condition, action=self.record)
+            d[1] = np.datetime64("2026-01-01")
+
+        self.assertEqual(self.hits, [])
+        self.assertTrue(arrays.has_nan(np.array([1.0, np.nan])))
+        self.assertTrue(arrays.has_nonfinite(np.array([1j, np.inf])))
+        self.assertFalse(arrays.has_nan(np.arange(3)))
+
+    def test_inplace_ufuncs(self):
+        cond = arrays.out_of_bounds(upper=10)
+        x = arrays.watch_array(np.arange(100.0), condition=cond, action=self.record)
+
+        x[:5] += 1
+        self.assertEqual(self.hits, [])
+
+        x[:5] += 10
+        # only the view is checked (no additional check in the write back)
+        self.assertEqual(self.hits, [("test_inplace_ufuncs", "add", 5)])
+
+        self.hits.clear()
+        np.multiply(x, 0, out=x)
+        self.assertEqual(self.hits, [])
+
+        np.add.at(x, [3, 4], 20)
+        self.assertEqual(self.hits, [("test_inplace_ufuncs", "add.at", 2)])
+
+        # results of non-inplace operations are not watched
+        y = x + 1
+        self.assertNotIsInstance(y, arrays.WatchedArray)
+        self.assertIsInstance(x[2:], arrays.WatchedArray)
+
+        self.hits.clear()
+        x.fill(-1)
+        self.assertEqual(self.hits, [])
+        x.fill(11)
+        self.assertEqual(self.hits, [("test_inplace_ufuncs", "fill", 100)])
+
+
+if __name__ == "__main__":
+    unittest.main()
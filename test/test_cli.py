@@ -0,0 +1,88 @@
+import contextlib
+import io
+import unittest
+
+from ipydex import cli
+
+try:
+    from jupyter_client.manager import start_new_kernel
+except ImportError:
+    start_new_kernel = None
+
+
+class TestCatchSnippets(unittest.TestCase):
+
+    def test_make_snippet(self):
+        self.assertEqual(cli.make_snippet(function="failing_function"), "failing_function()")
+        self.assertIn("importlib.import_module('a.b').func()", cli.make_snippet(function="a.b:func"))
+        self.assertIn("run_module('a.b'", cli.make_snippet(module="a.b"))
+        code = cli.wrap_snippet("x = 1\ny = 2")
+        self.assertIn("try:\n    x = 1\n    y = 2\nexcept Exception as ex:", code)
+        compile(code, "<test>", "exec")
+
+        # the lines of multi-line strings are not re-indented
+        snippet = "\n".join([
+            '    text = """first',
+            '      second',
+            'third"""',
+            '    value = f"""{text}',
+            'fourth"""',
+        ])
+        for excepthook in (True, False):
+            ns = {}
+            exec(cli.wrap_snippet(snippet, excepthook=excepthook), ns)
+            self.assertEqual(ns["text"], "first\n      second\nthird")
+            self.assertEqual(ns["value"], "first\n      second\nthird\nfourth")
+
+
+@unittest.skipIf(start_new_kernel is None, "jupyter_client is not available")
+class TestRunInKernel(unittest.TestCase):
+
+    def setUp(self):
+        self.km, client = start_new_kernel()
+        client.stop_channels()
+
+    def tearDown(self):
+        cli.close_kernel_clients()
+        self.km.shutdown_kernel(now=True)
+
+    def test_run_in_kernel(self):
+        connection = self.km.connection_file
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            replies = cli.run_in_kernel(["a = 21", "print(a * 2)", "print('second')"], connection=connection)
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(replies[0]["status"], "ok")
+        self.assertIn("42\nsecond", out.getvalue())
+
+        client = cli.get_kernel_client(connection)
+        with contextlib.redirect_stdout(out):
+            replies = cli.run_in_kernel(["1/0", "print(a)"], connection=connection, excepthook=False, batch=False)
+        # the client is reused
+        self.assertIs(cli.get_kernel_client(connection), client)
+        self.assertEqual([r["status"] for r in replies], ["error", "ok"])
+
+    def test_excepthook_in_kernel(self):
+        connection = self.km.connection_file
+        client = cli.get_kernel_client(connection)
+        prompts = []
+
+        def stdin_hook(msg):
+            # the shell of `ips_excepthook` (running inside the kernel) asks for input
+            prompts.append(msg["content"]["prompt"])
+            client.input("exit" if len(prompts) > 1 else "print('inside ips', __frame.f_code.co_name)")
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            replies = cli.run_in_kernel(
+                "def fail():\n    x = 1\n    1/0\nfail()", connection=connection, stdin_hook=stdin_hook, timeout=60
+            )
+        self.assertEqual(replies[0]["status"], "ok")
+        self.assertEqual(len(prompts), 2)
+        self.assertIn("inside ips fail", out.getvalue())
+        self.assertNotIn("Not entering IPython embedded shell", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import json
+import os
+import socket
+import tempfile
+import time
+import unittest
+
+from ipydex import collector
+
+
+def failing_function(x):
+    y = [x] * 3
+    return y[x]
+
+
+class SlowRepr(object):
+    def __repr__(self):
+        time.sleep(0.05)
+        return "SlowRepr()"
+
+
+def failing_with_slow_locals(n):
+    values = [SlowRepr() for i in range(n)]
+    return values[n]
+
+
+class TestCollector(unittest.TestCase):
+
+    def test_snapshots(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            if hasattr(socket, "AF_UNIX"):
+                address = "unix:" + os.path.join(tmpdir, "collector.sock")
+            else:
+                address = "tcp:127.0.0.1:0"
+            db_fname = os.path.join(tmpdir, "snapshots.jsonl")
+
+            with collector.CollectorServer(address, fname=db_fname) as server:
+                for x in (5, 7):
+                    try:
+                        failing_function(x)
+                    except IndexError:
+                        self.assertTrue(collector.send_exception(address=server.address, timeout=2))
+                try:
+                    {}["key"]
+                except KeyError:
+                    self.assertTrue(collector.send_exception(address=server.address, timeout=2))
+
+                entries = collector.list_snapshots(server.address, print_res=False)
+                self.assertEqual(sorted(e["count"] for e in entries), [1, 2])
+
+                fp = [e["fingerprint"] for e in entries if e["count"] == 2][0]
+                snapshot = collector.get_snapshot(fp[:8], server.address)
+                self.assertEqual(snapshot["exc_type"], "builtins.IndexError")
+                self.assertEqual(snapshot["frames"][-1]["function"], "failing_function")
+                self.assertIn("failing_function", snapshot["tb_txt"])
+
+                ns = collector.snapshot_namespace(snapshot)
+                self.assertEqual(ns["x"], "5")
+                self.assertEqual(ns["y"], "[5, 5, 5]")
+
+            # the full snapshot is persisted once per fingerprint
+            with open(db_fname) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), 3)
+            self.assertEqual(sum("frames" in record for record in records), 2)
+
+            # reload from the persistence file
+            store = collector.SnapshotStore(fname=db_fname)
+            self.assertEqual(sorted(e["count"] for e in store.summary()), [1, 2])
+            self.assertEqual(sorted(len(e["sources"]) for e in store.summary()), [1, 1])
+
+    def test_bounded_client(self):
+        try:
+            failing_function(10)
+        except IndexError as ex:
+            snapshot = collector.make_snapshot(type(ex), ex, ex.__traceback__, max_repr=20)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # nobody is listening
+            t0 = time.time()
+            res = collector.send_snapshot(snapshot, "unix:" + os.path.join(tmpdir, "nothing.sock"), timeout=0.5)
+            self.assertFalse(res)
+            self.assertLess(time.time() - t0, 1)
+
+        # server which accepts the connection but never answers
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            sock.listen()
+            t0 = time.time()
+            res = collector.send_snapshot(snapshot, "tcp:127.0.0.1:{}".format(sock.getsockname()[1]), timeout=0.3)
+            self.assertFalse(res)
+            self.assertLess(time.time() - t0, 1)
+
+    def test_snapshot_time_budget(self):
+        try:
+            failing_with_slow_locals(20)
+        except IndexError as ex:
+            t0 = time.time()
+            snapshot = collector.make_snapshot(type(ex), ex, ex.__traceback__, time_budget=0.12)
+            self.assertLess(time.time() - t0, 0.5)
+
+        local_reprs = snapshot["frames"][-1]["locals"]
+        self.assertEqual(local_reprs["n"], "20")
+        self.assertEqual(local_reprs["values"].count("SlowRepr()"), 3)
+        self.assertIn("<repr skipped: time budget", local_reprs["values"])
+        self.assertGreater(snapshot["n_skipped_reprs"], 0)
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "requires unix sockets")
+    def test_existing_socket(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "collector.sock")
+            address = "unix:" + path
+
+            with collector.CollectorServer(address):
+                # the socket of a running collector is not removed
+                with self.assertRaises(RuntimeError):
+                    collector.CollectorServer(address)
+                self.assertEqual(collector.list_snapshots(address, print_res=False), [])
+
+            # stale socket (nobody is listening)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.bind(path)
+            with collector.CollectorServer(address):
+                self.assertEqual(collector.list_snapshots(address, print_res=False), [])
+
+            with open(path, "w") as f:
+                f.write("no socket")
+            with self.assertRaises(RuntimeError):
+                collector.CollectorServer(address)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,7 @@
+import os
+import re
+import sys
+import tempfile
 import unittest
 
 import ipydex as ipd
@@ -92,9 +96,10 @@ class TestCore1(unittest.TestCase):
     def test_container3(self):
         C1 = ipd.Container(a=1.25, xaz=(42,), s="test", d={"a": 1, 2: "b"})
 
-        fname = "container.pcl"
-        C1.save_with_pickle(fname)
-        C2 = ipd.Container.load_with_pickle(fname)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "container.pcl")
+            C1.save_with_pickle(fname)
+            C2 = ipd.Container.load_with_pickle(fname)
 
         C2.publish_attrs()
 
@@ -113,9 +118,93 @@ class TestCore1(unittest.TestCase):
         self.assertNotEqual(C1, C3)
         self.assertNotEqual(C1, C4)
 
+    def test_container_fetch_policies(self):
+
+        class A:
+            pass
+
+        a_obj = A()
+        big_list = list(range(100000))
+        small_str = "abc"
+
+        C1 = ipd.Container(fetch_locals="weak")
+        self.assertIs(C1.a_obj(), a_obj)
+        self.assertEqual(C1.small_str, small_str)
+        self.assertIsInstance(C1.big_list, ipd.SnapshotRepr)
+
+        C2 = ipd.Container()
+        C2.fetch_locals(policy="copy", max_nbytes=10**7)
+        self.assertEqual(C2.big_list, big_list)
+        self.assertIsNot(C2.big_list, big_list)
+
+        C3 = ipd.Container()
+        C3.fetch_locals(policy="repr", include="big_*, small_str")
+        self.assertEqual(set(k for k, v in C3.item_list()), {"big_list", "small_str"})
+        self.assertTrue(C3.big_list.startswith("[0, 1, 2"))
+
+        C4 = ipd.Container()
+        C4.fetch_locals(exclude=["big_list", "C*"])
+        self.assertIs(C4.a_obj, a_obj)
+        self.assertFalse(hasattr(C4, "big_list"))
+        self.assertFalse(hasattr(C4, "C1"))
+
+        report = ipd.Container(cargs=(big_list, small_str)).memory_report(print_res=False)
+        self.assertEqual(report[0][0], "big_list")
+        self.assertGreater(report[0][1], 80000)
+
+        with self.assertRaises(ValueError):
+            ipd.Container(fetch_locals="unknown_policy")
+
+    def test_container_shared_memory(self):
+        try:
+            import numpy as np
+        except ImportError:
+            self.skipTest("numpy not available")
+
+        x = np.arange(1000, dtype=float)
+        y2 = "small value"
+        C1 = ipd.Container(cargs=(x, y2), z=np.ones(3))
+
+        with C1.to_shared_memory() as block1:
+            block2 = ipd.Container.from_shared_memory(block1.name)
+            C2 = block2.container
+
+            self.assertEqual(block1.array_names, ["x"])
+            self.assertEqual(C2.y2, y2)
+            self.assertTrue(np.all(C2.z == C1.z))
+            self.assertTrue(np.all(C2.x == x))
+            self.assertEqual([k for k, v in C2.item_list()][:2], ["x", "y2"])
+            self.assertFalse(C2.x.flags.writeable)
+
+            # changes made via a writable view are visible in the other view (no copy)
+            block3 = ipd.Container.from_shared_memory(block1.name, readonly=False)
+            block3.container.x[0] = -1.0
+            self.assertEqual(C2.x[0], -1.0)
+
+            block3.close()
+            block2.close()
+            self.assertFalse(hasattr(C2, "x"))
+
+    def test_approx_nbytes(self):
+        try:
+            import numpy as np
+        except ImportError:
+            self.skipTest("numpy not available")
+
+        x = np.zeros(10**5)
+        header = sys.getsizeof(np.zeros(0))
+        self.assertEqual(ipd.approx_nbytes(x), header + x.nbytes)
+        # a view counts its header and the viewed data
+        self.assertEqual(ipd.approx_nbytes(x[:10]), sys.getsizeof(x[:10]) + 80)
+
     def test_in_ipynb(self):
         self.assertFalse(ipd.in_ipynb())
 
+        env = ipd.get_environment()
+        self.assertFalse(env.zmq_kernel)
+        self.assertIs(ipd.get_environment(), env)
+        self.assertIsNot(ipd.get_environment(refresh=True), env)
+
 
 class TestCore2(unittest.TestCase):
 
@@ -141,6 +230,68 @@ class TestCore2(unittest.TestCase):
         self.assertFalse("foobar_xyz" in res2.tb_txt)
         self.assertTrue("foobar_123" in res2.tb_txt)
 
+    def test_stack_summary(self):
+        def foobar_xyz():
+            return foobar_abc()
+
+        def foobar_abc():
+            x = 1
+            return ipd.calling_stack_info(
+                print_res=False, structured=True, fields=("function", "lineno", "code_context", "index", "locals"),
+                limit=2, code_context=3,
+            )
+
+        res = foobar_xyz()
+        self.assertEqual([s["function"] for s in res], ["foobar_xyz", "foobar_abc"])
+        self.assertEqual(set(res[0]), {"function", "lineno", "code_context", "index", "locals"})
+        self.assertEqual(res[1]["locals"]["x"], 1)
+        self.assertEqual(res[1]["index"], 1)
+        self.assertIn("calling_stack_info", res[1]["code_context"][1])
+        self.assertNotIn("\x1b", "".join(res[1]["code_context"]))
+
+        with self.assertRaises(ValueError):
+            ipd.stack_summary(fields=("filename", "colors"))
+
+        try:
+            foobar_zero = 0
+            1 / foobar_zero
+        except ZeroDivisionError as ex:
+            res = ipd.traceback_summary(ex, fields=ipd.FRAME_SUMMARY_FIELDS, code_context=1)
+
+        self.assertEqual(len(res), 1)
+        self.assertEqual(res[0]["qualname"], "TestCore2.test_stack_summary")
+        self.assertEqual(res[0]["module"], __name__)
+        self.assertEqual(res[0]["code_context"], ["            1 / foobar_zero\n"])
+        self.assertIn("-->             1 / foobar_zero", ipd.render_frame_summaries(res))
+
+    def test_async_stack_info(self):
+        import asyncio
+
+        async def inner_waiter(event):
+            await event.wait()
+
+        async def outer_waiter(event):
+            await inner_waiter(event)
+
+        async def main():
+            event = asyncio.Event()
+            tasks = [asyncio.create_task(outer_waiter(event), name="worker-{}".format(i)) for i in range(5)]
+            await asyncio.sleep(0)
+
+            res = ipd.async_stack_info(task_filter="worker-*", limit=2, print_res=False, code_context=0)
+            event.set()
+            await asyncio.gather(*tasks)
+            return res
+
+        res = asyncio.run(main())
+
+        self.assertEqual(len(res.tasks), 5)
+        self.assertEqual(len(res.frame_lists), 2)
+        self.assertEqual([f.f_code.co_name for f in res.frame_lists[0][:2]], ["outer_waiter", "inner_waiter"])
+        self.assertIn("=== Task worker-0", res.tb_txt)
+        self.assertIn("inner_waiter", res.tb_txt)
+        self.assertIn("6 pending tasks, 5 selected, 2 rendered", res.tb_txt)
+
 
 class TestCore3(unittest.TestCase):
 
@@ -186,6 +337,337 @@ class TestCore4(unittest.TestCase):
             frame, code_context, add_context_for_latest, limit_to=limit_to
         )
 
+    def test_find_repeated_blocks(self):
+        keys = list("ab") + list("cd") * 10 + list("c") + list("e") * 3 + list("fgf")
+        self.assertEqual(ipd.find_repeated_blocks(keys), [(2, 2, 10), (23, 1, 3)])
+        self.assertEqual(ipd.find_repeated_blocks(keys, min_repeats=11), [])
+
+    def test_collapsed_traceback(self):
+
+        def ping(n):
+            return pong(n)
+
+        def pong(n):
+            return ping(n + 1)
+
+        try:
+            ping(0)
+        except RecursionError as ex:
+            exc = ex
+
+        tb_printer = ipd.core.TBPrinter(type(exc), exc, exc.__traceback__)
+        collapsed = tb_printer.collapsed
+        self.assertEqual(collapsed.markers.keys(), {1})
+        self.assertEqual(len(collapsed.entries), 3)
+        self.assertGreater(collapsed.n_hidden, 100)
+
+        # the innermost frame is the frame where the exception occurred (which is opened by `ips_excepthook`)
+        innermost = exc.__traceback__
+        while innermost.tb_next is not None:
+            innermost = innermost.tb_next
+        self.assertIs(collapsed.frames[-1], innermost.tb_frame)
+
+        txt = tb_printer.get_tb_txt()
+        self.assertIn("frames hidden: the following 2 frame(s) were repeated", txt)
+        self.assertLess(txt.count("return ping(n + 1)"), 3)
+
+        # `end_offset` (i.e. `__mu`) refers to the collapsed frame list
+        txt = re.sub("\x1b\\[[0-9;]*m", "", tb_printer.get_tb_txt(end_offset=2))
+        self.assertNotIn("frames hidden", txt)
+        self.assertIn("ping(0)", txt)
+        self.assertNotIn("return pong(n)", txt)
+
+    def test_safe_repr(self):
+        from unittest import mock
+        from IPython.core import ultratb
+
+        orig_eqrepr = ultratb.eqrepr
+        # state of the ultratb module while a repr is called
+        module_unchanged = []
+
+        # every slow repr takes 1 s of a fake clock
+        now = [0.0]
+
+        class SlowRepr:
+            def __repr__(self):
+                module_unchanged.append(ultratb.eqrepr is orig_eqrepr and "repr" not in vars(ultratb))
+                now[0] += 1
+                return "SlowRepr()"
+
+        class LazyQuery:
+            shape = (10**6, 3)
+
+            def __repr__(self):
+                raise AssertionError("must not be called")
+
+        lazy_query_name = "{}.{}".format(LazyQuery.__module__, LazyQuery.__qualname__)
+        safe_repr = ipd.SafeRepr(max_len=60, skip_types={lazy_query_name})
+        self.assertEqual(safe_repr([list(range(10**5))]), "[[0, 1, 2, 3, 4, 5, ...]]")
+        self.assertEqual(len(safe_repr("x" * 10**5)), 60)
+        self.assertEqual(safe_repr({"q": LazyQuery()}), "{'q': <LazyQuery shape=(1000000, 3) (repr skipped)>}")
+
+        # the deadline is also checked for the elements of containers
+        budget_repr = ipd.SafeRepr(max_len=200, time_budget=1.5)
+        budget_repr.clock = lambda: now[0]
+        budget_repr.start()
+        res = budget_repr([SlowRepr(), SlowRepr(), SlowRepr()])
+        self.assertTrue(res.startswith("[SlowRepr(), SlowRepr(), <repr skipped: time budget"), res)
+        self.assertEqual(budget_repr.n_skipped, 1)
+
+        def failing(a, s1, s2, s3):
+            query = LazyQuery()
+            big = list(range(10**5))
+            return a + s1 + s2 + s3 + query + big
+
+        try:
+            failing(1, SlowRepr(), SlowRepr(), SlowRepr())
+        except TypeError as ex:
+            exc = ex
+
+        config = ipd.module_config
+        orig = config.SAFE_REPR_TIME_BUDGET, config.SAFE_REPR_SKIP_TYPES
+        config.SAFE_REPR_TIME_BUDGET = 1.5
+        config.SAFE_REPR_SKIP_TYPES = orig[1] | {lazy_query_name}
+        try:
+            tb = ipd.core.CollapsingFormattedTB(mode="Verbose", theme_name="nocolor")
+            with mock.patch.object(ipd.SafeRepr, "clock", staticmethod(lambda: now[0])):
+                txt = tb.text(type(exc), exc, exc.__traceback__)
+        finally:
+            config.SAFE_REPR_TIME_BUDGET, config.SAFE_REPR_SKIP_TYPES = orig
+
+        self.assertIn("s1=SlowRepr(), s2=SlowRepr(), s3=<repr skipped: time budget", txt)
+        self.assertIn("a=1", txt)
+        self.assertIn("reprs skipped because the time budget", txt)
+        self.assertNotIn("must not be called", txt)
+        # the reprs are replaced for the instance only (the module of ultratb is not patched)
+        self.assertTrue(module_unchanged)
+        self.assertTrue(all(module_unchanged))
+
+
+class TestWatchpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.hits = []
+
+    def record(self, frame, obj, name, value):
+        self.hits.append((frame.f_code.co_name, name, value))
+
+    def test_watchpoints(self):
+        import dataclasses
+
+        @ipd.watchpoints("x", action=self.record, y=lambda obj, value: value < 0)
+        @dataclasses.dataclass
+        class A:
+            x: int = 1
+            y: int = 2
+            z: int = 3
+
+        def writing_function(a):
+            a.x = 10
+            a.y = 5
+            a.y = -5
+            a.z = 7
+
+        a = A()
+        self.assertEqual((a.x, a.y, a.z), (1, 2, 3))
+        self.hits.clear()
+        writing_function(a)
+        self.assertEqual(self.hits, [("writing_function", "x", 10), ("writing_function", "y", -5)])
+        self.assertEqual((a.x, a.y, a.z), (10, -5, 7))
+
+        # unwatched attributes are untouched
+        self.assertNotIsInstance(A.__dict__["z"], ipd.WatchedAttribute)
+
+        ipd.remove_watchpoints(A)
+        self.assertEqual(A.__dict__["x"], 1)
+        self.hits.clear()
+        a.x = 20
+        self.assertEqual(self.hits, [])
+        self.assertEqual(a.x, 20)
+
+    def test_watchpoints_slots(self):
+
+        class B:
+            __slots__ = ("u", "v")
+
+            def __init__(self):
+                self.u = 0
+                self.v = 0
+
+        slot_u = B.__dict__["u"]
+        ipd.add_watchpoints(B, "u", action=self.record, condition=lambda obj, value: value > 1)
+        b = B()
+        b.u = 1
+        b.u = 2
+        b.v = 3
+        self.assertEqual(self.hits, [("test_watchpoints_slots", "u", 2)])
+        self.assertEqual((b.u, b.v), (2, 3))
+        del b.u
+        self.assertRaises(AttributeError, getattr, b, "u")
+
+        ipd.remove_watchpoints(B, "u")
+        self.assertIs(B.__dict__["u"], slot_u)
+
+
+class TestSurveiledDict(unittest.TestCase):
+
+    def test_surveiled_dict(self):
+        d = ipd.SurveiledDict(a=1, b=2, x_1=3)
+        d.surveil(
+            keys=["a"], patterns="x_*", key_conditions={"b": lambda d, key, value: value is d.DELETED}, record=4
+        )
+
+        def writing_function():
+            d["a"] = 10
+            d["c"] = 10
+            d.setdefault("x_2", 0)
+            d.setdefault("x_2", 5)
+            d["b"] = 20
+
+        writing_function()
+        self.assertEqual([(v.method, v.key, v.value) for v in d.violations], [
+            ("__setitem__", "a", 10), ("setdefault", "x_2", 0)
+        ])
+        self.assertEqual(d.violations[0].function, "writing_function")
+
+        d.violations.clear()
+        d.update({"c": 1, "x_3": 2}, a=3)
+        d |= {"c": 5}
+        self.assertEqual({(v.method, v.key) for v in d.violations}, {("update", "x_3"), ("update", "a")})
+
+        d.violations.clear()
+        d.pop("b")
+        d.pop("c")
+        del d["a"]
+        self.assertEqual([(v.method, v.key) for v in d.violations], [("pop", "b"), ("__delitem__", "a")])
+
+        # the ring buffer keeps only the last 4 violations
+        d.update((("x_{}".format(i), i) for i in range(10)))
+        self.assertEqual(len(d.violations), 4)
+
+        # the batch condition is called once per bulk update
+        calls = []
+
+        def batch_condition(d, items):
+            calls.append(items)
+            return [(k, v) for k, v in items if v is d.DELETED or v < 0]
+
+        d2 = ipd.SurveiledDict().surveil(batch_condition=batch_condition, record=10)
+        d2.update({"p": 1, "q": -1, "r": -2})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([(v.key, v.value) for v in d2.violations], [("q", -1), ("r", -2)])
+        d2.clear()
+        self.assertEqual(len(d2.violations), 5)
+        self.assertEqual(d2.violations[-1].value, d2.DELETED)
+
+
+class TestNotebook(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import requests
+        except ImportError:
+            self.skipTest("requests not available")
+
+        import json
+        import socket
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.requested_paths = requested_paths = []
+        session = {"id": "s1", "kernel": {"id": "k1"}, "notebook": {"path": "sub/nb.ipynb"}}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                requested_paths.append(path)
+                data = {"/api/sessions": [session], "/api/sessions/s1": session}.get(path)
+                if data is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps(data).encode("utf8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+        # a server which accepts connections but never answers
+        self.dead_socket = socket.socket()
+        self.dead_socket.bind(("127.0.0.1", 0))
+        self.dead_socket.listen(5)
+
+        self.servers = [
+            {"url": "http://127.0.0.1:{}/".format(self.dead_socket.getsockname()[1]), "root_dir": "/dead"},
+            {"url": "http://127.0.0.1:{}/".format(self.httpd.server_address[1]), "root_dir": "/nbroot"},
+        ]
+        ipd.core._notebook_name_cache.clear()
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.dead_socket.close()
+        ipd.core._notebook_name_cache.clear()
+
+    def test_get_notebook_name(self):
+        import time
+
+        t0 = time.time()
+        res = ipd.get_notebook_name(kernel_id="k1", servers=self.servers, timeout=5)
+        self.assertEqual(res, "/nbroot/sub/nb.ipynb")
+
+        # the dead server must not delay the result
+        self.assertLess(time.time() - t0, 4)
+        self.assertEqual(self.requested_paths, ["/api/sessions"])
+
+        # second call: cheap re-validation of the cached session
+        res = ipd.get_notebook_name(kernel_id="k1", servers=self.servers, timeout=5)
+        self.assertEqual(res, "/nbroot/sub/nb.ipynb")
+        self.assertEqual(self.requested_paths, ["/api/sessions", "/api/sessions/s1"])
+
+        with self.assertRaises(ValueError):
+            ipd.get_notebook_name(kernel_id="unknown", servers=self.servers[:1], timeout=0.2)
+
+
+class TestNotebookExport(unittest.TestCase):
+
+    def test_export_notebook_to_html(self):
+        try:
+            import nbformat
+            import nbconvert
+        except ImportError:
+            self.skipTest("nbconvert not available")
+
+        import os
+        import tempfile
+
+        nb = nbformat.v4.new_notebook(cells=[nbformat.v4.new_code_cell("x_unique_name = 1 + 1")])
+        wd = os.getcwd()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nb_path = os.path.join(tmpdir, "test_nb.ipynb")
+            nbformat.write(nb, nb_path)
+
+            res1 = ipd.export_notebook_to_html(nb_path)
+            self.assertEqual(res1.method, "in-process")
+            self.assertEqual(res1.fname, os.path.join(tmpdir, "test_nb.html"))
+            with open(res1.fname) as htmlfile:
+                self.assertIn("x_unique_name", htmlfile.read())
+
+            # the exporter is reused and relative target paths refer to the notebook directory
+            res2 = ipd.export_notebook_to_html(nb_path, html_path="other.html")
+            self.assertTrue(os.path.isfile(os.path.join(tmpdir, "other.html")))
+            self.assertEqual(len(ipd.core._html_exporter_cache), 1)
+
+        self.assertEqual(os.getcwd(), wd)
+
 
 class TestUtils(unittest.TestCase):
 
@@ -197,6 +679,57 @@ class TestUtils(unittest.TestCase):
         self.assertTrue(ipydex.utils.regex_a_in_b(a1, b))
         self.assertFalse(ipydex.utils.regex_a_in_b(a2, b))
 
+    def test_compare_strings(self):
+        u = ipydex.utils
+        a = "abcdefghij" * 100000
+        b = list(a)
+        b[12345] = "#"
+        b[12346] = "#"
+        b[500001] = "#"
+        b = "".join(b)
+
+        self.assertEqual(u.find_first_difference(a, a), None)
+        self.assertEqual(u.find_first_difference(a, b, chunk_size=1000), 12345)
+        self.assertEqual(u.find_first_difference(a, a + "x"), len(a))
+        self.assertEqual(u.find_differences(a, b), [(12345, 12347), (500001, 500002)])
+        self.assertEqual(u.find_differences(a, b, max_regions=1), [(12345, 12347)])
+
+        a = "first line\nsecond line\nthird line"
+        b = "first line\nsecond lime\nthird line!"
+        res = u.compare_strings(a, b, n=5, lines=True, max_regions=5, print_res=False)
+        self.assertEqual([(r.line, r.col) for r in res], [(2, 10), (3, 11)])
+        self.assertEqual(u.compare_strings(a, a, print_res=False), [])
+
+        res = u.benchmark_compare_strings(nbytes=10**5, repeat=1, naive=False, print_res=False)
+        self.assertIn("find_first_difference", res)
+
+    def test_run_command(self):
+        import sys
+        u = ipydex.utils
+
+        script = "import sys; print('x' * 1000); print('ä-line'); print(input()); sys.stderr.write('err'); sys.exit(3)"
+        lines = []
+        res = u.run_command([sys.executable, "-c", script], _input="abc\n", on_stdout=lines.append, max_capture=20)
+        self.assertEqual(res.returncode, 3)
+        self.assertEqual(res.stdout, "x\nä-line\nabc\n"[-20:].rjust(20, "x"))
+        self.assertEqual(res.stdout_dropped, 1000 + 1 + 7 + 4 - 20)
+        self.assertEqual(res.stderr, "err")
+        self.assertEqual(lines[1:], ["ä-line", "abc"])
+        self.assertFalse(res.timed_out)
+
+        out, err = u.get_out_and_err_of_command([sys.executable, "-c", "print(1)"])
+        self.assertEqual((out.strip(), err), ("1", ""))
+
+        res = u.run_command([sys.executable, "-c", "import time; time.sleep(10)"], timeout=0.2)
+        self.assertTrue(res.timed_out)
+        self.assertLess(res.duration, 5)
+
+        cmds = [[sys.executable, "-c", "import time; time.sleep(0.5); print({})".format(i)] for i in range(4)]
+        results = u.run_commands(cmds, max_workers=4)
+        self.assertEqual([r.stdout.strip() for r in results], ["0", "1", "2", "3"])
+        # concurrent execution
+        self.assertLess(max(r.start_time for r in results) - min(r.start_time for r in results), 0.4)
+
 
 def f1(*args1, **kwargs1):
     """
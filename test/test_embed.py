@@ -42,6 +42,38 @@ print('bye!')
 
 """
 
+_sample_embed_ips_nav = b'''
+from ipydex import activate_ips_on_exception
+activate_ips_on_exception(theme_name="nocolor")
+
+
+def inner():
+    only_inner = 1
+    1/0
+
+
+def outer():
+    only_outer = 2
+    inner()
+
+
+outer()
+'''
+
+_sample_embed_autorestore = b"""
+import sys
+
+import ipydex
+from ipydex import IPS, storedb
+
+db = storedb.SQLiteStoreDB(sys.argv[1])
+db["autorestore/stored_x"] = 42
+db.close()
+
+ipydex.module_config.STORE_DB_PATH = sys.argv[1]
+IPS(theme_name="nocolor", store_backend="sqlite")
+"""
+
 _sample_embed_ips2 = b'''
 import sys
 
@@ -120,6 +152,24 @@ y = 20
 
 '''
 
+# repeatedly catch an exception in a function with a large local variable
+_sample_catch_exception_leak = b'''
+import gc
+import tracemalloc
+import ipydex
+
+def f1():
+    data = bytearray(20*10**6)
+    1/0
+
+gc.disable()
+tracemalloc.start()
+base = tracemalloc.get_traced_memory()[0]
+for i in range(3):
+    ipydex.catch_exception(f1)
+print("retained_bytes:", tracemalloc.get_traced_memory()[0] - base)
+'''
+
 
 def write_string_to_file_script(bytearr, fname="tmp.py"):
     """
@@ -324,6 +374,112 @@ class TestE1(unittest.TestCase):
             out_a = ipy_io(p, fname, "print('z =', z)\n")
             self.assertIn(b"z = 789", out_a)
 
+    def test_excepthook_navigation(self):
+        with NamedFileInTemporaryDirectory("file_with_embed.py", "wb") as f:
+            f.write(_sample_embed_ips2)
+            f.flush()
+            f.close()  # otherwise msft won't be able to read the file
+
+            fname = f.name
+
+            env = os.environ.copy()
+            env["IPY_TEST_SIMPLE_PROMPT"] = "1"
+
+            # exception in f1 (x == 3.5)
+            p = PopenSpawn(f"{sys.executable} {fname} 1.5", env=env)
+            p.expect(ipy_prompt)
+
+            out_a = ipy_io(p, fname, "zz = 123\n")
+            out_a = ipy_io(p, fname, "%up\n")
+            self.assertIn(b"frame 1 of 5", out_a)
+            self.assertIn(b"f1(x+1)", out_a)
+
+            out_a = ipy_io(p, fname, "print('name, x =', name, x)\n")
+            self.assertIn(b"name, x = f2 2.5", out_a)
+
+            out_a = ipy_io(p, fname, "%up 3\n")
+            self.assertIn(b"frame 4 of 5", out_a)
+            out_a = ipy_io(p, fname, "print('a, b =', a, b)\n")
+            self.assertIn(b"a, b = 1 [1, 3]", out_a)
+
+            out_a = ipy_io(p, fname, "%frame 0\n")
+            out_a = ipy_io(p, fname, "print('zz, x =', zz, x)\n")
+            self.assertIn(b"zz, x = 123 3.5", out_a)
+
+            out_a = ipy_io(p, fname, "%down\n")
+            self.assertIn(b"out of range", out_a)
+
+            # `__mu` is relative to the current frame
+            ipy_io(p, fname, "%up\n")
+            ipy_io(p, fname, "__mu = 1\n")
+            ipy_io(p, fname, "exit()\n")
+            out_a = ipy_io(p, fname, "print('name, x =', name, x)\n")
+            self.assertIn(b"name, x = f1 2.5", out_a)
+
+    def test_excepthook_navigation_namespaces(self):
+        with NamedFileInTemporaryDirectory("file_with_embed.py", "wb") as f:
+            f.write(_sample_embed_ips_nav)
+            f.flush()
+            f.close()  # otherwise msft won't be able to read the file
+
+            fname = f.name
+
+            env = os.environ.copy()
+            env["IPY_TEST_SIMPLE_PROMPT"] = "1"
+
+            p = PopenSpawn(f"{sys.executable} {fname}", env=env)
+            p.expect(ipy_prompt)
+
+            names = ("only_inner", "only_outer", "shell_inner", "shell_outer")
+            cmd = "print('vars:', {})\n".format(", ".join("'{}' in locals()".format(name) for name in names))
+
+            ipy_io(p, fname, "shell_inner = 1\n")
+            ipy_io(p, fname, "%up\n")
+            ipy_io(p, fname, "shell_outer = 2\n")
+            out_a = ipy_io(p, fname, cmd)
+            self.assertIn(b"vars: False True False True", out_a)
+            ipy_io(p, fname, "__mu = 0\n")
+            ipy_io(p, fname, "exit()\n")
+
+            # the shell is relaunched in the frame which was active when it was closed (`outer`)
+            out_a = ipy_io(p, fname, cmd)
+            self.assertIn(b"vars: False True False True", out_a)
+
+            ipy_io(p, fname, "__mu = -1\n")
+            ipy_io(p, fname, "exit()\n")
+            out_a = ipy_io(p, fname, cmd)
+            self.assertIn(b"vars: True False True False", out_a)
+
+    def test_autorestore(self):
+        with NamedFileInTemporaryDirectory("file_with_embed.py", "wb") as f:
+            f.write(_sample_embed_autorestore)
+            f.flush()
+            f.close()  # otherwise msft won't be able to read the file
+
+            tmpdir = os.path.dirname(f.name)
+            ipython_dir = os.path.join(tmpdir, "ipython")
+            cmd = [sys.executable, f.name, os.path.join(tmpdir, "store.sqlite")]
+            check = b"print('restored:', 'stored_x' in dir())\n" + _exit
+            extra_env = {"IPY_TEST_SIMPLE_PROMPT": "1", "IPYTHONDIR": ipython_dir}
+
+            # option unset (IPython's default: no autorestore)
+            std, _, returncode = ipydex.utils.get_out_and_err_of_command(
+                cmd, _input=check, extra_env=extra_env, returncode=True,
+            )
+            self.assertEqual(returncode, 0)
+            self.assertIn("restored: False", std)
+
+            profile_dir = os.path.join(ipython_dir, "profile_default")
+            os.makedirs(profile_dir, exist_ok=True)
+            with open(os.path.join(profile_dir, "ipython_config.py"), "w") as config_file:
+                config_file.write("c.StoreMagics.autorestore = True\n")
+
+            std, _, returncode = ipydex.utils.get_out_and_err_of_command(
+                cmd, _input=check, extra_env=extra_env, returncode=True,
+            )
+            self.assertEqual(returncode, 0)
+            self.assertIn("restored: True", std)
+
     def test_ipython_embed3(self):
         with NamedFileInTemporaryDirectory("file_with_embed.py", "wb") as f:
             f.write(_sample_embed_ips3)
@@ -380,6 +536,24 @@ class TestE1(unittest.TestCase):
             self.assertTrue(out_a.strip().startswith("SUCCESS"))
 
 
+    def test_catch_exception_leak(self):
+        with NamedFileInTemporaryDirectory("file_with_catch.py", "wb") as f:
+            f.write(_sample_catch_exception_leak)
+            f.flush()
+            f.close()  # otherwise msft won't be able to read the file
+
+            cmd = [sys.executable, f.name]
+            std, _, returncode = ipydex.utils.get_out_and_err_of_command(
+                cmd, _input=_exit*3, extra_env={"IPY_TEST_SIMPLE_PROMPT": "1"}, returncode=True,
+            )
+
+        self.assertEqual(returncode, 0)
+        retained_bytes = int(std.split("retained_bytes:")[-1].strip())
+
+        # without releasing the frames (gc is disabled) each call would retain 20 MB
+        self.assertLess(retained_bytes, 10*10**6)
+
+
 # noinspection PyPep8Naming,PyUnresolvedReferences,PyUnusedLocal
 class TestDBG(unittest.TestCase):
 
@@ -0,0 +1,229 @@
+import sys
+import unittest
+
+from ipydex import monitoring
+
+
+THRESHOLD = 10
+
+
+def target_function(x):
+    y = x * 2
+    z = y + 1
+    return z
+
+
+def accumulate(values):
+    total = 0
+    items = []
+    for v in values:
+        total += v
+        items.append(v)
+    raise ValueError(total)
+
+
+def rebind():
+    x = [1, 2]
+    x = None
+    x = 0
+    return x
+
+
+def lookup(d, keys):
+    found = 0
+    for key in keys:
+        try:
+            found += d[key]
+        except KeyError:
+            pass
+    return found
+
+
+def call_lookup(d, keys):
+    try:
+        return lookup(d, keys) + d["missing"]
+    except KeyError:
+        return -1
+
+
+def raise_stored(ex):
+    raise ex
+
+
+@unittest.skipIf(sys.version_info < (3, 12), "sys.monitoring requires python >= 3.12")
+class TestBreakpointManager(unittest.TestCase):
+
+    def test_conditional_breakpoint(self):
+        hits = []
+
+        def action(frame, bp):
+            hits.append(dict(frame.f_locals))
+
+        lineno = target_function.__code__.co_firstlineno + 2
+        with monitoring.BreakpointManager() as bpm:
+            bp = bpm.add(target_function, lineno=lineno, condition="y > 10", action=action)
+
+            for x in range(10):
+                target_function(x)
+
+            self.assertEqual([h["x"] for h in hits], [6, 7, 8, 9])
+            self.assertEqual(hits[0]["y"], 12)
+            self.assertEqual(bp.hits, 4)
+
+            bpm.disable(bp)
+            target_function(100)
+            self.assertEqual(bp.hits, 4)
+
+            bpm.enable(bp)
+            target_function(100)
+            self.assertEqual(bp.hits, 5)
+
+        # after closing the manager the tool id can be used again
+        with monitoring.BreakpointManager() as bpm:
+            entry_bp = bpm.add(target_function, action=action)
+            target_function(-1)
+            self.assertEqual(entry_bp.hits, 1)
+            self.assertEqual(hits[-1], {"x": -1})
+
+    def test_hit_counts(self):
+        hits = []
+
+        def action(frame, bp):
+            hits.append(frame.f_locals["x"])
+
+        lineno = target_function.__code__.co_firstlineno + 2
+        with monitoring.BreakpointManager() as bpm:
+            bp = bpm.add(target_function, lineno=lineno, condition="x % 2", action=action, ignore=3, max_hits=2)
+            for x in range(10):
+                target_function(x)
+
+            # x = 0, 1, 2 are ignored, the condition holds for 3 and 5, afterwards the location is switched off
+            self.assertEqual(hits, [3, 5])
+            self.assertTrue(bp.spent)
+            self.assertEqual(bp.ignore, 0)
+
+    def test_condition_names(self):
+        hits = []
+
+        def action(frame, bp):
+            hits.append((bp.lineno, frame.f_locals["x"]))
+
+        lineno = target_function.__code__.co_firstlineno + 2
+        with monitoring.BreakpointManager() as bpm:
+            # `y` is not yet bound at the entry -> the condition is false (no exception in the monitored code)
+            entry_bp = bpm.add(target_function, condition="y > 0", action=action)
+            # `THRESHOLD` is a global name
+            line_bp = bpm.add(target_function, lineno=lineno, condition="x + y > THRESHOLD", action=action)
+            self.assertEqual(line_bp.condition_names, ("x", "y"))
+
+            for x in range(6):
+                self.assertEqual(target_function(x), 2 * x + 1)
+
+        self.assertEqual(entry_bp.hits, 0)
+        self.assertEqual(hits, [(lineno, 4), (lineno, 5)])
+
+    def test_invalid_line(self):
+        with monitoring.BreakpointManager() as bpm:
+            with self.assertRaises(ValueError):
+                bpm.add(target_function, lineno=1)
+
+    def test_debugger_id_in_use(self):
+        sys.monitoring.use_tool_id(sys.monitoring.DEBUGGER_ID, "other debugger")
+        try:
+            with monitoring.BreakpointManager() as bpm:
+                self.assertIn(bpm.tool_id, (3, 4))
+                bp = bpm.add(target_function, condition="x < 0", action=lambda frame, bp: None)
+                target_function(-1)
+                self.assertEqual(bp.hits, 1)
+        finally:
+            sys.monitoring.free_tool_id(sys.monitoring.DEBUGGER_ID)
+
+
+@unittest.skipIf(sys.version_info < (3, 12), "sys.monitoring requires python >= 3.12")
+class TestExecutionRecorder(unittest.TestCase):
+
+    def test_history(self):
+        recorder = monitoring.ExecutionRecorder(accumulate, maxlen=100)
+        try:
+            with recorder:
+                # not recorded
+                target_function(1)
+                try:
+                    accumulate([3, 4, 5])
+                except ValueError as ex:
+                    tb = ex.__traceback__
+        finally:
+            recorder.close()
+
+        frame = tb.tb_next.tb_frame
+        self.assertEqual(frame.f_code.co_name, "accumulate")
+        first = accumulate.__code__.co_firstlineno
+
+        res = recorder.history("total", frame=frame, print_res=False)
+        self.assertEqual(res, [(first + 1, "0"), (first + 4, "3"), (first + 4, "7"), (first + 4, "12")])
+
+        res = recorder.history("items", frame=frame, n=2, print_res=False)
+        self.assertEqual(res, [(first + 5, "[3, 4]"), (first + 5, "[3, 4, 5]")])
+
+        self.assertEqual(recorder.history("values", frame=frame, print_res=False), [(first, "[3, 4, 5]")])
+        self.assertTrue(all(rec[1] is accumulate.__code__ for rec in recorder.records))
+
+    def test_rebind_to_none(self):
+        with monitoring.ExecutionRecorder(rebind, maxlen=100) as recorder:
+            rebind()
+        recorder.close()
+
+        first = rebind.__code__.co_firstlineno
+        res = recorder.history("x", print_res=False)
+        self.assertEqual(res, [(first + 1, "[1, 2]"), (first + 2, "None"), (first + 3, "0")])
+
+
+@unittest.skipIf(sys.version_info < (3, 12), "sys.monitoring requires python >= 3.12")
+class TestRaiseProfiler(unittest.TestCase):
+
+    def test_raise_sites(self):
+        hits = []
+
+        with monitoring.RaiseProfiler(theme_name="nocolor") as rp:
+            rp.break_at(lookup, nth=3, exc_type=KeyError, action=lambda frame, ex: hits.append(frame.f_locals["key"]))
+            call_lookup({"a": 1}, ["a", "b", "c", "d", "e"])
+            try:
+                accumulate([1])
+            except ValueError:
+                pass
+
+        self.assertEqual(hits, ["d"])
+        first = lookup.__code__.co_firstlineno
+        site = rp.sites[(lookup.__code__, first + 4)]
+        self.assertEqual(site.counts, {KeyError: 4})
+        self.assertIn("found += d[key]", site.context)
+
+        # the propagation through `call_lookup` is not counted as a separate site
+        self.assertEqual(
+            sorted((site.code.co_name, site.total) for site in rp.sites.values()),
+            [("accumulate", 1), ("call_lookup", 1), ("lookup", 4)],
+        )
+        self.assertEqual(rp.per_type(), [(KeyError, 5), (ValueError, 1)])
+        self.assertEqual(rp.top(1), [site])
+
+        txt = rp.render(n=2, print_res=False)
+        self.assertIn("--- 4x: KeyError (4) ---", txt)
+        self.assertNotIn("accumulate", txt.split("--- total")[0])
+
+    def test_reraise_stored_exception(self):
+        ex = KeyError("stored")
+        with monitoring.RaiseProfiler(context=False) as rp:
+            for i in range(3):
+                try:
+                    raise_stored(ex)
+                except KeyError:
+                    pass
+
+        # the stored exception carries the traceback of the previous raise -> every raise is counted at its site
+        self.assertEqual(
+            [(site.code.co_name, site.counts) for site in rp.sites.values()], [("raise_stored", {KeyError: 3})]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import time
+import threading
+import unittest
+
+from ipydex import profiling
+
+
+def busy_function_xyz(duration):
+    t0 = time.time()
+    x = 0
+    while time.time() - t0 < duration:
+        x += 1
+    return x
+
+
+class TestStackSampler(unittest.TestCase):
+
+    def test_sampling(self):
+        with profiling.StackSampler(interval=0.005, threads=[threading.current_thread()]) as sampler:
+            busy_function_xyz(0.2)
+
+        self.assertGreater(sampler.n_samples, 5)
+        self.assertLess(sampler.overhead, 0.5)
+
+        collapsed = sampler.collapsed(include_lineno=False)
+        self.assertTrue(any(stack.endswith("busy_function_xyz:" + __file__) for stack in collapsed))
+        self.assertEqual(sampler.top(1)[0][0][1], "busy_function_xyz")
+
+        txt = sampler.export_collapsed()
+        stack, count = txt.split("\n")[0].rsplit(" ", 1)
+        self.assertTrue(int(count) > 0)
+
+    def test_thread_selection(self):
+        worker = threading.Thread(target=busy_function_xyz, args=(0.2,))
+        worker.start()
+        sampler = profiling.sample_stacks(interval=0.005, threads=[worker])
+        worker.join()
+        sampler.stop()
+
+        self.assertEqual({thread_id for thread_id, stack in sampler.samples}, {worker.ident})
+
+
+if __name__ == "__main__":
+    unittest.main()
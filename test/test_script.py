@@ -0,0 +1,40 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from ipydex import benchmarks, script
+
+
+class TestBench(unittest.TestCase):
+
+    def test_percentiles(self):
+        summary = benchmarks.summarize([float(i) for i in range(100, 0, -1)])
+        self.assertEqual((summary["min"], summary["p50"], summary["p90"], summary["p99"]), (1, 50, 90, 99))
+        self.assertEqual(summary["n"], 100)
+
+    def test_bench_command(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, "bench.json")
+            argv = [
+                "bench", "--quick", "-n", "2", "--only", "insert_disp_lines", "traceback_formatting", "-o", fname
+            ]
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                self.assertEqual(script.main(argv), 0)
+                script.main(argv[:-2] + ["--compare", fname])
+
+            with open(fname) as f:
+                res = json.load(f)
+
+        self.assertEqual(set(res["results"]), {"insert_disp_lines", "traceback_formatting"})
+        self.assertEqual(len(res["results"]["insert_disp_lines"]["samples"]), 2)
+        self.assertEqual(res["params"]["cell_lines"], benchmarks.QUICK_PARAMS["cell_lines"])
+        self.assertIn("ipython", res["meta"])
+        self.assertIn("ratio", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+from ipydex import storedb, Container
+
+
+class TestSQLiteStoreDB(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "store.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_dict_interface(self):
+        db = storedb.SQLiteStoreDB(self.path)
+        db["autorestore/x"] = [1, 2, 3]
+        db["autorestore/y"] = {"a": 1}
+        db["stored_aliases"] = {}
+        db["autorestore/x"] = [1, 2]
+
+        self.assertEqual(db["autorestore/x"], [1, 2])
+        self.assertEqual(db.keys("autorestore/*"), ["autorestore/x", "autorestore/y"])
+        self.assertEqual(len(db), 3)
+        self.assertIn("stored_aliases", db)
+        self.assertEqual(db.get("dhist", []), [])
+        self.assertRaises(KeyError, db.__getitem__, "missing")
+
+        del db["autorestore/y"]
+        self.assertRaises(KeyError, db.__delitem__, "autorestore/y")
+        db.close()
+
+        # persistence
+        db = storedb.SQLiteStoreDB(self.path)
+        self.assertEqual(db.items("autorestore/*"), [("autorestore/x", [1, 2])])
+        db.close()
+
+    def test_migration_and_restore(self):
+        from IPython.external.pickleshare import PickleShareDB
+
+        ps_dir = os.path.join(self.tmpdir.name, "profile", "db")
+        ps = PickleShareDB(ps_dir)
+        ps["autorestore/a"] = 42
+        ps["autorestore/b"] = "text"
+        ps["dhist"] = ["/tmp"]
+
+        db = storedb.SQLiteStoreDB(self.path)
+        self.assertEqual(storedb.import_pickleshare(db, ps_dir), 3)
+
+        shell = Container(db=db, user_ns={})
+        names = storedb.restore_autorestore(shell)
+        self.assertEqual(names, ["a", "b"])
+        self.assertEqual(shell.user_ns, {"a": 42, "b": "text"})
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
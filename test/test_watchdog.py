@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import tempfile
+import threading
+import unittest
+
+from ipydex.watchdog import HangWatchdog, format_thread_stacks
+
+
+def slow_function_xyz(duration):
+    time.sleep(duration)
+
+
+class TestHangWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmpdir.name, "hang.txt")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_deadline_missed(self):
+        wd = HangWatchdog(deadline=0.1, fname=self.fname)
+        with wd:
+            slow_function_xyz(0.5)
+        wd.close()
+
+        self.assertEqual(wd.n_dumps, 1)
+        with open(self.fname) as txtfile:
+            txt = txtfile.read()
+
+        self.assertIn("deadline of 0.1s missed", txt)
+        self.assertIn("[stalled]", txt)
+        self.assertIn("slow_function_xyz", txt)
+
+    def test_heartbeat(self):
+        wd = HangWatchdog(deadline=0.3, fname=self.fname)
+        with wd:
+            for i in range(5):
+                slow_function_xyz(0.1)
+                wd.heartbeat()
+        wd.close()
+
+        self.assertEqual(wd.n_dumps, 0)
+        self.assertFalse(os.path.exists(self.fname))
+
+    def test_format_timeout(self):
+        frames = {threading.get_ident(): sys._getframe()}
+        txt = format_thread_stacks(frames, timeout=0)
+        self.assertIn("raw stack", txt)
+        self.assertIn("test_format_timeout", txt)
+
+    def test_single_formatter_thread(self):
+        from ipydex import watchdog
+
+        orig = watchdog.generate_frame_list_info
+
+        def slow_generate_frame_list_info(*args, **kwargs):
+            time.sleep(0.2)
+            return orig(*args, **kwargs)
+
+        frames = {threading.get_ident(): sys._getframe()}
+        watchdog.generate_frame_list_info = slow_generate_frame_list_info
+        try:
+            for i in range(5):
+                txt = format_thread_stacks(frames, timeout=0.01)
+                self.assertIn("raw stack", txt)
+        finally:
+            watchdog.generate_frame_list_info = orig
+
+        names = [t.name for t in threading.enumerate()]
+        self.assertEqual(names.count("ipydex-stack-formatter"), 1)
+
+        # the (reused) thread formats later stacks again
+        txt = format_thread_stacks(frames, timeout=5)
+        self.assertNotIn("raw stack", txt)
+        self.assertIn("test_single_formatter_thread", txt)
+
+
+if __name__ == "__main__":
+    unittest.main()